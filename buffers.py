@@ -0,0 +1,52 @@
+import io
+import os
+
+
+class BufferReader(io.RawIOBase):
+    """Seekable, read-only file object over an in-memory buffer.
+
+    Reads are served from a memoryview of the original data, so handing an
+    upload to the API client does not copy it. Each reader keeps its own
+    position, which lets retries and hedged requests share one buffer.
+    """
+
+    def __init__(self, data, name):
+        super().__init__()
+        if hasattr(data, "getbuffer"):
+            data = data.getbuffer()
+        self._view = memoryview(data).cast("B")
+        self._pos = 0
+        self.name = name
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._view[self._pos : self._pos + len(buffer)]
+        buffer[: len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def __len__(self):
+        return len(self._view)
+
+
+def buffer_size(data):
+    """Size in bytes of a buffer, bytes object or in-memory file."""
+    if hasattr(data, "getbuffer"):
+        return data.getbuffer().nbytes
+    return memoryview(data).nbytes
@@ -1,62 +1,384 @@
-import io
-from openai import OpenAI
-import boto3
+import base64
+import json
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from PIL import Image, UnidentifiedImageError
+from buffers import BufferReader
+from clients import get_openai_client, get_s3_client
+from caption_index import get_caption_index, image_hashes
+from profiling import profiled
+from rate_governor import governed_call
+from s3_listing import iter_s3_objects
 
 load_dotenv()
 
+CAPTION_PROMPT = "You are an expert at describing images accurately and concisely. Provide clear, detailed captions that capture the main elements and context of the image."
 
-def bytes_to_named_file(image_bytes, filename="image.png"):
-    # Create a file-like object
-    file_obj = io.BytesIO(image_bytes)
-    # Add name attribute that OpenAI's client expects
-    file_obj.name = filename
-    return file_obj
-
-
-def caption_uploaded_image(image: bytes):
-    client = OpenAI()
-
-    image_file = client.files.create(file=bytes_to_named_file(image), purpose="vision")
-
-    response = client.responses.create(
-        model="gpt-4o-mini",
-        input=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "input_text",
-                        "text": "You are an expert at describing images accurately and concisely. Provide clear, detailed captions that capture the main elements and context of the image.",
-                    },
-                    {
-                        "type": "input_image",
-                        "file_id": image_file.id,
-                    },
-                ],
-            }
-        ],
-    )
-    return response.output_text
-
-
-def caption_images_on_s3_bucket(bucket_name, folder_name):
-    s3 = boto3.client("s3")
-    response = s3.list_objects_v2(Bucket=bucket_name, Prefix=folder_name)
-    for obj in response.get("Contents", []):
-        if obj["Key"].endswith(
-            (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".webp")
+# gpt-4o-mini bills an image as a base cost plus a cost per 512px tile
+IMAGE_BASE_TOKENS = 2833
+IMAGE_TILE_TOKENS = 5667
+# Packed requests stop growing at whichever limit is reached first
+BATCH_TOKEN_BUDGET = 100_000
+MAX_IMAGES_PER_REQUEST = 10
+MAX_CONCURRENT_BATCHES = 4
+
+PACKED_CAPTIONS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "captions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "index": {"type": "integer"},
+                    "caption": {"type": "string"},
+                },
+                "required": ["index", "caption"],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["captions"],
+    "additionalProperties": False,
+}
+
+image_extensions = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".webp")
+
+
+@profiled()
+def caption_uploaded_image(image, use_index=True):
+    """Caption an image given as bytes, a memoryview, an in-memory file or a
+    public URL.
+
+    Unless `use_index` is False, the caption of a near-identical image seen
+    before is reused from the perceptual-hash index instead of calling the API.
+    """
+    hashes = None
+    if use_index and not isinstance(image, str):
+        try:
+            hashes = image_hashes(image)
+        except (OSError, UnidentifiedImageError) as e:
+            print(f"Could not hash image, captioning without the index: {e}")
+        if hashes:
+            caption = get_caption_index().lookup(hashes)
+            if caption is not None:
+                return caption
+
+    caption = request_caption(image)
+    if hashes:
+        get_caption_index().add(hashes, caption)
+    return caption
+
+
+def request_caption(image):
+    """Ask the vision model to caption a single image."""
+    client = get_openai_client()
+    image_input = _image_input(image)
+
+    with governed_call("gpt-4o-mini", tokens=estimate_image_tokens(image)) as call:
+        response = client.responses.with_raw_response.create(
+            model="gpt-4o-mini",
+            input=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "input_text", "text": CAPTION_PROMPT},
+                        image_input,
+                    ],
+                }
+            ],
+        )
+        call.observe(response.headers)
+    return response.parse().output_text
+
+
+def image_tokens(width, height):
+    """Input tokens of a `width` x `height` image at the default detail level."""
+    # The API fits images into 2048x2048, then scales the short side to 768
+    scale = min(1, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return IMAGE_BASE_TOKENS + tiles * IMAGE_TILE_TOKENS
+
+
+# Images whose size is not known, such as public URLs the API fetches itself,
+# are counted as a square photo: four tiles, about 25k tokens
+UNKNOWN_IMAGE_TOKENS = image_tokens(1024, 1024)
+
+
+def estimate_image_tokens(image):
+    """Estimate the input tokens of an image from its dimensions."""
+    if isinstance(image, str):
+        return UNKNOWN_IMAGE_TOKENS
+    try:
+        # Only the header is read here, not the pixel data
+        with Image.open(BufferReader(image, "image")) as decoded:
+            width, height = decoded.size
+    except (OSError, UnidentifiedImageError):
+        return UNKNOWN_IMAGE_TOKENS
+    return image_tokens(width, height)
+
+
+def _image_input(image):
+    if isinstance(image, str):
+        # Public URLs are fetched by the API itself
+        return {"type": "input_image", "image_url": image}
+    # Inline the image rather than uploading it through the files API first
+    with Image.open(BufferReader(image, "image")) as decoded:
+        mime = Image.MIME.get(decoded.format, "image/png")
+    with BufferReader(image, "image") as reader:
+        data = base64.b64encode(reader.read()).decode("ascii")
+    return {"type": "input_image", "image_url": f"data:{mime};base64,{data}"}
+
+
+def request_packed_captions(images, tokens):
+    """Caption several images in one request.
+
+    Returns {position: caption} for the images the model answered for; the
+    caller retries any that are missing.
+    """
+    client = get_openai_client()
+    content = [
+        {
+            "type": "input_text",
+            "text": f"{CAPTION_PROMPT}\n\nYou will receive {len(images)} images, "
+            "each preceded by its index. Return one caption per image, "
+            "identified by that index.",
+        }
+    ]
+    for position, image in enumerate(images):
+        content.append({"type": "input_text", "text": f"Image {position}:"})
+        content.append(_image_input(image))
+
+    with governed_call("gpt-4o-mini", tokens=tokens) as call:
+        response = client.responses.with_raw_response.create(
+            model="gpt-4o-mini",
+            input=[{"role": "user", "content": content}],
+            text={
+                "format": {
+                    "type": "json_schema",
+                    "name": "captions",
+                    "schema": PACKED_CAPTIONS_SCHEMA,
+                    "strict": True,
+                }
+            },
+        )
+        call.observe(response.headers)
+
+    try:
+        entries = json.loads(response.parse().output_text)["captions"]
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Could not parse packed captions: {e}")
+        return {}
+    return {
+        entry["index"]: entry["caption"]
+        for entry in entries
+        if 0 <= entry["index"] < len(images) and entry["caption"].strip()
+    }
+
+
+def pack_images(images, estimates):
+    """Group image positions into requests within the token and count limits."""
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for position in images:
+        tokens = estimates[position]
+        if batch and (
+            len(batch) == MAX_IMAGES_PER_REQUEST
+            or batch_tokens + tokens > BATCH_TOKEN_BUDGET
         ):
-            # Download the image from S3
-            image_obj = s3.get_object(Bucket=bucket_name, Key=obj["Key"])
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(position)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+@profiled()
+def caption_images_batch(images, use_index=True):
+    """Caption many images with as few requests as possible.
+
+    Images are packed several to a request, sized from their token
+    estimates. When a packed response cannot be parsed or leaves images
+    out, only those images are split into smaller requests and retried.
+    Returns the captions in input order.
+    """
+    captions = [None] * len(images)
+    hashes = [None] * len(images)
+    if use_index:
+        for position, image in enumerate(images):
+            if isinstance(image, str):
+                continue
+            try:
+                hashes[position] = image_hashes(image)
+            except (OSError, UnidentifiedImageError):
+                continue
+            captions[position] = get_caption_index().lookup(hashes[position])
+
+    todo = [position for position, caption in enumerate(captions) if caption is None]
+    estimates = {position: estimate_image_tokens(images[position]) for position in todo}
+
+    def run(batch):
+        if len(batch) == 1:
+            return {batch[0]: request_caption(images[batch[0]])}
+        answered = request_packed_captions(
+            [images[position] for position in batch],
+            sum(estimates[position] for position in batch),
+        )
+        results = {batch[i]: caption for i, caption in answered.items()}
+        missing = [position for position in batch if position not in results]
+        if missing:
+            half = max(1, len(missing) // 2)
+            for part in (missing[:half], missing[half:]):
+                if part:
+                    results.update(run(part))
+        return results
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_BATCHES) as pool:
+        for results in pool.map(run, pack_images(todo, estimates)):
+            for position, caption in results.items():
+                captions[position] = caption
+                if hashes[position]:
+                    get_caption_index().add(hashes[position], caption)
+    return captions
+
+
+def caption_key_for(image_key):
+    return image_key.rsplit(".", 1)[0] + "_caption.txt"
+
+
+def find_uncaptioned_images(s3, bucket_name, folder_name):
+    """Return the image keys without an up-to-date `_caption.txt` sidecar.
+
+    Everything is worked out from one listing, so an already captioned
+    bucket costs no downloads and no API calls.
+    """
+    images = {}
+    sidecars = {}
+    for obj in iter_s3_objects(
+        s3, bucket_name, folder_name, image_extensions + ("_caption.txt",)
+    ):
+        key = obj["Key"]
+        if key.endswith("_caption.txt"):
+            sidecars[key] = obj["LastModified"]
+        elif key.lower().endswith(image_extensions):
+            images[key] = obj["LastModified"]
+
+    return [
+        key
+        for key, modified in images.items()
+        if caption_key_for(key) not in sidecars
+        or sidecars[caption_key_for(key)] < modified
+    ]
+
+
+def caption_images_on_s3_bucket(
+    bucket_name,
+    folder_name,
+    download_workers=8,
+    caption_workers=8,
+    upload_workers=8,
+    max_in_flight=32,
+):
+    """Caption every image under `folder_name` that has no caption yet.
+
+    Downloads, captioning and sidecar uploads run in separate thread pools, so
+    the stages overlap. Downloaded images are captioned in packed batches. At
+    most `max_in_flight` images are held in memory at once. Returns the number
+    of images captioned and the keys that failed.
+    """
+    s3 = get_s3_client()
+    # Imported here, like the clients themselves, to keep them off page loads
+    from botocore.exceptions import BotoCoreError, ClientError
+    from openai import APIError
+
+    pending = find_uncaptioned_images(s3, bucket_name, folder_name)
+    print(f"{len(pending)} images need captions")
+    if not pending:
+        return 0, []
+
+    downloads = ThreadPoolExecutor(download_workers, thread_name_prefix="download")
+    captions = ThreadPoolExecutor(caption_workers, thread_name_prefix="caption")
+    uploads = ThreadPoolExecutor(upload_workers, thread_name_prefix="upload")
+    slots = threading.Semaphore(max_in_flight)
+    lock = threading.Lock()
+    finished = threading.Event()
+    done = []
+    failed = []
+    downloaded = []
+    batch_size = min(MAX_IMAGES_PER_REQUEST, max_in_flight)
+
+    def report(key, error=None):
+        with lock:
+            if error is None:
+                done.append(key)
+            else:
+                failed.append(key)
+                print(f"Error captioning {key}: {error}")
+            completed = len(done) + len(failed)
+            if completed % 25 == 0 or completed == len(pending):
+                print(
+                    f"Captioned {len(done)}/{len(pending)} images ({len(failed)} failed)"
+                )
+            if completed == len(pending):
+                finished.set()
+        slots.release()
+
+    # Each stage hands its result to the next stage's pool, so one image can
+    # be uploading while others are being captioned or downloaded.
+    def download(key):
+        try:
+            image_obj = s3.get_object(Bucket=bucket_name, Key=key)
             image_data = image_obj["Body"].read()
+        except (BotoCoreError, ClientError, OSError) as e:
+            report(key, e)
+            return
+        with lock:
+            downloaded.append((key, image_data))
+            if len(downloaded) < batch_size:
+                return
+            batch = downloaded[:]
+            downloaded.clear()
+        captions.submit(caption, batch)
 
-            # Get the caption
-            caption = caption_uploaded_image(image_data)
-            print(f"Caption for {obj['Key']}: {caption}")
+    def caption(batch):
+        try:
+            texts = caption_images_batch([image_data for _, image_data in batch])
+        except (APIError, OSError) as e:
+            for key, _ in batch:
+                report(key, e)
+            return
+        for (key, _), text in zip(batch, texts):
+            uploads.submit(upload, key, text)
 
-            # Store the caption in S3
-            caption_key = obj["Key"].rsplit(".", 1)[0] + "_caption.txt"
+    def upload(key, text):
+        try:
             s3.put_object(
-                Bucket=bucket_name, Key=caption_key, Body=caption.encode("utf-8")
+                Bucket=bucket_name, Key=caption_key_for(key), Body=text.encode("utf-8")
             )
+        except (BotoCoreError, ClientError) as e:
+            report(key, e)
+            return
+        report(key)
+
+    for key in pending:
+        slots.acquire()
+        downloads.submit(download, key)
+
+    # Caption whatever is left over once every download has finished
+    downloads.shutdown(wait=True)
+    if downloaded:
+        captions.submit(caption, downloaded[:])
+
+    finished.wait()
+    for pool in (downloads, captions, uploads):
+        pool.shutdown()
+    return len(done), failed
@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import threading
+
+from PIL import Image
+
+from buffers import BufferReader
+from image_hash import HammingIndex, dhash, hamming_distance, phash
+
+CAPTION_INDEX_PATH = os.getenv("CAPTION_INDEX_PATH", "caption_index.db")
+# pHash bits that may differ between copies of the same image. dHash is
+# checked as well with a looser bound, to weed out pHash collisions.
+PHASH_DISTANCE = 4
+DHASH_DISTANCE = 10
+
+
+def _to_signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def image_hashes(image):
+    """Return (phash, dhash) for image bytes, a buffer or an in-memory file."""
+    with Image.open(BufferReader(image, "image")) as decoded:
+        # Hashes only need a few dozen pixels, so decode at reduced size
+        decoded.draft("L", (64, 64))
+        return phash(decoded), dhash(decoded)
+
+
+class CaptionIndex:
+    """Persistent map from perceptual hashes to captions already paid for.
+
+    Rows live in SQLite; a HammingIndex over the pHashes is rebuilt in memory
+    on open so lookups never touch disk.
+    """
+
+    def __init__(self, path=CAPTION_INDEX_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS captions ("
+            "phash INTEGER NOT NULL, dhash INTEGER NOT NULL, caption TEXT NOT NULL)"
+        )
+        self._index = HammingIndex(max_distance=PHASH_DISTANCE)
+        for p, d, caption in self._db.execute(
+            "SELECT phash, dhash, caption FROM captions"
+        ):
+            self._index.add(_to_unsigned(p), (_to_unsigned(d), caption))
+
+    def __len__(self):
+        return len(self._index)
+
+    def lookup(self, hashes):
+        """Return the caption of a near-identical image, or None."""
+        image_phash, image_dhash = hashes
+        with self._lock:
+            matches = self._index.search(image_phash)
+        for _, (stored_dhash, caption) in matches:
+            if hamming_distance(image_dhash, stored_dhash) <= DHASH_DISTANCE:
+                return caption
+        return None
+
+    def add(self, hashes, caption):
+        image_phash, image_dhash = hashes
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO captions (phash, dhash, caption) VALUES (?, ?, ?)",
+                (_to_signed(image_phash), _to_signed(image_dhash), caption),
+            )
+            self._db.commit()
+            self._index.add(image_phash, (image_dhash, caption))
+
+
+_caption_index = None
+_caption_index_lock = threading.Lock()
+
+
+def get_caption_index():
+    """Return the process-wide caption index, opening it on first use."""
+    global _caption_index
+    with _caption_index_lock:
+        if _caption_index is None:
+            _caption_index = CaptionIndex()
+        return _caption_index
@@ -0,0 +1,33 @@
+from functools import cache
+
+# openai and boto3 take a few hundred milliseconds each to import, so they are
+# imported when a client is first needed rather than when a page loads. The
+# clients are thread-safe and shared, which also keeps their connections open
+# between calls.
+
+
+@cache
+def get_openai_client():
+    from openai import OpenAI
+
+    return OpenAI()
+
+
+@cache
+def get_s3_client(anonymous=False, access_key=None, secret_key=None, region=None):
+    """Return a shared S3 client for these credentials, or the default chain."""
+    import boto3
+
+    if anonymous:
+        from botocore import UNSIGNED
+        from botocore.config import Config
+
+        return boto3.client("s3", config=Config(signature_version=UNSIGNED))
+    if access_key is not None:
+        return boto3.client(
+            "s3",
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region,
+        )
+    return boto3.client("s3")
@@ -0,0 +1,276 @@
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from extract_audio import audio_extensions, audio_output_path
+from transcript_store import get_transcript_store
+
+# Most the working directories may hold, in bytes; 0 means no quota
+DISK_QUOTA_BYTES = int(os.getenv("DISK_QUOTA_BYTES", "0"))
+# Downloads are refused rather than leave less than this free on the disk
+MIN_FREE_BYTES = int(os.getenv("MIN_FREE_BYTES", str(1024 * 1024 * 1024)))
+WORK_DIRS = ("files", "audio", "thumbnails")
+
+# Temporary files and directories are named troweb-<pid>-..., so that those
+# left behind by a process that died can be told apart from live ones
+TEMP_PREFIX = "troweb-"
+# Anything named with this process's pid but older than this was left by an
+# earlier process that had the same pid. File times lag the clock a little.
+_STARTED = time.time() - 2
+
+
+class DiskQuotaExceeded(OSError):
+    """Raised when there is no room for a download even after eviction."""
+
+
+def temp_prefix():
+    """Prefix for this process's temporary files and directories."""
+    return f"{TEMP_PREFIX}{os.getpid()}-"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Someone else's live process
+        return True
+    return True
+
+
+def _path_size(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(path)
+            for name in names
+        )
+    return os.path.getsize(path)
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        os.unlink(path)
+
+
+def sweep_orphaned_temp_files(directory=None):
+    """Delete temporary files of processes that are no longer running.
+
+    Returns the number of bytes freed. Entries with this process's own pid
+    are left alone, as they may be in use (a session's prefetch cache, say),
+    unless they predate the process, which happens after a pid was reused.
+    """
+    directory = directory or tempfile.gettempdir()
+    freed = 0
+    for name in os.listdir(directory):
+        if not name.startswith(TEMP_PREFIX):
+            continue
+        pid = name[len(TEMP_PREFIX) :].split("-", 1)[0]
+        if not pid.isdigit():
+            continue
+        path = os.path.join(directory, name)
+        if int(pid) == os.getpid():
+            try:
+                if os.path.getmtime(path) >= _STARTED:
+                    continue
+            except OSError:
+                continue
+        elif _pid_alive(int(pid)):
+            continue
+        try:
+            size = _path_size(path)
+            _remove(path)
+        except OSError as e:
+            print(f"Could not remove {path}: {e}")
+            continue
+        freed += size
+    if freed:
+        print(f"Removed {freed / 1_000_000:.1f} MB of orphaned temporary files")
+    return freed
+
+
+_swept = False
+_sweep_lock = threading.Lock()
+
+
+def sweep_once():
+    """Run the orphan sweep the first time it is called in this process."""
+    global _swept
+    with _sweep_lock:
+        if not _swept:
+            _swept = True
+            sweep_orphaned_temp_files()
+
+
+def _walk(directory):
+    """Yield the files under `directory`, in subdirectories too."""
+    for entry in os.scandir(directory):
+        if entry.is_dir(follow_symlinks=False):
+            yield from _walk(entry.path)
+        elif entry.is_file():
+            yield entry
+
+
+def working_set_size():
+    return sum(
+        entry.stat().st_size
+        for directory in WORK_DIRS
+        if os.path.isdir(directory)
+        for entry in _walk(directory)
+    )
+
+
+def evictable_files():
+    """Intermediate files whose downstream output exists, least recently used
+    first, as (last use, size, path).
+
+    A video in files/ is done once its audio was extracted or transcribed,
+    and audio in audio/ once its transcript is in the store. Thumbnails are
+    a cache, rebuilt when next shown.
+    """
+    # download builds on this module
+    from download import video_extensions
+
+    store = get_transcript_store()
+    candidates = []
+    for directory in WORK_DIRS:
+        if not os.path.isdir(directory):
+            continue
+        entries = (
+            _walk(directory) if directory == "thumbnails" else os.scandir(directory)
+        )
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            stem, ext = os.path.splitext(entry.name)
+            ext = ext.lower()
+            if directory == "thumbnails":
+                done = ext == ".webp"
+            elif directory == "files" and ext in video_extensions:
+                done = os.path.exists(
+                    audio_output_path(entry.name)
+                ) or store.has_transcript(local_name=stem)
+            elif directory == "audio" and ext in audio_extensions:
+                done = store.has_transcript(local_name=stem)
+            else:
+                done = False
+            if done:
+                stat = entry.stat()
+                candidates.append(
+                    (max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path)
+                )
+    candidates.sort()
+    return candidates
+
+
+def _in_work_dirs(directory):
+    directory = os.path.abspath(directory)
+    return any(
+        directory == os.path.abspath(work_dir)
+        or directory.startswith(os.path.abspath(work_dir) + os.sep)
+        for work_dir in WORK_DIRS
+    )
+
+
+def _same_filesystem(directory):
+    return os.stat(directory).st_dev == os.stat(".").st_dev
+
+
+def collect_garbage(needed=0, directory=".", quota=True):
+    """Evict finished intermediates, oldest first, until `needed` more bytes
+    fit under the quota, unless not `quota`, and above the free-space floor
+    of `directory`, unless it is None. Returns bytes freed."""
+    used = working_set_size()
+    free = shutil.disk_usage(directory).free if directory else None
+    freed = 0
+    for _, size, path in evictable_files():
+        over_quota = quota and DISK_QUOTA_BYTES and used + needed > DISK_QUOTA_BYTES
+        low_on_space = free is not None and free - needed < MIN_FREE_BYTES
+        if not over_quota and not low_on_space:
+            break
+        try:
+            os.unlink(path)
+        except OSError as e:
+            print(f"Could not evict {path}: {e}")
+            continue
+        print(f"Evicted {path}")
+        used -= size
+        if free is not None:
+            free += size
+        freed += size
+    return freed
+
+
+_space_lock = threading.Lock()
+
+
+def ensure_space(nbytes, directory="."):
+    """Make room for a `nbytes` download into `directory` or raise
+    DiskQuotaExceeded.
+
+    The free-space floor is checked on the filesystem `directory` is on,
+    which for temporary files is often not that of the working directories.
+    The quota only counts downloads into the working directories. Finished
+    intermediates are evicted if that helps: for the quota, or when they
+    share the filesystem. The check is advisory: concurrent downloads each
+    see the same free space, so keep the floor comfortably above a batch of
+    them.
+    """
+    counted = _in_work_dirs(directory)
+    with _space_lock:
+        same_filesystem = _same_filesystem(directory)
+        if counted or same_filesystem:
+            # Evicting only frees space on the working directories' disk
+            collect_garbage(
+                nbytes, directory if same_filesystem else None, quota=counted
+            )
+        used = working_set_size()
+        free = shutil.disk_usage(directory).free
+    if counted and DISK_QUOTA_BYTES and used + nbytes > DISK_QUOTA_BYTES:
+        raise DiskQuotaExceeded(
+            f"No room for {nbytes / 1_000_000:.1f} MB: working set is "
+            f"{used / 1_000_000:.1f} MB of a {DISK_QUOTA_BYTES / 1_000_000:.1f} "
+            "MB quota"
+        )
+    if free - nbytes < MIN_FREE_BYTES:
+        raise DiskQuotaExceeded(
+            f"No room for {nbytes / 1_000_000:.1f} MB: only "
+            f"{free / 1_000_000:.1f} MB free on the disk of {directory}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage disk use of the workers.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Show disk use and what could be evicted")
+    commands.add_parser("sweep", help="Delete orphaned temporary files")
+    gc_parser = commands.add_parser("gc", help="Evict finished intermediates")
+    gc_parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Evict everything finished, not just enough to get under the quota",
+    )
+    args = parser.parse_args()
+
+    if args.command == "status":
+        evictable = evictable_files()
+        print(f"Working set: {working_set_size() / 1_000_000:.1f} MB")
+        print(f"Quota: {DISK_QUOTA_BYTES / 1_000_000:.1f} MB (0 = none)")
+        print(f"Free: {shutil.disk_usage('.').free / 1_000_000:.1f} MB")
+        print(
+            f"Evictable: {len(evictable)} files, "
+            f"{sum(size for _, size, _ in evictable) / 1_000_000:.1f} MB"
+        )
+    elif args.command == "sweep":
+        sweep_orphaned_temp_files()
+    elif args.all:
+        for _, _, path in evictable_files():
+            os.unlink(path)
+            print(f"Evicted {path}")
+    else:
+        print(f"Freed {collect_garbage() / 1_000_000:.1f} MB")
@@ -1,7 +1,9 @@
+import hashlib
 import os
-import boto3
-from botocore import UNSIGNED
-from botocore.config import Config
+from clients import get_s3_client
+from disk_manager import DiskQuotaExceeded, ensure_space, sweep_once
+from s3_listing import iter_s3_objects
+from transcript_store import get_transcript_store
 
 video_extensions = (".mp4", ".mov", ".mkv", ".avi")
 
@@ -9,24 +11,52 @@ video_extensions = (".mp4", ".mov", ".mkv", ".avi")
 def prepare_application():
     os.makedirs("files", exist_ok=True)
     os.makedirs("audio", exist_ok=True)
-    os.makedirs("transcription", exist_ok=True)
+    sweep_once()
+
+
+def local_name_for(store, key):
+    """Name a downloaded object by its key, flattened to one folder.
+
+    Keys that flatten to a name already taken by another key, as `a/b.mp4`
+    and `a_b.mp4` do, get a short hash of the key appended.
+    """
+    registered = store.get(key)
+    if registered and registered["local_name"]:
+        return registered["local_name"]
+    name = os.path.splitext(key.replace("/", "_"))[0]
+    try:
+        taken = store.s3_key_for(name) is not None
+    except ValueError:
+        taken = True
+    if not taken:
+        return name
+    return f"{name}-{hashlib.sha1(key.encode()).hexdigest()[:8]}"
 
 
 def download_videos_from_s3(bucket_name: str, local_dir: str, s3_path: str = None):
-    s3_client = boto3.client("s3", config=Config(signature_version=UNSIGNED))
+    s3_client = get_s3_client(anonymous=True)
     # List objects in bucket and filter for video extensions
     prefix = s3_path.rstrip("/") + "/" if s3_path else ""
-    response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-
-    if "Contents" in response:
-        for obj in response["Contents"]:
-            key = obj["Key"]
-            # Check if file is a video and it is not downloaded yet
-            if key.lower().endswith(video_extensions) and not os.path.exists(
-                os.path.join(local_dir, key.replace("/", "_"))
-            ):
-                local_path = os.path.join(
-                    local_dir, key.replace("/", "_")
-                )  # Avoid subfolder issues
-                print(f"Downloading {key} to {local_path}")
-                s3_client.download_file(bucket_name, key, local_path)
+
+    store = get_transcript_store()
+    for obj in iter_s3_objects(s3_client, bucket_name, prefix, video_extensions):
+        key = obj["Key"]
+        # Avoid subfolder issues
+        local_name = local_name_for(store, key)
+        local_path = os.path.join(local_dir, local_name + os.path.splitext(key)[1])
+        # Skip videos already downloaded, or transcribed and then evicted
+        if not os.path.exists(local_path) and not store.has_transcript(s3_key=key):
+            try:
+                ensure_space(obj.get("Size", 0), local_dir)
+            except DiskQuotaExceeded as e:
+                print(f"Stopping downloads: {e}")
+                return
+            print(f"Downloading {key} to {local_path}")
+            s3_client.download_file(bucket_name, key, local_path)
+            # Remember the original key, which the flattened name loses
+            store.register(
+                key,
+                local_name=local_name,
+                etag=obj.get("ETag"),
+                title=os.path.splitext(key)[0],
+            )
@@ -1,43 +1,372 @@
+import json
 import os
+import re
 import subprocess
 
+# Optional pre-conditioning applied before transcription: strip silences,
+# resample to 16 kHz (all Whisper uses) and encode as low-bitrate Opus.
+PRECONDITION_AUDIO = os.getenv("PRECONDITION_AUDIO", "0") == "1"
+SILENCE_THRESHOLD_DB = -35
+MIN_SILENCE_SECONDS = 1.0
+SILENCE_PADDING_SECONDS = 0.25
+PRECONDITION_SAMPLE_RATE = 16000
+PRECONDITION_BITRATE = "24k"
+PRECONDITION_TEMPO = float(os.getenv("PRECONDITION_TEMPO", "1.0"))
+# What the audio/ working directory holds, extracted or dropped in directly
+audio_extensions = (".mp3", ".m4a", ".wav", ".ogg")
+
+# Bitrate of the plain MP3 extraction, the baseline savings are measured against
+BASELINE_BITRATE = 128_000
+# Chunks for files too large for a single transcription request, at most 20
+# minutes each; shorter when the source bitrate would make them too large
+CHUNK_SECONDS = 1200
+# Containers whose audio is cut into chunks of the same format, without
+# re-encoding. Anything else is converted to MP3 as extract_audio_file does.
+AUDIO_ONLY_EXTENSIONS = (".flac", ".m4a", ".mp3", ".oga", ".ogg", ".wav")
+COPY_CHUNK_EXTENSIONS = (
+    ".flac",
+    ".m4a",
+    ".mp3",
+    ".mp4",
+    ".oga",
+    ".ogg",
+    ".wav",
+    ".webm",
+)
+
+_SILENCE_START = re.compile(r"silence_start: (-?\d+(?:\.\d+)?)")
+_SILENCE_END = re.compile(r"silence_end: (-?\d+(?:\.\d+)?)")
+
+
+def get_media_duration(path):
+    """Return the duration of a media file in seconds, or None if unknown."""
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-show_entries",
+        "format=duration",
+        "-of",
+        "default=noprint_wrappers=1:nokey=1",
+        path,
+    ]
+    try:
+        result = subprocess.run(
+            command,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        return float(result.stdout.strip())
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def get_audio_bitrate(path):
+    """Return the bitrate of the first audio stream in bits per second, or
+    None if the container does not record it (Ogg and WebM often do not)."""
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "a:0",
+        "-show_entries",
+        "stream=bit_rate",
+        "-of",
+        "default=noprint_wrappers=1:nokey=1",
+        path,
+    ]
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+        return int(result.stdout.strip())
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def extract_audio_file(video_path, audio_path):
+    """Extract the audio track of `video_path` into a mono MP3 at `audio_path`."""
+    command = [
+        "ffmpeg",
+        "-i",
+        video_path,
+        "-map",
+        "a",
+        "-c:a",
+        "mp3",
+        "-b:a",
+        "128k",
+        "-ac",
+        "1",  # Mono
+        audio_path,
+    ]
+
+    # Run FFmpeg command, capture stderr
+    subprocess.run(
+        command,
+        check=True,
+        capture_output=True,
+        text=True,  # Output as text instead of bytes
+    )
+
+
+def chunk_bitrate(input_path):
+    """Bitrate, in bits per second, of the chunks split_audio cuts from
+    `input_path`, or None if it cannot be told."""
+    if os.path.splitext(input_path)[1].lower() not in COPY_CHUNK_EXTENSIONS:
+        return BASELINE_BITRATE
+    bitrate = get_audio_bitrate(input_path)
+    if bitrate:
+        return bitrate
+    # Audio-only files are as large as their audio stream
+    duration = get_media_duration(input_path)
+    if duration and input_path.lower().endswith(AUDIO_ONLY_EXTENSIONS):
+        return os.path.getsize(input_path) * 8 / duration
+    return None
+
+
+def split_audio(
+    input_path, output_dir, chunk_seconds=CHUNK_SECONDS, first_chunk_seconds=None
+):
+    """Cut the audio of `input_path` into consecutive chunks.
+
+    The audio keeps its codec and bitrate when the container is one the
+    transcription endpoint takes, and is converted to MP3 otherwise. With
+    `first_chunk_seconds`, the first chunk is that long and the others up
+    to `chunk_seconds`. Returns the chunk paths in playback order.
+    """
+    cuts = ["-segment_time", str(chunk_seconds)]
+    duration = get_media_duration(input_path) if first_chunk_seconds else None
+    if duration:
+        times = range(first_chunk_seconds, int(duration), chunk_seconds)
+        cuts = ["-segment_times", ",".join(str(t) for t in times)]
+    ext = os.path.splitext(input_path)[1].lower()
+    if ext in COPY_CHUNK_EXTENSIONS:
+        codec = ["-c:a", "copy"]
+    else:
+        ext = ".mp3"
+        codec = ["-c:a", "mp3", "-b:a", str(BASELINE_BITRATE), "-ac", "1"]
+    command = [
+        "ffmpeg",
+        "-i",
+        input_path,
+        "-map",
+        "a",
+        *codec,
+        "-f",
+        "segment",
+        *cuts,
+        "-reset_timestamps",
+        "1",
+        os.path.join(output_dir, f"chunk_%04d{ext}"),
+    ]
+    subprocess.run(
+        command,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return sorted(
+        os.path.join(output_dir, f)
+        for f in os.listdir(output_dir)
+        if f.startswith("chunk_")
+    )
+
+
+def detect_silences(
+    path, threshold_db=SILENCE_THRESHOLD_DB, min_silence=MIN_SILENCE_SECONDS
+):
+    """Return (start, end) pairs of the silent stretches in `path`."""
+    command = [
+        "ffmpeg",
+        "-i",
+        path,
+        "-map",
+        "a",
+        "-af",
+        f"silencedetect=noise={threshold_db}dB:d={min_silence}",
+        "-f",
+        "null",
+        "-",
+    ]
+    result = subprocess.run(
+        command,
+        check=True,
+        capture_output=True,  # silencedetect reports on stderr
+        text=True,
+    )
+    starts = [float(t) for t in _SILENCE_START.findall(result.stderr)]
+    ends = [float(t) for t in _SILENCE_END.findall(result.stderr)]
+    silences = list(zip(starts, ends))
+    # A file ending in silence has a start without a matching end.
+    if len(starts) > len(ends):
+        silences.append((starts[-1], None))
+    return silences
+
+
+def speech_segments(duration, silences, padding=SILENCE_PADDING_SECONDS):
+    """Invert silences into the (start, end) spans of `duration` worth keeping."""
+    segments = []
+    position = 0.0
+    for start, end in silences:
+        keep_until = min(duration, start + padding)
+        if keep_until > position:
+            segments.append((position, keep_until))
+        if end is None:
+            position = duration
+            break
+        position = max(position, end - padding)
+    if position < duration:
+        segments.append((position, duration))
+    return segments
+
+
+def build_timestamp_map(segments, tempo=1.0):
+    """Describe where each kept source span lands in the processed audio."""
+    mapped = []
+    output_position = 0.0
+    for start, end in segments:
+        mapped.append(
+            [round(output_position, 3), round(start, 3), round(end - start, 3)]
+        )
+        output_position += (end - start) / tempo
+    return {"tempo": tempo, "segments": mapped}
+
+
+def reproject_timestamp(timestamp_map, seconds):
+    """Map a time in the processed audio back to the original recording."""
+    tempo = timestamp_map["tempo"]
+    segments = timestamp_map["segments"]
+    if not segments:
+        return seconds * tempo
+    current = segments[0]
+    for segment in segments:
+        if segment[0] > seconds:
+            break
+        current = segment
+    output_start, source_start, source_duration = current
+    offset = min((seconds - output_start) * tempo, source_duration)
+    return source_start + max(0.0, offset)
+
+
+def timestamp_map_path(audio_path):
+    return os.path.splitext(audio_path)[0] + ".map.json"
+
+
+def _tempo_filters(tempo):
+    # atempo only accepts factors between 0.5 and 2.0 per instance.
+    filters = []
+    while tempo > 2.0:
+        filters.append("atempo=2.0")
+        tempo /= 2.0
+    while tempo < 0.5:
+        filters.append("atempo=0.5")
+        tempo /= 0.5
+    if tempo != 1.0:
+        filters.append(f"atempo={tempo:.4f}")
+    return filters
+
+
+def precondition_audio(
+    input_path,
+    output_path,
+    remove_silence=True,
+    sample_rate=PRECONDITION_SAMPLE_RATE,
+    bitrate=PRECONDITION_BITRATE,
+    tempo=PRECONDITION_TEMPO,
+):
+    """Extract a transcription-ready Opus track from `input_path`.
+
+    Silences are cut, the audio is resampled to `sample_rate` and optionally
+    sped up by `tempo`. A timestamp map saved next to `output_path` lets
+    timings in the transcript be projected back onto the original recording.
+    Returns a report of the bytes and seconds saved against a plain 128 kbps
+    MP3 extraction.
+    """
+    duration = get_media_duration(input_path)
+    if duration is None:
+        raise ValueError(f"Could not read the duration of {input_path}")
+
+    segments = [(0.0, duration)]
+    if remove_silence:
+        segments = speech_segments(duration, detect_silences(input_path))
+
+    filters = []
+    if len(segments) > 1 or segments[0] != (0.0, duration):
+        spans = "+".join(f"between(t,{start:.3f},{end:.3f})" for start, end in segments)
+        filters += [f"aselect='{spans}'", "asetpts=N/SR/TB"]
+    filters += _tempo_filters(tempo)
+
+    command = ["ffmpeg", "-y", "-i", input_path, "-map", "a"]
+    if filters:
+        command += ["-af", ",".join(filters)]
+    command += [
+        "-ac",
+        "1",  # Mono
+        "-ar",
+        str(sample_rate),
+        "-c:a",
+        "libopus",
+        "-b:a",
+        bitrate,
+        "-application",
+        "voip",  # Tuned for speech
+        output_path,
+    ]
+    subprocess.run(
+        command,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+    timestamp_map = build_timestamp_map(segments, tempo)
+    with open(timestamp_map_path(output_path), "w") as f:
+        json.dump(timestamp_map, f)
+
+    output_duration = get_media_duration(output_path) or sum(
+        (end - start) / tempo for start, end in segments
+    )
+    baseline_bytes = int(duration * BASELINE_BITRATE / 8)
+    output_bytes = os.path.getsize(output_path)
+    report = {
+        "source_seconds": round(duration, 1),
+        "output_seconds": round(output_duration, 1),
+        "seconds_saved": round(duration - output_duration, 1),
+        "baseline_bytes": baseline_bytes,
+        "output_bytes": output_bytes,
+        "bytes_saved": baseline_bytes - output_bytes,
+        "timestamp_map": timestamp_map,
+    }
+    print(
+        f"Pre-conditioned {os.path.basename(input_path)}: "
+        f"saved {report['bytes_saved'] / 1_000_000:.1f} MB and "
+        f"{report['seconds_saved']:.0f}s of audio"
+    )
+    return report
+
+
+def audio_output_path(video_file):
+    """Path in `audio/` that extraction produces for `video_file`."""
+    ext = ".ogg" if PRECONDITION_AUDIO else ".mp3"
+    return os.path.join("audio", os.path.splitext(video_file)[0] + ext)
+
 
 def extract_audio_from_mp4_ffmpeg(video_file):
     try:
         # Construct paths
         video_path = os.path.join("files", video_file)
-        audio_filename = os.path.splitext(video_file)[0] + ".mp3"
-        audio_path = os.path.join("audio", audio_filename)
+        audio_path = audio_output_path(video_file)
 
         # Check if audio file already exists
         if os.path.exists(audio_path):
             print(f"Audio already extracted for {video_file}. Skipping.")
             return
 
-        # Construct FFmpeg command
-        command = [
-            "ffmpeg",
-            "-i",
-            video_path,
-            "-map",
-            "a",
-            "-c:a",
-            "mp3",
-            "-b:a",
-            "128k",
-            "-ac",
-            "1",  # Mono
-            audio_path,
-        ]
-
-        # Run FFmpeg command, capture stderr
-        result = subprocess.run(
-            command,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,  # Capture stderr
-            text=True,  # Output as text instead of bytes
-        )
+        if PRECONDITION_AUDIO:
+            precondition_audio(video_path, audio_path)
+        else:
+            extract_audio_file(video_path, audio_path)
         print(f"Extracted audio from {video_file}")
 
     except subprocess.CalledProcessError as e:
@@ -1,67 +1,329 @@
+import json
 import threading
 import os
-from openai import OpenAI
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from queue import Queue
+from buffers import BufferReader, buffer_size
+from disk_manager import temp_prefix
+from extract_audio import (
+    CHUNK_SECONDS,
+    audio_extensions,
+    chunk_bitrate,
+    get_media_duration,
+    split_audio,
+    timestamp_map_path,
+)
+from profiling import in_context, profiled
+from rate_governor import MAX_CONCURRENCY, governed_call
+from resilience import LatencyTracker, call_with_retries, run_hedged
+from transcript_formats import from_verbose_json, join, reproject
+from transcript_store import get_transcript_store
 
+# Deadline for one file: a fixed allowance for upload and queueing plus a share
+# of the audio length. Whisper usually runs well above real time.
+BASE_DEADLINE = 60
+DEADLINE_PER_AUDIO_SECOND = 0.5
+HEDGE_TRANSCRIPTIONS = os.getenv("HEDGE_TRANSCRIPTIONS", "0") == "1"
+# Upload limit of the transcription endpoint
+WHISPER_MAX_BYTES = 25 * 1024 * 1024
+# Cost per minute of audio, in USD
+WHISPER_COST_PER_MINUTE = 0.006
+# Seconds of wall time per second of audio assumed before any were measured,
+# plus a fixed allowance per request for upload and queueing
+DEFAULT_SECONDS_PER_AUDIO_SECOND = 0.1
+REQUEST_OVERHEAD_SECONDS = 5
+# Length of the first chunk of a file shown as it is transcribed, so its
+# first text arrives after one short request. Later chunks stay long, as
+# every cut can split a word.
+STREAM_FIRST_CHUNK_SECONDS = int(os.getenv("STREAM_FIRST_CHUNK_SECONDS", "30"))
+# Chunks of one file transcribed at once; the rate governor still has the
+# last word across files
+CHUNK_WORKERS = 4
 
-def transcribe_audio(client, file_path):
-    """Transcribe an audio file using OpenAI's Whisper model."""
-    with open(file_path, "rb") as audio_file:
-        return client.audio.transcriptions.create(
-            file=audio_file,
-            model="whisper-1",
-            response_format="text",
-            prompt="Keep the natural language spoken",
+# Formats the transcription endpoint accepts as-is; anything else needs ffmpeg.
+WHISPER_EXTENSIONS = (
+    ".flac",
+    ".m4a",
+    ".mp3",
+    ".mp4",
+    ".mpeg",
+    ".mpga",
+    ".oga",
+    ".ogg",
+    ".wav",
+    ".webm",
+)
+
+# Seconds of wall time per second of audio, used to spot stragglers.
+_latency = LatencyTracker()
+
+
+def estimate_transcription_seconds(duration):
+    """Expected wall time for `duration` seconds of audio, from recent calls."""
+    ratio = _latency.percentile(50) or DEFAULT_SECONDS_PER_AUDIO_SECOND
+    return REQUEST_OVERHEAD_SECONDS + duration * ratio
+
+
+def transcription_deadline(duration):
+    """Seconds allowed for transcribing `duration` seconds of audio, retries included."""
+    return BASE_DEADLINE + duration * DEADLINE_PER_AUDIO_SECOND
+
+
+def _open_audio(audio):
+    """Open a path, or wrap an in-memory upload without copying it."""
+    if isinstance(audio, (str, os.PathLike)):
+        return open(audio, "rb")
+    return BufferReader(audio, getattr(audio, "name", "audio.mp3"))
+
+
+def _transcribe_once(client, audio, duration, timeout, scope, abortable=False):
+    """Run a single transcription request.
+
+    Requests share the client's connection pool. An `abortable` one, a
+    hedged attempt that may lose the race, gets a connection of its own
+    that `scope` can close.
+    """
+    http_client = None
+    if abortable:
+        from openai import DefaultHttpxClient
+
+        http_client = DefaultHttpxClient(timeout=timeout)
+        scope.on_cancel(http_client.close)
+        client = client.with_options(http_client=http_client)
+    try:
+        with governed_call("whisper-1") as call:
+            # Time spent queueing for the governor is not the endpoint's
+            started = time.monotonic()
+            with _open_audio(audio) as audio_file:
+                response = client.with_options(
+                    timeout=timeout, max_retries=0
+                ).audio.transcriptions.with_raw_response.create(
+                    file=audio_file,
+                    model="whisper-1",
+                    # Segments cost nothing extra and give SRT, VTT and
+                    # timestamps later without transcribing again
+                    response_format="verbose_json",
+                    timestamp_granularities=["segment"],
+                    prompt="Keep the natural language spoken",
+                )
+            call.observe(response.headers)
+        _latency.record((time.monotonic() - started) / duration)
+        return from_verbose_json(response.parse())
+    finally:
+        if http_client is not None:
+            http_client.close()
+
+
+@profiled()
+def transcribe_audio(client, audio, hedge=HEDGE_TRANSCRIPTIONS):
+    """Transcribe an audio file using OpenAI's Whisper model.
+
+    `audio` is a file path or an in-memory upload (bytes, memoryview or a
+    BytesIO such as Streamlit's UploadedFile), which is streamed as-is.
+    Returns a transcript dict with the text, its timed segments and the audio
+    duration (see transcript_formats).
+
+    The call gets a deadline proportional to the audio duration, and transient
+    errors are retried with jittered backoff until it expires. With `hedge`, a
+    request still running past the recent p95 latency is duplicated and the
+    slower of the two is cancelled.
+    """
+    if isinstance(audio, (str, os.PathLike)):
+        duration = get_media_duration(audio)
+        size = os.path.getsize(audio)
+    else:
+        duration = None
+        size = buffer_size(audio)
+    if duration is None:
+        # Fall back to the size of a 128 kbps MP3, what extract_audio produces.
+        duration = size / (128_000 / 8)
+    duration = max(duration, 1.0)
+
+    hedge_after = None
+    if hedge:
+        p95 = _latency.percentile(95)
+        if p95 is not None:
+            hedge_after = p95 * duration
+
+    return call_with_retries(
+        lambda timeout: run_hedged(
+            lambda scope: _transcribe_once(
+                client, audio, duration, timeout, scope, hedge_after is not None
+            ),
+            hedge_after,
+        ),
+        deadline=time.monotonic() + transcription_deadline(duration),
+    )
+
+
+def transcribe_in_chunks(
+    client,
+    path,
+    hedge=HEDGE_TRANSCRIPTIONS,
+    chunk_seconds=CHUNK_SECONDS,
+    on_chunk=None,
+    first_chunk_seconds=None,
+):
+    """Transcribe a file too large for one request, in a format the endpoint
+    does not take, or to be shown as it arrives, by cutting its audio into
+    chunks.
+
+    `on_chunk(index, total, text)` is called from a worker thread as each
+    chunk finishes, in whatever order they finish. The segments of each
+    chunk are offset by the duration of the chunks before it. A
+    `first_chunk_seconds` shorter than the rest gets the first text back
+    sooner.
+
+    Chunks keep the bitrate of the source's audio stream, so they are made
+    shorter than `chunk_seconds` when needed to stay under the upload limit.
+    The first chunk to fail fails the file, and chunks not started yet are
+    dropped.
+    """
+    bitrate = chunk_bitrate(path)
+    if bitrate is None:
+        # Sized as if the whole file were audio, which is never too long
+        duration = get_media_duration(path)
+        bitrate = os.path.getsize(path) * 8 / duration if duration else None
+    if bitrate:
+        # Some headroom for container overhead and uneven bitrates
+        chunk_seconds = max(
+            1, min(chunk_seconds, int(0.9 * WHISPER_MAX_BYTES * 8 / bitrate))
         )
+    if first_chunk_seconds:
+        first_chunk_seconds = min(first_chunk_seconds, chunk_seconds)
+    with tempfile.TemporaryDirectory(prefix=temp_prefix()) as tmp_dir:
+        chunks = split_audio(path, tmp_dir, chunk_seconds, first_chunk_seconds)
+        print(f"Transcribing {os.path.basename(path)} in {len(chunks)} chunks")
+        transcripts = [None] * len(chunks)
+        with ThreadPoolExecutor(max_workers=min(len(chunks), CHUNK_WORKERS)) as pool:
+            futures = {
+                pool.submit(in_context(transcribe_audio), client, chunk, hedge): i
+                for i, chunk in enumerate(chunks)
+            }
+            try:
+                for future in as_completed(futures):
+                    i = futures[future]
+                    transcripts[i] = future.result()
+                    if on_chunk:
+                        on_chunk(i, len(chunks), transcripts[i]["text"])
+            except BaseException:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+    return join(transcripts, chunk_seconds)
+
+
+def worth_streaming(path):
+    """True if a file is long enough that a short first chunk pays off."""
+    duration = get_media_duration(path)
+    return duration is not None and duration > 2 * STREAM_FIRST_CHUNK_SECONDS
+
+
+def needs_chunking(path):
+    return os.path.getsize(path) > WHISPER_MAX_BYTES or not path.lower().endswith(
+        WHISPER_EXTENSIONS
+    )
+
+
+class ProgressiveTranscript:
+    """A transcript that fills in chunk by chunk.
+
+    Pass `add` as the `on_chunk` callback of a transcription; the page reads
+    `text()` while the chunks arrive. Chunks still running show as a gap.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chunks = {}
+        self.total = None
+        # Bumped on every change, so readers can skip redrawing
+        self.version = 0
 
+    def add(self, index, total, text):
+        with self._lock:
+            self.total = total
+            self._chunks[index] = text.strip()
+            self.version += 1
 
-def process_single_audio_file(client, file_path):
+    def progress(self):
+        with self._lock:
+            if self.total is None:
+                return "transcribing..."
+            if len(self._chunks) == self.total:
+                return "complete"
+            return f"{len(self._chunks)} of {self.total} parts"
+
+    def text(self):
+        with self._lock:
+            return "\n".join(
+                self._chunks.get(i, "[...]") for i in range(self.total or 0)
+            )
+
+
+def process_single_audio_file(file_path, overwrite=False):
     """Process a single audio file: transcribe and generate corrected transcript."""
+    # The backends build on this module
+    from transcription_backends import get_transcription_router
+
     try:
         file_name = os.path.basename(file_path)
         print("File:", file_name)
-        output_file = os.path.join(
-            "transcription", f"{os.path.splitext(file_name)[0]}.md"
-        )
+        local_name = os.path.splitext(file_name)[0]
+        store = get_transcript_store()
 
-        if os.path.exists(output_file):
+        # Files downloaded from S3 are stored under their key
+        s3_key = store.s3_key_for(local_name)
+
+        if not overwrite and store.has_transcript(s3_key=s3_key, local_name=local_name):
             print(f"Transcription for {file_name} already exists. Skipping.")
             return
 
-        transcript = transcribe_audio(client, file_path)
-
-        with open(output_file, "w") as f:
-            f.write(transcript)
+        transcript = get_transcription_router().transcribe(file_path)
+        # Pre-conditioned audio has its cut silences mapped next to it
+        map_path = timestamp_map_path(file_path)
+        if os.path.exists(map_path):
+            with open(map_path) as f:
+                transcript = reproject(transcript, json.load(f))
+        store.put(
+            transcript["text"],
+            s3_key=s3_key,
+            local_name=local_name,
+            segments=transcript["segments"],
+        )
 
     except Exception as e:
         print(f"Error processing {file_path}: {e}")
 
 
-def worker(queue, client):
+def worker(queue):
     """Worker function for thread pool."""
     while True:
         file_path = queue.get()
         if file_path is None:
             break
-        process_single_audio_file(client, file_path)
+        process_single_audio_file(file_path)
         queue.task_done()
 
 
-def process_all_audio_files(num_threads=4):
-    """Process all audio files in the 'audio' folder using multiple threads."""
-    client = OpenAI()
+def process_all_audio_files(num_threads=MAX_CONCURRENCY):
+    """Process all audio files in the 'audio' folder using multiple threads.
+
+    The shared rate governor decides how many calls actually run at once, so
+    `num_threads` is only an upper bound.
+    """
     queue = Queue()
 
     # Start worker threads
     threads = []
     for _ in range(num_threads):
-        t = threading.Thread(target=worker, args=(queue, client))
+        t = threading.Thread(target=worker, args=(queue,))
         t.start()
         threads.append(t)
 
     # Enqueue audio files
     for file_name in os.listdir("audio"):
-        if file_name.endswith((".mp3", ".m4a", ".wav")):
+        if file_name.endswith(audio_extensions):
             queue.put(os.path.join("audio", file_name))
 
     # Block until all tasks are done
@@ -1,15 +1,18 @@
-import boto3
 import os
-from botocore import UNSIGNED
-from botocore.config import Config
 from urllib.parse import quote
+from clients import get_s3_client
+from s3_listing import iter_s3_objects
+from transcript_store import get_transcript_store
 
 video_extensions = (".mp4", ".mov", ".mkv", ".avi")
 
 
 def create_file_info_map_from_s3(bucket_name: str, s3_path: str = None):
     """
-    Creates a file info map by reading from S3 and matching with local transcripts.
+    Creates a file info map by reading from S3 and matching with stored transcripts.
+
+    The transcript store is read in a single sequential scan up front rather
+    than opening one file per video.
 
     Args:
         bucket_name (str): Name of the S3 bucket
@@ -17,39 +20,35 @@ def create_file_info_map_from_s3(bucket_name: str, s3_path: str = None):
     Returns:
         dict: A dictionary with video information structure
     """
-    s3_client = boto3.client("s3", config=Config(signature_version=UNSIGNED))
+    s3_client = get_s3_client(anonymous=True)
     file_info_map = {}
 
+    by_key = {}
+    by_local_name = {}
+    for row in get_transcript_store().iter_transcripts():
+        if row["s3_key"]:
+            by_key[row["s3_key"]] = row
+        if row["local_name"]:
+            by_local_name[row["local_name"]] = row
+
     prefix = s3_path.rstrip("/") + "/" if s3_path else ""
 
-    # List objects in bucket
-    response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-
-    if "Contents" in response:
-        for obj in response["Contents"]:
-            key = obj["Key"]
-            # Check if file is a video
-            if key.lower().endswith(video_extensions):
-                # Get base name without extension
-                base_name = os.path.splitext(key)[0]
-                key_name = key.replace("/", "_")
-                # Check for corresponding transcription
-                transcript_file = os.path.join(
-                    "transcription", f"{os.path.splitext(key_name)[0]}.md"
-                )
-
-                # Read transcription if exists
-                transcription = ""
-                if os.path.exists(transcript_file):
-                    with open(transcript_file, "r", encoding="utf-8") as tf:
-                        transcription = tf.read()
-
-                # Create the file info entry
-                file_info_map[key] = {
-                    "url": f"https://{bucket_name}.s3.amazonaws.com/{quote(key)}",
-                    "title": base_name,
-                    "transcription": transcription,
-                    "transcription_file": transcript_file,
-                }
+    # List the videos in the bucket
+    for obj in iter_s3_objects(s3_client, bucket_name, prefix, video_extensions):
+        key = obj["Key"]
+        # Get base name without extension
+        base_name = os.path.splitext(key)[0]
+        # Match by S3 key first; the flattened local name is only a
+        # fallback for transcripts stored before the key was known
+        local_name = os.path.splitext(key.replace("/", "_"))[0]
+        row = by_key.get(key) or by_local_name.get(local_name) or {}
+
+        # Create the file info entry
+        file_info_map[key] = {
+            "url": f"https://{bucket_name}.s3.amazonaws.com/{quote(key)}",
+            "title": base_name,
+            "transcription": row.get("transcription", ""),
+            "segments": row.get("segments"),
+        }
 
     return file_info_map
@@ -0,0 +1,111 @@
+import math
+from itertools import pairwise
+
+from PIL import Image
+
+
+def dhash(image, hash_size=8):
+    """Difference hash of a PIL image as an int of hash_size**2 bits.
+
+    Resized or re-encoded copies of the same picture hash to values a few
+    bits apart, so the Hamming distance works as a similarity measure.
+    """
+    small = image.convert("L").resize(
+        (hash_size + 1, hash_size), Image.Resampling.LANCZOS
+    )
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+def _dct_matrix(size, coefficients):
+    return [
+        [math.cos(math.pi * k * (2 * n + 1) / (2 * size)) for n in range(size)]
+        for k in range(coefficients)
+    ]
+
+
+_DCT_32 = _dct_matrix(32, 8)
+
+
+def phash(image):
+    """64-bit DCT perceptual hash of a PIL image.
+
+    The image is reduced to 32x32 greyscale; the 8x8 lowest frequencies of its
+    DCT are compared with their median. More robust than dHash to contrast and
+    gamma changes from re-exports.
+    """
+    small = image.convert("L").resize((32, 32), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    rows = [pixels[i * 32 : (i + 1) * 32] for i in range(32)]
+    # Separable 2D DCT, keeping only the first 8 coefficients on each axis
+    row_coefficients = [
+        [sum(c * p for c, p in zip(basis, row)) for basis in _DCT_32] for row in rows
+    ]
+    low = [
+        sum(_DCT_32[k][n] * row_coefficients[n][col] for n in range(32))
+        for k in range(8)
+        for col in range(8)
+    ]
+    # The DC term only reflects overall brightness
+    median = sorted(low[1:])[len(low[1:]) // 2]
+    value = 0
+    for coefficient in low:
+        value = (value << 1) | (coefficient > median)
+    return value
+
+
+class HammingIndex:
+    """Finds stored 64-bit hashes within `max_distance` bits of a query.
+
+    Uses multi-index hashing: each hash is split into max_distance + 1
+    chunks, and any hash within range must match the query exactly on at
+    least one chunk (pigeonhole). A lookup is a handful of dict probes plus
+    a check of the few candidates they return, however large the index gets.
+    """
+
+    def __init__(self, max_distance=4, bits=64):
+        self.max_distance = max_distance
+        chunks = max_distance + 1
+        bounds = [round(i * bits / chunks) for i in range(chunks + 1)]
+        self._chunks = [
+            (bits - end, (1 << (end - start)) - 1) for start, end in pairwise(bounds)
+        ]
+        self._tables = [{} for _ in self._chunks]
+        self._hashes = []
+        self._values = []
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, value_hash, value):
+        item = len(self._hashes)
+        self._hashes.append(value_hash)
+        self._values.append(value)
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            table.setdefault((value_hash >> shift) & mask, []).append(item)
+
+    def search(self, query_hash, max_distance=None):
+        """Return (distance, value) pairs within range, closest first."""
+        if max_distance is None:
+            max_distance = self.max_distance
+        seen = set()
+        matches = []
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            for item in table.get((query_hash >> shift) & mask, ()):
+                if item in seen:
+                    continue
+                seen.add(item)
+                distance = hamming_distance(query_hash, self._hashes[item])
+                if distance <= max_distance:
+                    matches.append((distance, self._values[item]))
+        matches.sort(key=lambda match: match[0])
+        return matches
@@ -0,0 +1,111 @@
+import os
+import re
+import subprocess
+import tempfile
+
+from PIL import Image
+
+from caption_images import caption_images_batch
+from disk_manager import temp_prefix
+from image_hash import dhash, hamming_distance
+
+# ffmpeg scene score (0-1) above which a frame counts as a new scene
+SCENE_THRESHOLD = 0.3
+# Frames whose hashes differ by at most this many bits count as duplicates
+DUPLICATE_DISTANCE = 6
+# Keyframes are downscaled to this width before hashing and captioning
+KEYFRAME_WIDTH = 768
+MAX_KEYFRAMES = 60
+
+_PTS_TIME = re.compile(r"pts_time:(\d+(?:\.\d+)?)")
+
+
+def extract_scene_keyframes(video_path, output_dir, threshold=SCENE_THRESHOLD):
+    """Write the first frame and every scene-change frame of a video as JPEGs.
+
+    Returns (timestamp, path) pairs in playback order.
+    """
+    command = [
+        "ffmpeg",
+        "-i",
+        video_path,
+        "-vf",
+        f"select='eq(n,0)+gt(scene,{threshold})',showinfo,scale={KEYFRAME_WIDTH}:-2",
+        "-vsync",
+        "vfr",
+        "-q:v",
+        "3",
+        os.path.join(output_dir, "frame_%05d.jpg"),
+    ]
+    result = subprocess.run(
+        command,
+        check=True,
+        capture_output=True,  # showinfo reports frame times on stderr
+        text=True,
+    )
+    timestamps = [float(t) for t in _PTS_TIME.findall(result.stderr)]
+    frames = sorted(f for f in os.listdir(output_dir) if f.startswith("frame_"))
+    return [
+        (timestamp, os.path.join(output_dir, frame))
+        for timestamp, frame in zip(timestamps, frames)
+    ]
+
+
+def drop_near_duplicates(frames, max_distance=DUPLICATE_DISTANCE):
+    """Keep only frames that do not look like an already kept frame.
+
+    Slides are often revisited, so each frame is compared with every kept
+    frame rather than just the previous one.
+    """
+    kept = []
+    hashes = []
+    for timestamp, path in frames:
+        with Image.open(path) as image:
+            frame_hash = dhash(image)
+        if any(hamming_distance(frame_hash, h) <= max_distance for h in hashes):
+            continue
+        hashes.append(frame_hash)
+        kept.append((timestamp, path))
+    return kept
+
+
+def limit_frames(frames, max_frames=MAX_KEYFRAMES):
+    """Evenly thin out frames so a busy video stays within budget."""
+    if len(frames) <= max_frames:
+        return frames
+    step = len(frames) / max_frames
+    return [frames[int(i * step)] for i in range(max_frames)]
+
+
+def caption_frames(frames):
+    """Caption frames in packed requests, returning them in order."""
+    images = []
+    for _, path in frames:
+        with open(path, "rb") as f:
+            images.append(f.read())
+    captions = caption_images_batch(images)
+    return [
+        {"time": timestamp, "caption": caption}
+        for (timestamp, _), caption in zip(frames, captions)
+    ]
+
+
+def summarize_video(video_path, threshold=SCENE_THRESHOLD):
+    """Describe what is on screen in a video, one caption per distinct scene."""
+    with tempfile.TemporaryDirectory(prefix=temp_prefix()) as tmp_dir:
+        frames = extract_scene_keyframes(video_path, tmp_dir, threshold)
+        unique = limit_frames(drop_near_duplicates(frames))
+        print(
+            f"Captioning {len(unique)} of {len(frames)} keyframes "
+            f"from {os.path.basename(video_path)}"
+        )
+        return caption_frames(unique)
+
+
+def format_visual_summary(entries):
+    """Render summary entries as '[mm:ss] caption' lines."""
+    lines = []
+    for entry in entries:
+        minutes, seconds = divmod(int(entry["time"]), 60)
+        lines.append(f"[{minutes:02d}:{seconds:02d}] {entry['caption']}")
+    return "\n".join(lines)
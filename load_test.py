@@ -0,0 +1,547 @@
+"""Load test for the Streamlit pages.
+
+Runs many concurrent, authenticated sessions of Home.py and both pages in
+this process through Streamlit's app-testing API, with OpenAI, S3 and Troweb
+replaced by a local fake server, and reports how the app holds up as the
+number of sessions grows:
+
+    python load_test.py --levels 1 4 8 16 --iterations 2
+
+Nothing leaves the machine. The pages still need ffmpeg and ffprobe
+installed, as in production.
+
+Sessions share one process, as they do under `streamlit run`, so the loop
+lag and RSS columns show how much each level costs the server. AppTest
+itself keeps some state in globals; a lone missing widget at high levels is
+worth reproducing in a browser before treating it as a regression.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PAGES = {
+    "home": os.path.join(ROOT, "Home.py"),
+    "transcription": os.path.join(ROOT, "pages", "1_📝_Transcription.py"),
+    "captioning": os.path.join(ROOT, "pages", "2_🖼️_Captioning.py"),
+}
+BUCKET = "content-vidoes"  # The pages' default bucket name
+FLOWS = ["home", "transcribe-upload", "transcribe-s3", "caption-upload", "caption-s3"]
+# Reruns of a session that AppTest's shared globals broke (see Session.run)
+HARNESS_RETRIES = 2
+
+
+def make_wav(seconds=2.0, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\0\0" * int(seconds * rate))
+    return buffer.getvalue()
+
+
+def make_png(seed):
+    from PIL import Image
+
+    rng = random.Random(seed)
+    image = Image.new("RGB", (64, 64), tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class FakeBackends(BaseHTTPRequestHandler):
+    """OpenAI, S3 (path-style) and Troweb GraphQL on one local port."""
+
+    latency = 0.2
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type, headers=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._body()
+        if path.endswith("/audio/transcriptions"):
+            time.sleep(self.latency)
+            text = "Fake transcript of the uploaded clip."
+            self._send(
+                200,
+                json.dumps(
+                    {
+                        "text": text,
+                        "duration": 2.0,
+                        "segments": [{"start": 0.0, "end": 2.0, "text": text}],
+                    }
+                ),
+                "application/json",
+            )
+        elif path.endswith("/responses"):
+            time.sleep(self.latency)
+            self._send(
+                200, json.dumps(self._caption_response(body)), "application/json"
+            )
+        elif path.endswith("/graphql"):
+            request = json.loads(body)
+            query = request["query"]
+            if "createBulkOperation" in query:
+                data = {"createBulkOperation": {"_id": "load-test-job"}}
+            elif "createVideo" in query:
+                data = {
+                    f"create{i}": {"_id": f"load-test-video-{uuid.uuid4().hex}"}
+                    for i in range(len(request["variables"]))
+                }
+            else:
+                data = {"start": {"status": "started"}}
+            self._send(200, json.dumps({"data": data}), "application/json")
+        else:
+            self._send(404, "not found", "text/plain")
+
+    def _caption_response(self, body):
+        request = json.loads(body)
+        content = request["input"][0]["content"]
+        images = sum(1 for part in content if part["type"] == "input_image")
+        if "text" in request:
+            text = json.dumps(
+                {
+                    "captions": [
+                        {"index": i, "caption": f"Fake caption {i}."}
+                        for i in range(images)
+                    ]
+                }
+            )
+        else:
+            text = "Fake caption."
+        return {
+            "id": "resp_load_test",
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": request.get("model", ""),
+            "status": "completed",
+            "parallel_tool_calls": False,
+            "tool_choice": "auto",
+            "tools": [],
+            "output": [
+                {
+                    "id": "msg_load_test",
+                    "type": "message",
+                    "role": "assistant",
+                    "status": "completed",
+                    "content": [
+                        {"type": "output_text", "text": text, "annotations": []}
+                    ],
+                }
+            ],
+        }
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = unquote(url.path).lstrip("/").split("/", 1)
+        if len(parts) == 1 or not parts[1]:
+            query = parse_qs(url.query)
+            self._list_objects(
+                query.get("prefix", [""])[0], query.get("delimiter", [""])[0]
+            )
+            return
+        data = self.server.objects.get(parts[1])
+        if data is None:
+            self._send(404, "<Error><Code>NoSuchKey</Code></Error>", "application/xml")
+            return
+        headers = {
+            "ETag": f'"{hash(data) & 0xFFFFFFFF:08x}"',
+            "Accept-Ranges": "bytes",
+            "Last-Modified": formatdate(usegmt=True),
+        }
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2) or len(data) - 1)
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            self._send(206, data[start : end + 1], "application/octet-stream", headers)
+        else:
+            self._send(200, data, "application/octet-stream", headers)
+
+    do_HEAD = do_GET
+
+    def _list_objects(self, prefix, delimiter=""):
+        keys = sorted(k for k in self.server.objects if k.startswith(prefix))
+        common_prefixes = []
+        if delimiter:
+            nested = {k for k in keys if delimiter in k[len(prefix) :]}
+            keys = [k for k in keys if k not in nested]
+            common_prefixes = sorted(
+                {
+                    prefix + k[len(prefix) :].split(delimiter, 1)[0] + delimiter
+                    for k in nested
+                }
+            )
+        contents = "".join(
+            f"<Contents><Key>{key}</Key>"
+            "<LastModified>2024-01-01T00:00:00.000Z</LastModified>"
+            f'<ETag>"{hash(self.server.objects[key]) & 0xFFFFFFFF:08x}"</ETag>'
+            f"<Size>{len(self.server.objects[key])}</Size>"
+            "<StorageClass>STANDARD</StorageClass></Contents>"
+            for key in keys
+        ) + "".join(
+            f"<CommonPrefixes><Prefix>{p}</Prefix></CommonPrefixes>"
+            for p in common_prefixes
+        )
+        self._send(
+            200,
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Name>{BUCKET}</Name><Prefix>{prefix}</Prefix>"
+            f"<KeyCount>{len(keys) + len(common_prefixes)}</KeyCount><MaxKeys>1000</MaxKeys>"
+            f"<IsTruncated>false</IsTruncated>{contents}</ListBucketResult>",
+            "application/xml",
+        )
+
+
+class FakeServer(ThreadingHTTPServer):
+    """Serves FakeBackends, holding the bucket's objects."""
+
+    request_queue_size = 128
+
+    def __init__(self, objects):
+        super().__init__(("127.0.0.1", 0), FakeBackends)
+        self.objects = objects
+
+
+def start_fake_backends(latency, media_files, images):
+    FakeBackends.latency = latency
+    server = FakeServer(
+        {f"media/clip_{i}.wav": make_wav() for i in range(media_files)}
+        | {f"images/image_{i}.png": make_png(i) for i in range(images)}
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def configure_environment(base_url, work_dir):
+    """Point every client at the fake server. Must run before the app imports."""
+    os.environ.update(
+        {
+            "OPENAI_BASE_URL": f"{base_url}/v1",
+            "OPENAI_API_KEY": "load-test",
+            "AWS_ENDPOINT_URL": base_url,
+            "AWS_ACCESS_KEY_ID": "load-test",
+            "AWS_SECRET_ACCESS_KEY": "load-test",
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "TROWEB_GRAPHQL_URL": f"{base_url}/graphql",
+            "TW_TOKEN": "load-test",
+            "TRANSCRIPTION_BACKEND": "openai",
+            "TRANSCRIPT_STORE_PATH": os.path.join(work_dir, "transcripts.db"),
+            "CAPTION_INDEX_PATH": os.path.join(work_dir, "caption_index.db"),
+        }
+    )
+    # The pages write their working files to the current directory
+    os.chdir(work_dir)
+    sys.path.insert(0, ROOT)
+
+    from streamlit import config
+
+    # AppTest turns this option on for each run and back off when the run
+    # ends, which breaks other sessions running at the same time. Keeping it
+    # on for the whole test makes those restores no-ops.
+    config.set_option("global.appTest", True)
+
+
+def current_rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+
+    # Peak rather than current where /proc is not available (kB on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class LoopMonitor:
+    """Measures how late an asyncio loop's timers fire while sessions run.
+
+    The app-testing API runs scripts without the Tornado server, so this loop
+    stands in for the server's: time it cannot get the GIL for is time the
+    real server could not serve websocket traffic. Also samples RSS.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        asyncio.run(self._tick())
+
+    async def _tick(self):
+        loop = asyncio.get_running_loop()
+        while not self._stop.is_set():
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - expected))
+            self.peak_rss = max(self.peak_rss, current_rss())
+
+    def blocked_seconds(self, threshold=0.05):
+        return sum(lag for lag in self.lags if lag > threshold)
+
+
+class Session:
+    """One simulated editor: an authenticated AppTest session."""
+
+    def __init__(self, page, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        self.app = AppTest.from_file(PAGES[page], default_timeout=timeout)
+        self.app.session_state["authenticated"] = True
+        self.app.session_state["username"] = "load-test"
+        self.reruns = []
+        self.errors = []
+        self.retries = 0
+
+    def run(self, step):
+        started = time.perf_counter()
+        try:
+            for attempt in range(HARNESS_RETRIES + 1):
+                try:
+                    self.app.run()
+                    break
+                except KeyError as e:
+                    # AppTest keeps the runtime and page registry in globals,
+                    # so a concurrent session can make a run skip the page.
+                    # That is the harness, not the app: run it again.
+                    if "STREAMLIT_INTERNAL" not in str(e) or attempt == HARNESS_RETRIES:
+                        raise
+                    self.retries += 1
+        except Exception as e:
+            self.errors.append(f"{step}: {type(e).__name__}: {e}")
+            return False
+        finally:
+            self.reruns.append(time.perf_counter() - started)
+        failures = [f"{step}: {e.value}" for e in self.app.exception]
+        failures += [f"{step}: {e.value}" for e in self.app.error]
+        self.errors += failures
+        return not failures
+
+    def button(self, label):
+        return self._find(self.app.button, label)
+
+    def radio(self, label):
+        return self._find(self.app.radio, label)
+
+    def _find(self, widgets, label):
+        for widget in widgets:
+            if widget.label == label:
+                return widget
+        raise LookupError(f"No {widgets[0].type if widgets else 'widget'} {label!r}")
+
+
+def run_flow(flow, timeout, media_files, images):
+    """Drive one session through a flow, returning its rerun times and errors."""
+    page = {"home": "home"}.get(flow, flow.split("-")[0])
+    page = {"transcribe": "transcription", "caption": "captioning"}.get(page, page)
+    session = Session(page, timeout)
+    try:
+        session.run("load")
+        if flow == "transcribe-upload":
+            clips = [(f"clip_{i}.wav", make_wav(), "audio/wav") for i in range(2)]
+            session.app.file_uploader[0].set_value(clips)
+            session.button("Process Files").click()
+            session.run("transcribe uploads")
+            session.button("🚀 Send Transcribed Files to Troweb").click()
+            session.run("send to Troweb")
+        elif flow == "transcribe-s3":
+            session.radio("Select Source").set_value("Load from S3")
+            session.run("list S3")
+            session.button("Plan Processing").click()
+            session.run("plan")
+            start = session.button("Start Processing")
+            if start.disabled:
+                raise RuntimeError(
+                    "Nothing to process in the plan (is ffprobe installed?)"
+                )
+            start.click()
+            session.run("transcribe S3 files")
+        elif flow == "caption-upload":
+            uploads = [(f"image_{i}.png", make_png(i), "image/png") for i in range(3)]
+            session.app.file_uploader[0].set_value(uploads)
+            session.run("caption uploads")
+            session.button("🚀 Send Captioned Images to Troweb").click()
+            session.run("send to Troweb")
+        elif flow == "caption-s3":
+            session.radio("Select Source").set_value("Load from S3")
+            session.run("list S3")
+            if not session.app.multiselect:
+                warnings = [w.value for w in session.app.warning]
+                raise LookupError(f"No image selection on the page: {warnings}")
+            selection = session.app.multiselect[0]
+            selection.set_value(selection.options[: min(3, images)])
+            session.run("caption S3 images")
+    except Exception as e:
+        session.errors.append(f"{flow}: {type(e).__name__}: {e}")
+    return session.reruns, session.errors, session.retries
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_level(sessions, iterations, flows, timeout, media_files, images):
+    """Run `sessions` concurrent sessions, each going through `flows` in turn."""
+    jobs = [
+        flows[(session + i) % len(flows)]
+        for session in range(sessions)
+        for i in range(iterations)
+    ]
+    reruns = []
+    errors = []
+    retries = 0
+    started = time.perf_counter()
+    with LoopMonitor() as monitor, ThreadPoolExecutor(max_workers=sessions) as pool:
+        futures = [
+            pool.submit(run_flow, flow, timeout, media_files, images) for flow in jobs
+        ]
+        failed_flows = 0
+        for future in futures:
+            flow_reruns, flow_errors, flow_retries = future.result()
+            reruns += flow_reruns
+            errors += flow_errors
+            retries += flow_retries
+            failed_flows += bool(flow_errors)
+    return {
+        "sessions": sessions,
+        "flows": len(jobs),
+        "wall_seconds": round(time.perf_counter() - started, 2),
+        "rerun_p50": round(statistics.median(reruns), 3) if reruns else 0.0,
+        "rerun_p95": round(percentile(reruns, 95), 3),
+        "rerun_max": round(max(reruns, default=0.0), 3),
+        "peak_rss_mb": round(monitor.peak_rss / 1_000_000, 1),
+        "loop_lag_max": round(max(monitor.lags, default=0.0), 3),
+        "loop_blocked_seconds": round(monitor.blocked_seconds(), 2),
+        "error_rate": round(failed_flows / len(jobs), 3),
+        "harness_retries": retries,
+        "errors": errors[:20],
+    }
+
+
+def print_report(results):
+    columns = [
+        ("sessions", "Sessions"),
+        ("flows", "Flows"),
+        ("wall_seconds", "Wall s"),
+        ("rerun_p50", "Rerun p50"),
+        ("rerun_p95", "Rerun p95"),
+        ("rerun_max", "Rerun max"),
+        ("peak_rss_mb", "RSS MB"),
+        ("loop_lag_max", "Loop lag max"),
+        ("loop_blocked_seconds", "Loop blocked s"),
+        ("error_rate", "Error rate"),
+        ("harness_retries", "Retries"),
+    ]
+    print("  ".join(f"{title:>14}" for _, title in columns))
+    for result in results:
+        print("  ".join(f"{result[key]:>14}" for key, _ in columns))
+    for result in results:
+        for error in result["errors"]:
+            print(f"[{result['sessions']} sessions] {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Streamlit pages.")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--iterations", type=int, default=1)
+    parser.add_argument("--flows", nargs="+", choices=FLOWS, default=FLOWS)
+    parser.add_argument(
+        "--latency", type=float, default=0.2, help="Fake API latency in seconds"
+    )
+    parser.add_argument("--media-files", type=int, default=4)
+    parser.add_argument("--images", type=int, default=6)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    server = start_fake_backends(args.latency, args.media_files, args.images)
+    work_dir = tempfile.mkdtemp(prefix="troweb-load-test-")
+    configure_environment(f"http://127.0.0.1:{server.server_port}", work_dir)
+    print(f"Fake backends on port {server.server_port}, working in {work_dir}")
+
+    # Import the app's modules and compile each page once, so the first level
+    # does not measure start-up
+    for page in PAGES:
+        Session(page, args.timeout).run("warm-up")
+
+    results = []
+    for sessions in args.levels:
+        result = run_level(
+            sessions,
+            args.iterations,
+            args.flows,
+            args.timeout,
+            args.media_files,
+            args.images,
+        )
+        results.append(result)
+        print(
+            f"{sessions} sessions: rerun p95 {result['rerun_p95']}s, "
+            f"error rate {result['error_rate']}"
+        )
+
+    print_report(results)
+    if args.json:
+        # The working directory moved into the temp dir; resolve against the
+        # directory the command was started from.
+        with open(os.path.join(os.environ.get("PWD", ROOT), args.json), "w") as f:
+            json.dump(results, f, indent=2)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import streamlit as st
+
+from profiling import PROFILE_DIR
+
+
+def show_send_result(result, ids):
+    """Report the result of `insert_all` on the page and record the Troweb
+    id of each item in `ids`. Returns False if the send failed."""
+    if result is None:
+        st.error(
+            "Sending to Troweb failed, see the server log. Items sent before "
+            "the failure are recorded and will not be sent twice."
+        )
+        return False
+
+    ids.update(result["ids"])
+    if not result["sent"]:
+        st.info(
+            "Nothing to send: every item is unchanged since it was last sent "
+            "to this collection."
+        )
+    else:
+        st.success(
+            f"Sent to Troweb: {result['created']} created, {result['updated']} updated"
+        )
+        if result["unchanged"]:
+            st.caption(f"Skipped {result['unchanged']} unchanged items")
+    if result["unidentified"]:
+        st.warning(
+            f"{result['unidentified']} changed items were not sent: they were "
+            "sent before their Troweb ids were recorded, so sending them again "
+            "would create copies. Record their ids with "
+            "`python send_ledger.py set-id`."
+        )
+    return True
+
+
+def profiling_sidebar():
+    """The sidebar toggle that profiles this session's page runs."""
+    st.toggle(
+        "Profile page runs",
+        key="profile_pages",
+        help=f"Write a flamegraph and timing breakdown of each run to `{PROFILE_DIR}/`",
+    )
@@ -1,28 +1,41 @@
 import os
 import streamlit as st
 import tempfile
-from openai import OpenAI
-import boto3
-from botocore import UNSIGNED
-from botocore.config import Config
-from extract_transcript import transcribe_audio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from clients import get_s3_client
+from disk_manager import ensure_space, sweep_once, temp_prefix
+from extract_audio import extract_audio_file, precondition_audio, timestamp_map_path
+from extract_transcript import WHISPER_EXTENSIONS, ProgressiveTranscript
+from download import video_extensions
+from keyframes import format_visual_summary, summarize_video
+from planner import format_duration, plan_media, plan_rows, plan_summary
+from prefetch import close_session_prefetcher, get_session_prefetcher
 import json
-from send_to_troweb import insert_all
+from send_to_troweb import TRANSCRIPT_FORMAT, insert_all
+from s3_listing import iter_s3_objects
+from transcript_formats import FORMATS, available_formats, render, reproject
+from transcript_store import get_transcript_store
+from transcription_backends import fits_single_request, get_transcription_router
 import asyncio
-import aiohttp
 from auth import login_page, logout
+from page_ui import profiling_sidebar, show_send_result
+from profiling import in_context, profile_page, profiled
 
-# Initialize OpenAI client
-client = OpenAI()
-
-# Constants for concurrency
+# Constants for concurrency. Transcription concurrency is not capped here: the
+# process-wide rate governor in `transcribe_audio` adapts it to the API quota
+# across every session.
 MAX_CONCURRENT_DOWNLOADS = 5
-MAX_CONCURRENT_TRANSCRIPTIONS = 3  # OpenAI API has rate limits
+MAX_CONCURRENT_UPLOADS = 5
+# How often transcripts still coming in are redrawn
+LIVE_REFRESH_SECONDS = 0.5
 
 # Page config
 st.set_page_config(
     page_title="Transcription - Troweb Assistant", page_icon="📝", layout="wide"
 )
+profile_page("transcription", st.session_state.get("profile_pages", False))
+# Temporary files of a server that died mid-download
+sweep_once()
 
 # Check authentication
 authenticated, username = login_page()
@@ -33,6 +46,7 @@ if authenticated:
         st.write(f"👤 Logged in as: {username}")
         if st.button("🚪 Logout"):
             logout()
+        profiling_sidebar()
 
     # Sidebar configuration
     with st.sidebar:
@@ -70,17 +84,44 @@ if authenticated:
             aws_secret_key = st.text_input("AWS Secret Access Key", type="password")
             aws_region = st.text_input("AWS Region", value="us-east-1")
 
-        # Initialize S3 client
+        # Initialize S3 client, built once per set of credentials
         if auth_mode == "Anonymous (Public Bucket)":
-            s3_client = boto3.client("s3", config=Config(signature_version=UNSIGNED))
+            s3_client = get_s3_client(anonymous=True)
         else:
-            s3_client = boto3.client(
-                "s3",
-                aws_access_key_id=aws_access_key,
-                aws_secret_access_key=aws_secret_key,
-                region_name=aws_region,
+            s3_client = get_s3_client(
+                access_key=aws_access_key,
+                secret_key=aws_secret_key,
+                region=aws_region,
             )
 
+        # Transcription Settings
+        st.subheader("Transcription Settings")
+        hedge_requests = st.checkbox(
+            "Hedge slow transcriptions",
+            value=False,
+            help="Send a duplicate request when a transcription runs past the "
+            "usual p95 latency and keep whichever finishes first",
+        )
+        precondition = st.checkbox(
+            "Pre-condition audio",
+            value=False,
+            help="Cut silences and send 16 kHz Opus instead of the original "
+            "track, to shrink uploads and transcription time",
+        )
+        add_visual_summary = st.checkbox(
+            "Add visual summary for videos",
+            value=False,
+            help="Caption the distinct scenes of each video and send them to "
+            "Troweb along with the transcript",
+        )
+        troweb_format = st.selectbox(
+            "Transcript format for Troweb",
+            list(FORMATS),
+            index=list(FORMATS).index(TRANSCRIPT_FORMAT),
+            help="All formats come from the same transcription; items "
+            "transcribed before segments were kept are sent as text",
+        )
+
         # Show stored IDs
         if "transcript_ids" in st.session_state and st.session_state.transcript_ids:
             st.subheader("📝 Stored Transcripts")
@@ -96,6 +137,8 @@ if authenticated:
         st.session_state.transcript_ids = {}
     if "transcripts" not in st.session_state:
         st.session_state.transcripts = {}
+    if "transcript_segments" not in st.session_state:
+        st.session_state.transcript_segments = {}
     if "processed_files" not in st.session_state:
         st.session_state.processed_files = set()
     if "processed_items" not in st.session_state:
@@ -106,6 +149,12 @@ if authenticated:
         st.session_state.selected_s3_files = None
     if "file_statuses" not in st.session_state:
         st.session_state.file_statuses = {}
+    if "timestamp_maps" not in st.session_state:
+        st.session_state.timestamp_maps = {}
+    if "media_plan" not in st.session_state:
+        st.session_state.media_plan = None
+        # What the plan was made for; it is dropped once any of it changes
+        st.session_state.media_plan_inputs = None
 
     st.title("📝 Audio/Video Transcription")
     st.info(
@@ -116,18 +165,12 @@ if authenticated:
         """Send processed items to Troweb and store their IDs"""
         try:
             with st.spinner("Creating Troweb job..."):
-                result = insert_all(items, collection_id)
-
-                # Store IDs in session state
-                if result and "data" in result:
-                    for item in items:
-                        file_name = item.get("title", "")
-                        if file_name:
-                            st.session_state.transcript_ids[file_name] = result[
-                                "data"
-                            ].get("_id")
+                result = insert_all(
+                    items, collection_id, transcript_format=troweb_format
+                )
 
-                st.success("Successfully sent to Troweb!")
+                if not show_send_result(result, st.session_state.transcript_ids):
+                    return False
 
                 # Save processed files for reference
                 with open("transcript_info.json", "w") as f:
@@ -138,17 +181,15 @@ if authenticated:
             st.error(f"Error sending to Troweb: {str(e)}")
             return False
 
+    @profiled()
     def list_s3_files(client, bucket, prefix="", extensions=()):
         """List files in S3 bucket with given extensions"""
         files = []
         prefix = prefix.rstrip("/") + "/" if prefix else ""
 
         try:
-            response = client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-            if "Contents" in response:
-                for obj in response["Contents"]:
-                    if obj["Key"].lower().endswith(extensions):
-                        files.append(obj["Key"])
+            for obj in iter_s3_objects(client, bucket, prefix, extensions):
+                files.append(obj["Key"])
         except Exception as e:
             st.error(f"Error listing S3 files: {str(e)}")
 
@@ -157,7 +198,7 @@ if authenticated:
     async def download_s3_file(session, s3_key, bucket_name):
         """Download a single file from S3 asynchronously"""
         temp_file = tempfile.NamedTemporaryFile(
-            delete=False, suffix=os.path.splitext(s3_key)[1]
+            delete=False, prefix=temp_prefix(), suffix=os.path.splitext(s3_key)[1]
         )
         try:
             # Generate presigned URL for the S3 object
@@ -169,6 +210,12 @@ if authenticated:
 
             async with session.get(url) as response:
                 if response.status == 200:
+                    # Eviction walks and deletes files; keep it off the loop
+                    await asyncio.to_thread(
+                        ensure_space,
+                        response.content_length or 0,
+                        os.path.dirname(temp_file.name),
+                    )
                     content = await response.read()
                     temp_file.write(content)
                     temp_file.close()
@@ -182,12 +229,60 @@ if authenticated:
             os.unlink(temp_file.name)
             raise e
 
-    async def process_file_async(s3_key, bucket_name, progress_bar, progress_text):
-        """Process a single file asynchronously"""
+    def start_live_transcript(panels, container, file_key):
+        """Add a panel to `container` showing a transcript as it arrives"""
+        transcript = ProgressiveTranscript()
+        panels[file_key] = {
+            "transcript": transcript,
+            "placeholder": container.empty(),
+            "shown": 0,
+        }
+        return transcript
+
+    def show_live_transcripts(panels):
+        """Redraw the live panels whose transcript changed"""
+        for file_key, panel in panels.items():
+            transcript = panel["transcript"]
+            version = transcript.version
+            if version == panel["shown"]:
+                continue
+            panel["shown"] = version
+            text = transcript.text()
+            with panel["placeholder"].container():
+                with st.expander(
+                    f"Transcript for {file_key} ({transcript.progress()})"
+                ):
+                    st.text_area(
+                        "",
+                        value=text,
+                        height=200,
+                        disabled=True,
+                        key=f"live_{file_key}_{version}",
+                    )
+                    # Downloading must not rerun the page and stop the batch
+                    st.download_button(
+                        "Download Transcript So Far",
+                        text,
+                        file_name=f"{file_key}_transcript.txt",
+                        mime="text/plain",
+                        key=f"live_download_{file_key}_{version}",
+                        on_click="ignore",
+                    )
+
+    def clear_live_transcripts(panels):
+        """Remove the live panels once the page can show the final transcripts"""
+        for panel in panels.values():
+            panel["placeholder"].empty()
+
+    async def process_file_async(
+        s3_key, route, bucket_name, progress_bar, progress_text, panels, live_area
+    ):
+        """Process a single file asynchronously, along its planned route"""
         file_key = os.path.splitext(os.path.basename(s3_key))[0]
 
         if file_key in st.session_state.processed_files:
             return True
+        prefetcher = st.session_state.get("prefetcher")
 
         # Initialize status for this file
         st.session_state.file_statuses[file_key] = {
@@ -197,6 +292,9 @@ if authenticated:
             "error": None,
         }
 
+        # Imported here, so the login screen does not wait for it
+        import aiohttp
+
         try:
             async with aiohttp.ClientSession() as session:
                 # Update download status
@@ -205,7 +303,12 @@ if authenticated:
                 progress_text.text(f"Downloading {os.path.basename(s3_key)}...")
 
                 try:
-                    temp_path = await download_s3_file(session, s3_key, bucket_name)
+                    # Usually already downloaded by the prefetcher
+                    temp_path = None
+                    if prefetcher is not None:
+                        temp_path = await asyncio.to_thread(prefetcher.wait, s3_key)
+                    if temp_path is None:
+                        temp_path = await download_s3_file(session, s3_key, bucket_name)
                     st.session_state.file_statuses[file_key]["download"] = "completed"
                 except Exception as e:
                     st.session_state.file_statuses[file_key]["download"] = "failed"
@@ -220,15 +323,58 @@ if authenticated:
                     )
                     progress_text.text(f"Transcribing {os.path.basename(s3_key)}...")
 
-                    transcript = transcribe_audio(client, temp_path)
+                    audio_path = temp_path
+                    if precondition:
+                        audio_path = os.path.splitext(temp_path)[0] + ".ogg"
+                        report = await asyncio.to_thread(
+                            precondition_audio, temp_path, audio_path
+                        )
+                        st.session_state.file_statuses[file_key]["saved"] = (
+                            format_savings(report)
+                        )
+                        st.session_state.timestamp_maps[file_key] = report[
+                            "timestamp_map"
+                        ]
+
+                    live_transcript = start_live_transcript(panels, live_area, file_key)
+                    transcript = await asyncio.to_thread(
+                        get_transcription_router().transcribe,
+                        audio_path,
+                        hedge_requests,
+                        live_transcript.add,
+                        route,
+                    )
+                    transcript = reproject(
+                        transcript, st.session_state.timestamp_maps.get(file_key)
+                    )
+
+                    visual_summary = None
+                    if add_visual_summary and s3_key.lower().endswith(video_extensions):
+                        progress_text.text(
+                            f"Captioning scenes of {os.path.basename(s3_key)}..."
+                        )
+                        visual_summary = format_visual_summary(
+                            await asyncio.to_thread(summarize_video, temp_path)
+                        )
 
                     # Store results
-                    st.session_state.transcripts[file_key] = transcript
+                    get_transcript_store().put(
+                        transcript["text"],
+                        s3_key=s3_key,
+                        title=os.path.splitext(s3_key)[0],
+                        segments=transcript["segments"],
+                    )
+                    st.session_state.transcripts[file_key] = transcript["text"]
+                    st.session_state.transcript_segments[file_key] = transcript[
+                        "segments"
+                    ]
                     st.session_state.processed_files.add(file_key)
                     st.session_state.processed_items.append(
                         {
                             "title": file_key,
-                            "transcription": transcript,
+                            "transcription": transcript["text"],
+                            "segments": transcript["segments"],
+                            "visual_summary": visual_summary,
                             "url": f"https://{bucket_name}.s3.amazonaws.com/{s3_key}",
                         }
                     )
@@ -249,17 +395,26 @@ if authenticated:
                     st.session_state.file_statuses[file_key]["error"] = str(e)
                     raise e
                 finally:
-                    # Clean up temp file
-                    if os.path.exists(temp_path):
-                        os.unlink(temp_path)
+                    # Clean up temp files
+                    for path in (
+                        temp_path,
+                        os.path.splitext(temp_path)[0] + ".ogg",
+                        timestamp_map_path(temp_path),
+                    ):
+                        if os.path.exists(path):
+                            os.unlink(path)
+                    if prefetcher is not None:
+                        prefetcher.discard(s3_key)
 
         except Exception as e:
             st.session_state.file_statuses[file_key]["status"] = "failed"
             st.error(f"Error processing {s3_key}: {str(e)}")
             return False
 
-    async def process_files_async(s3_keys, bucket_name):
-        """Process multiple files concurrently"""
+    @profiled()
+    async def process_files_async(routes, bucket_name):
+        """Process multiple files concurrently, `routes` mapping each S3 key
+        to its planned route"""
         # Clear previous statuses
         st.session_state.file_statuses = {}
 
@@ -268,29 +423,46 @@ if authenticated:
 
         # Create status display columns
         status_container = st.container()
+        # Transcripts show here chunk by chunk while the batch runs
+        live_area = st.container()
+        panels = {}
+
+        async def refresh_live_transcripts():
+            while True:
+                show_live_transcripts(panels)
+                await asyncio.sleep(LIVE_REFRESH_SECONDS)
 
-        # Create semaphores for rate limiting
+        # Create semaphore for rate limiting
         download_sem = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
-        transcribe_sem = asyncio.Semaphore(MAX_CONCURRENT_TRANSCRIPTIONS)
 
-        async def process_with_semaphores(s3_key):
+        async def process_with_semaphores(s3_key, route):
             async with download_sem:
-                async with transcribe_sem:
-                    result = await process_file_async(
-                        s3_key, bucket_name, progress_bar, progress_text
-                    )
-                    # Update status display after each file
-                    with status_container:
-                        display_status_table()
-                    return result
+                result = await process_file_async(
+                    s3_key,
+                    route,
+                    bucket_name,
+                    progress_bar,
+                    progress_text,
+                    panels,
+                    live_area,
+                )
+                # Update status display after each file
+                with status_container:
+                    display_status_table()
+                return result
 
         # Process files concurrently
-        tasks = [process_with_semaphores(s3_key) for s3_key in s3_keys]
+        refresher = asyncio.create_task(refresh_live_transcripts())
+        tasks = [
+            process_with_semaphores(s3_key, route) for s3_key, route in routes.items()
+        ]
         results = await asyncio.gather(*tasks, return_exceptions=True)
+        refresher.cancel()
 
         # Clear progress indicators but keep status table
         progress_bar.empty()
         progress_text.empty()
+        clear_live_transcripts(panels)
 
         # Final status update
         with status_container:
@@ -322,6 +494,9 @@ if authenticated:
                 "Transcription": f"{status_emojis[status['transcription']]} {status['transcription'].title()}",
             }
 
+            if status.get("saved"):
+                row["Saved"] = status["saved"]
+
             # Add error message if present
             if status["error"]:
                 row["Error"] = status["error"]
@@ -331,55 +506,171 @@ if authenticated:
         # Display as a table
         st.table(rows)
 
-    def process_uploaded_file(audio_file):
-        """Process a single uploaded file"""
-        file_key = os.path.splitext(audio_file.name)[0]
-        if file_key not in st.session_state.processed_files:
-            with st.spinner(f"Transcribing {audio_file.name}..."):
-                with tempfile.NamedTemporaryFile(
-                    delete=False, suffix=os.path.splitext(audio_file.name)[1]
-                ) as tmp_file:
-                    tmp_file.write(audio_file.getvalue())
-                    temp_path = tmp_file.name
+    def format_savings(report):
+        """Summarise a pre-conditioning report for display"""
+        return (
+            f"{report['bytes_saved'] / 1_000_000:.1f} MB, "
+            f"{report['seconds_saved']:.0f}s"
+        )
 
-                try:
-                    transcript = transcribe_audio(client, temp_path)
-                    st.session_state.transcripts[file_key] = transcript
-                    st.session_state.processed_files.add(file_key)
-                    st.session_state.processed_items.append(
-                        {
-                            "title": file_key,
-                            "transcription": transcript,
-                            "url": None,  # Local file
-                        }
-                    )
-                    return True
-                except Exception as e:
-                    st.error(f"Error processing {audio_file.name}: {str(e)}")
-                    return False
-                finally:
-                    os.unlink(temp_path)
-        return True
+    def transcribe_uploaded_file(audio_file, on_chunk=None):
+        """Transcribe an uploaded file, returning the transcript, any
+        pre-conditioning report and any visual summary"""
+        ext = os.path.splitext(audio_file.name)[1].lower()
+        summarize = add_visual_summary and ext in video_extensions
+        if (
+            ext in WHISPER_EXTENSIONS
+            and fits_single_request(audio_file)
+            and not precondition
+            and not summarize
+        ):
+            # Stream straight from the in-memory buffer
+            # Short clips go to the local engine when it is installed
+            router = get_transcription_router()
+            return router.transcribe(audio_file, hedge_requests, on_chunk), None, None
+
+        # ffmpeg needs a path for containers Whisper can't read directly
+        ensure_space(audio_file.size, tempfile.gettempdir())
+        with tempfile.TemporaryDirectory(prefix=temp_prefix()) as tmp_dir:
+            video_path = os.path.join(tmp_dir, f"input{ext}")
+            with open(video_path, "wb") as f:
+                f.write(audio_file.getbuffer())
+            report = None
+            if precondition:
+                audio_path = os.path.join(tmp_dir, "audio.ogg")
+                report = precondition_audio(video_path, audio_path)
+            elif ext in WHISPER_EXTENSIONS:
+                audio_path = video_path
+            else:
+                audio_path = os.path.join(tmp_dir, "audio.mp3")
+                extract_audio_file(video_path, audio_path)
+            transcript = get_transcription_router().transcribe(
+                audio_path, hedge_requests, on_chunk
+            )
+            if report:
+                transcript = reproject(transcript, report["timestamp_map"])
+            visual_summary = None
+            if summarize:
+                visual_summary = format_visual_summary(summarize_video(video_path))
+            return transcript, report, visual_summary
 
     def on_upload_submit():
         """Handle file upload submission"""
+        # Callbacks run before the script, so read the submitted widget value
+        st.session_state.uploaded_files = st.session_state.upload_selection
         if st.session_state.uploaded_files:
-            all_success = True
+            pending = {}
             for audio_file in st.session_state.uploaded_files:
-                if not process_uploaded_file(audio_file):
-                    all_success = False
+                file_key = os.path.splitext(audio_file.name)[0]
+                if file_key not in st.session_state.processed_files:
+                    pending[file_key] = audio_file
+            all_success = True
+            live_area = st.container()
+            panels = {}
+            with st.spinner(f"Transcribing {len(pending)} files..."):
+                # Transcribe in worker threads, but only touch session state
+                # and widgets from the script thread
+                with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_UPLOADS) as pool:
+                    futures = {
+                        pool.submit(
+                            in_context(transcribe_uploaded_file),
+                            audio_file,
+                            start_live_transcript(panels, live_area, file_key).add,
+                        ): file_key
+                        for file_key, audio_file in pending.items()
+                    }
+                    remaining = set(futures)
+                    while remaining:
+                        done, remaining = wait(
+                            remaining,
+                            timeout=LIVE_REFRESH_SECONDS,
+                            return_when=FIRST_COMPLETED,
+                        )
+                        show_live_transcripts(panels)
+                        for future in done:
+                            file_key = futures[future]
+                            try:
+                                transcript, report, visual_summary = future.result()
+                            except Exception as e:
+                                st.error(
+                                    f"Error processing {pending[file_key].name}: "
+                                    f"{str(e)}"
+                                )
+                                all_success = False
+                                continue
+                            get_transcript_store().put(
+                                transcript["text"],
+                                local_name=file_key,
+                                title=file_key,
+                                segments=transcript["segments"],
+                            )
+                            st.session_state.transcripts[file_key] = transcript["text"]
+                            st.session_state.transcript_segments[file_key] = transcript[
+                                "segments"
+                            ]
+                            st.session_state.processed_files.add(file_key)
+                            st.session_state.processed_items.append(
+                                {
+                                    "title": file_key,
+                                    "transcription": transcript["text"],
+                                    "segments": transcript["segments"],
+                                    "visual_summary": visual_summary,
+                                    "url": None,  # Local file
+                                }
+                            )
+                            if report:
+                                st.session_state.timestamp_maps[file_key] = report[
+                                    "timestamp_map"
+                                ]
+                                st.caption(
+                                    f"{file_key}: pre-conditioning saved "
+                                    f"{format_savings(report)}"
+                                )
+            clear_live_transcripts(panels)
             if all_success:
                 st.success("All files processed successfully!")
 
+    def plan_inputs():
+        return bucket_name, tuple(st.session_state.s3_selection), precondition
+
+    def on_s3_plan():
+        """Probe the selected S3 files and plan their processing"""
+        st.session_state.selected_s3_files = st.session_state.s3_selection
+        st.session_state.media_plan_inputs = plan_inputs()
+        if not st.session_state.selected_s3_files:
+            st.session_state.media_plan = None
+            return
+        # Files already prefetched are probed locally
+        prefetcher = st.session_state.get("prefetcher")
+        sources = {}
+        if prefetcher is not None:
+            for s3_key in st.session_state.selected_s3_files:
+                sources[s3_key] = prefetcher.wait(s3_key, timeout=0)
+        with st.spinner("Probing selected files..."):
+            st.session_state.media_plan = plan_media(
+                s3_client,
+                bucket_name,
+                st.session_state.selected_s3_files,
+                precondition,
+                sources=sources,
+            )
+
     def on_s3_submit():
-        """Handle S3 file selection submission"""
-        if st.session_state.selected_s3_files:
+        """Process the planned S3 files, longest first"""
+        plan = st.session_state.media_plan
+        st.session_state.media_plan = None
+        if plan and st.session_state.media_plan_inputs != plan_inputs():
+            st.warning("The selection changed since it was planned. Plan it again.")
+        elif plan:
+            routes = {
+                item["key"]: item["route"] for item in plan if item["route"] != "skip"
+            }
             # Run async processing in a new event loop
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             try:
                 all_success = loop.run_until_complete(
-                    process_files_async(st.session_state.selected_s3_files, bucket_name)
+                    process_files_async(routes, bucket_name)
                 )
                 if all_success:
                     st.success("All files processed successfully!")
@@ -393,6 +684,7 @@ if authenticated:
                             st.session_state.processed_items = []
                             st.session_state.processed_files = set()
                             st.session_state.transcripts = {}
+                            st.session_state.transcript_segments = {}
                             st.session_state.file_statuses = {}  # Clear statuses too
                             st.rerun()
             finally:
@@ -402,11 +694,13 @@ if authenticated:
     source = st.radio("Select Source", ["Upload Files", "Load from S3"])
 
     if source == "Upload Files":
+        close_session_prefetcher(st.session_state)
         with st.form("upload_form"):
             st.session_state.uploaded_files = st.file_uploader(
                 "Upload audio/video files",
                 type=["mp3", "m4a", "wav", "mp4", "avi", "mov"],
                 accept_multiple_files=True,
+                key="upload_selection",
             )
             submit_button = st.form_submit_button(
                 "Process Files", on_click=on_upload_submit
@@ -423,30 +717,77 @@ if authenticated:
         if not s3_files:
             st.warning("No audio/video files found in the specified S3 location.")
         else:
-            with st.form("s3_form"):
-                # Add select all checkbox
-                select_all = st.checkbox("Select All Files", value=True)
+            # Not in a form, so every change of selection reaches the
+            # prefetcher while the user is still choosing
+            # Add select all checkbox
+            select_all = st.checkbox("Select All Files", value=True)
+
+            # Auto-send to Troweb option
+            st.session_state.auto_send_troweb = st.checkbox(
+                "Automatically send to Troweb after processing", value=True
+            )
 
-                # Auto-send to Troweb option
-                st.session_state.auto_send_troweb = st.checkbox(
-                    "Automatically send to Troweb after processing", value=True
-                )
+            # If select all is True, pre-select all files
+            default_selection = s3_files if select_all else []
+            st.session_state.selected_s3_files = st.multiselect(
+                "Select files to transcribe",
+                s3_files,
+                default=default_selection,
+                format_func=lambda x: os.path.basename(x),
+                key="s3_selection",
+            )
 
-                # If select all is True, pre-select all files
-                default_selection = s3_files if select_all else []
-                st.session_state.selected_s3_files = st.multiselect(
-                    "Select files to transcribe",
-                    s3_files,
-                    default=default_selection,
-                    format_func=lambda x: os.path.basename(x),
-                )
+            # Start downloading the selection before Process is clicked
+            prefetcher = get_session_prefetcher(
+                st.session_state, s3_client, bucket_name
+            )
+            prefetcher.update(
+                [
+                    s3_key
+                    for s3_key in st.session_state.selected_s3_files
+                    if os.path.splitext(os.path.basename(s3_key))[0]
+                    not in st.session_state.processed_files
+                ]
+            )
 
-                total_files = len(st.session_state.selected_s3_files)
-                if total_files > 0:
-                    st.info(f"Selected {total_files} files for processing")
+            total_files = len(st.session_state.selected_s3_files)
+            if total_files > 0:
+                downloaded, prefetching, nbytes = prefetcher.progress()
+                st.info(
+                    f"Selected {total_files} files for processing "
+                    f"({downloaded} of {prefetching} downloaded ahead, "
+                    f"{nbytes / 1_000_000:.0f} MB)"
+                )
 
-                submit_button = st.form_submit_button(
-                    "Process Files", on_click=on_s3_submit
+            # A plan of another selection must not run
+            if st.session_state.media_plan_inputs != plan_inputs():
+                st.session_state.media_plan = None
+            st.button("Plan Processing", on_click=on_s3_plan)
+
+            # Show the plan for review before anything is transcribed
+            plan = st.session_state.media_plan
+            if plan:
+                summary = plan_summary(plan, MAX_CONCURRENT_DOWNLOADS)
+                st.subheader("Processing Plan")
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric("Files", summary["files"])
+                col2.metric("Audio", format_duration(summary["audio_minutes"] * 60))
+                col3.metric("Est. cost", f"${summary['cost']:.2f}")
+                col4.metric("Est. time", format_duration(summary["seconds"]))
+                if summary["skipped"]:
+                    st.warning(
+                        f"{summary['skipped']} files have no audio track or could "
+                        "not be read and will be skipped."
+                    )
+                if summary["chunked"]:
+                    st.info(
+                        f"{summary['chunked']} files will be transcribed in chunks."
+                    )
+                st.table(plan_rows(plan))
+                st.button(
+                    "Start Processing",
+                    on_click=on_s3_submit,
+                    disabled=not summary["files"],
                 )
 
     # Display processed transcripts
@@ -458,11 +799,20 @@ if authenticated:
                 height=200,
                 key=f"transcript_{file_key}",
             )
+            # Every format is rendered from the stored segments, locally
+            segments = st.session_state.transcript_segments.get(file_key)
+            fmt = st.radio(
+                "Format",
+                available_formats(segments),
+                horizontal=True,
+                key=f"transcript_format_{file_key}",
+            )
+            extension, mime = FORMATS[fmt]
             st.download_button(
                 "Download Transcript",
-                transcript,
-                file_name=f"{file_key}_transcript.txt",
-                mime="text/plain",
+                render(transcript, segments, fmt),
+                file_name=f"{file_key}_transcript{extension}",
+                mime=mime,
             )
 
     # Send to Troweb button
@@ -476,4 +826,5 @@ if authenticated:
                     st.session_state.processed_items = []
                     st.session_state.processed_files = set()
                     st.session_state.transcripts = {}
+                    st.session_state.transcript_segments = {}
                     st.rerun()  # Clear the page after successful send
@@ -1,18 +1,24 @@
 import os
 import streamlit as st
-import tempfile
-import boto3
-from botocore import UNSIGNED
-from botocore.config import Config
-from caption_images import caption_uploaded_image
+from concurrent.futures import ThreadPoolExecutor
+from caption_images import caption_images_batch, caption_uploaded_image
+from clients import get_s3_client
+from disk_manager import sweep_once
+from prefetch import close_session_prefetcher, get_session_prefetcher
+from s3_listing import iter_s3_objects
+from thumbnails import get_thumbnails
 import json
 from send_to_troweb import insert_all
 from auth import login_page, logout
+from page_ui import profiling_sidebar, show_send_result
+from profiling import in_context, profile_page, profiled
 
 # Page config
 st.set_page_config(
     page_title="Image Captioning - Troweb Assistant", page_icon="🖼️", layout="wide"
 )
+profile_page("captioning", st.session_state.get("profile_pages", False))
+sweep_once()
 
 # Check authentication
 authenticated, username = login_page()
@@ -23,6 +29,7 @@ if authenticated:
         st.write(f"👤 Logged in as: {username}")
         if st.button("🚪 Logout"):
             logout()
+        profiling_sidebar()
 
     # Sidebar configuration
     with st.sidebar:
@@ -60,15 +67,14 @@ if authenticated:
             aws_secret_key = st.text_input("AWS Secret Access Key", type="password")
             aws_region = st.text_input("AWS Region", value="us-east-1")
 
-        # Initialize S3 client
+        # Initialize S3 client, built once per set of credentials
         if auth_mode == "Anonymous (Public Bucket)":
-            s3_client = boto3.client("s3", config=Config(signature_version=UNSIGNED))
+            s3_client = get_s3_client(anonymous=True)
         else:
-            s3_client = boto3.client(
-                "s3",
-                aws_access_key_id=aws_access_key,
-                aws_secret_access_key=aws_secret_key,
-                region_name=aws_region,
+            s3_client = get_s3_client(
+                access_key=aws_access_key,
+                secret_key=aws_secret_key,
+                region=aws_region,
             )
 
         # Show stored IDs
@@ -84,6 +90,8 @@ if authenticated:
     # Initialize session state for caption IDs if not exists
     if "caption_ids" not in st.session_state:
         st.session_state.caption_ids = {}
+    if "s3_etags" not in st.session_state:
+        st.session_state.s3_etags = {}
 
     st.title("🖼️ Image Captioning")
     st.info("Upload images or select from S3 to generate AI-powered captions.")
@@ -94,16 +102,8 @@ if authenticated:
             with st.spinner("Creating Troweb job..."):
                 result = insert_all(items, collection_id)
 
-                # Store IDs in session state
-                if result and "data" in result:
-                    for item in items:
-                        file_name = item.get("title", "")
-                        if file_name:
-                            st.session_state.caption_ids[file_name] = result[
-                                "data"
-                            ].get("_id")
-
-                st.success("Successfully sent to Troweb!")
+                if not show_send_result(result, st.session_state.caption_ids):
+                    return False
 
                 # Save processed files for reference
                 with open("caption_info.json", "w") as f:
@@ -114,17 +114,17 @@ if authenticated:
             st.error(f"Error sending to Troweb: {str(e)}")
             return False
 
+    @profiled()
     def list_s3_files(client, bucket, prefix="", extensions=()):
-        """List files in S3 bucket with given extensions"""
+        """List files in S3 bucket with given extensions, remembering their
+        ETags for the thumbnail cache"""
         files = []
         prefix = prefix.rstrip("/") + "/" if prefix else ""
 
         try:
-            response = client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-            if "Contents" in response:
-                for obj in response["Contents"]:
-                    if obj["Key"].lower().endswith(extensions):
-                        files.append(obj["Key"])
+            for obj in iter_s3_objects(client, bucket, prefix, extensions):
+                files.append(obj["Key"])
+                st.session_state.s3_etags[obj["Key"]] = obj["ETag"]
         except Exception as e:
             st.error(f"Error listing S3 files: {str(e)}")
 
@@ -138,6 +138,8 @@ if authenticated:
     processed_items = []
 
     if source == "Upload Files":
+        # Nothing to prefetch for uploads
+        close_session_prefetcher(st.session_state)
         image_files = st.file_uploader(
             "Upload images",
             type=["jpg", "jpeg", "png", "webp"],
@@ -145,7 +147,13 @@ if authenticated:
         )
 
         if image_files:
-            for image_file in image_files:
+            # Caption all uploads in packed requests, straight from their
+            # buffers, while the previews render
+            pool = ThreadPoolExecutor(max_workers=1)
+            captions = pool.submit(in_context(caption_images_batch), list(image_files))
+            pool.shutdown(wait=False)
+
+            for index, image_file in enumerate(image_files):
                 col1, col2 = st.columns([1, 1])
 
                 with col1:
@@ -156,7 +164,7 @@ if authenticated:
                 with col2:
                     with st.spinner("Generating caption..."):
                         try:
-                            caption = caption_uploaded_image(image_file.getvalue())
+                            caption = captions.result()[index]
 
                             # Add to processed items
                             processed_items.append(
@@ -189,6 +197,7 @@ if authenticated:
 
         if not s3_files:
             st.warning("No image files found in the specified S3 location.")
+            close_session_prefetcher(st.session_state)
         else:
             selected_files = st.multiselect(
                 "Select images to caption",
@@ -196,28 +205,42 @@ if authenticated:
                 format_func=lambda x: os.path.basename(x),
             )
 
+            # Images in private buckets are read by the app, so download the
+            # whole selection in the background while earlier ones are captioned
+            prefetcher = None
+            if auth_mode != "Anonymous (Public Bucket)" and selected_files:
+                prefetcher = get_session_prefetcher(
+                    st.session_state, s3_client, bucket_name
+                )
+                prefetcher.update(selected_files)
+            else:
+                close_session_prefetcher(st.session_state)
+
             if selected_files:
+                # Small cached previews instead of the full-size originals,
+                # for public and private buckets alike
+                with st.spinner("Loading previews..."):
+                    thumbnails = get_thumbnails(
+                        s3_client,
+                        bucket_name,
+                        {
+                            s3_key: st.session_state.s3_etags.get(s3_key)
+                            for s3_key in selected_files
+                        },
+                    )
+
                 for s3_key in selected_files:
                     col1, col2 = st.columns([1, 1])
 
                     with col1:
-                        # Generate presigned URL for image display
-                        try:
-                            if auth_mode == "AWS Credentials":
-                                url = s3_client.generate_presigned_url(
-                                    "get_object",
-                                    Params={"Bucket": bucket_name, "Key": s3_key},
-                                    ExpiresIn=3600,
-                                )
-                            else:
-                                url = f"https://{bucket_name}.s3.amazonaws.com/{s3_key}"
-                                st.image(
-                                    url,
-                                    caption=os.path.basename(s3_key),
-                                    use_container_width=True,
-                                )
-                        except Exception as e:
-                            st.error(f"Error displaying image {s3_key}: {str(e)}")
+                        if s3_key in thumbnails:
+                            st.image(
+                                thumbnails[s3_key],
+                                caption=os.path.basename(s3_key),
+                                use_container_width=True,
+                            )
+                        else:
+                            st.error(f"Error displaying image {s3_key}")
 
                     with col2:
                         with st.spinner("Generating caption..."):
@@ -228,14 +251,20 @@ if authenticated:
                                     caption = caption_uploaded_image(url)
                                 else:
                                     # For private buckets, download and process
-                                    with tempfile.NamedTemporaryFile(
-                                        delete=False, suffix=os.path.splitext(s3_key)[1]
-                                    ) as tmp_file:
-                                        s3_client.download_fileobj(
-                                            bucket_name, s3_key, tmp_file
-                                        )
-                                        caption = caption_uploaded_image(tmp_file.name)
-                                        os.unlink(tmp_file.name)
+                                    url = s3_client.generate_presigned_url(
+                                        "get_object",
+                                        Params={"Bucket": bucket_name, "Key": s3_key},
+                                        ExpiresIn=3600,
+                                    )
+                                    path = prefetcher.wait(s3_key)
+                                    if path:
+                                        with open(path, "rb") as f:
+                                            image_data = f.read()
+                                    else:
+                                        image_data = s3_client.get_object(
+                                            Bucket=bucket_name, Key=s3_key
+                                        )["Body"].read()
+                                    caption = caption_uploaded_image(image_data)
 
                                 # Add to processed items
                                 processed_items.append(
@@ -260,6 +289,10 @@ if authenticated:
 
                     st.divider()
 
+                # Every image is captioned, so the downloads are not needed
+                # any more; the next run prefetches its selection afresh
+                close_session_prefetcher(st.session_state)
+
     # Send to Troweb button
     if processed_items:
         st.markdown("---")
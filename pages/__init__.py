@@ -1,4 +0,0 @@
-from .transcript_page import show_transcript_page
-from .caption_page import show_caption_page
-
-__all__ = ["show_transcript_page", "show_caption_page"]
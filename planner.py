@@ -0,0 +1,172 @@
+import heapq
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from extract_audio import PRECONDITION_BITRATE
+from extract_transcript import (
+    WHISPER_COST_PER_MINUTE,
+    WHISPER_EXTENSIONS,
+    WHISPER_MAX_BYTES,
+    estimate_transcription_seconds,
+)
+from transcription_backends import runs_locally
+
+PROBE_TIMEOUT = 30
+
+
+def probe_media(source):
+    """Return duration, size and audio presence of a file or URL, via ffprobe.
+
+    For URLs ffprobe only fetches the byte ranges holding the headers and
+    index, not the whole file.
+    """
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-show_entries",
+        "format=duration,size:stream=codec_type",
+        "-of",
+        "json",
+        source,
+    ]
+    result = subprocess.run(
+        command,
+        check=True,
+        capture_output=True,
+        text=True,
+        timeout=PROBE_TIMEOUT,
+    )
+    info = json.loads(result.stdout)
+    fmt = info.get("format", {})
+    return {
+        "duration": float(fmt.get("duration") or 0),
+        "size": int(fmt.get("size") or 0),
+        "has_audio": any(
+            s.get("codec_type") == "audio" for s in info.get("streams", [])
+        ),
+    }
+
+
+def plan_item(key, probe, precondition=False):
+    """Work out how a probed file will be processed and what it will cost."""
+    duration = probe["duration"]
+    if precondition:
+        # Silence removal only shrinks this further
+        upload_bytes = duration * int(PRECONDITION_BITRATE.rstrip("k")) * 1000 / 8
+    else:
+        upload_bytes = probe["size"]
+
+    if not probe["has_audio"]:
+        route = "skip"
+    elif runs_locally(duration):
+        route = "local"
+    elif upload_bytes > WHISPER_MAX_BYTES or (
+        not precondition and not key.lower().endswith(WHISPER_EXTENSIONS)
+    ):
+        route = "chunked"
+    else:
+        route = "direct"
+
+    return {
+        "key": key,
+        "duration": duration,
+        "size": probe["size"],
+        "has_audio": probe["has_audio"],
+        "route": route,
+        "cost": 0.0
+        if route in ("skip", "local")
+        else duration / 60 * WHISPER_COST_PER_MINUTE,
+        "seconds": 0.0 if route == "skip" else estimate_transcription_seconds(duration),
+        "error": None,
+    }
+
+
+def plan_media(
+    s3_client, bucket_name, keys, precondition=False, workers=8, sources=None
+):
+    """Probe S3 objects in parallel and return their plan, longest first.
+
+    `sources` maps keys to local copies, such as prefetched downloads, which
+    are probed instead of the object in S3.
+
+    Starting the longest files first keeps one large file from running
+    alone at the end of the batch. Files without audio and files that could
+    not be probed are listed last with route "skip".
+    """
+
+    sources = sources or {}
+
+    def probe(key):
+        source = sources.get(key) or s3_client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": bucket_name, "Key": key},
+            ExpiresIn=3600,
+        )
+        try:
+            return plan_item(key, probe_media(source), precondition)
+        except (OSError, subprocess.SubprocessError, ValueError) as e:
+            stderr = getattr(e, "stderr", None)
+            return {
+                "key": key,
+                "duration": 0.0,
+                "size": 0,
+                "has_audio": False,
+                "route": "skip",
+                "cost": 0.0,
+                "seconds": 0.0,
+                "error": (stderr or str(e)).strip(),
+            }
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        items = list(pool.map(probe, keys))
+    items.sort(key=lambda item: (item["route"] == "skip", -item["duration"]))
+    return items
+
+
+def estimate_makespan(items, concurrency):
+    """Wall time to run the items in order on `concurrency` slots."""
+    slots = [0.0] * concurrency
+    for item in items:
+        if item["route"] != "skip":
+            heapq.heappush(slots, heapq.heappop(slots) + item["seconds"])
+    return max(slots)
+
+
+def plan_summary(items, concurrency):
+    runnable = [item for item in items if item["route"] != "skip"]
+    return {
+        "files": len(runnable),
+        "skipped": len(items) - len(runnable),
+        "chunked": sum(item["route"] == "chunked" for item in runnable),
+        "audio_minutes": sum(item["duration"] for item in runnable) / 60,
+        "cost": sum(item["cost"] for item in runnable),
+        "seconds": estimate_makespan(items, concurrency),
+    }
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    return f"{minutes}m {seconds:02d}s"
+
+
+def plan_rows(items):
+    """Table rows for showing a plan."""
+    return [
+        {
+            "File": os.path.basename(item["key"]),
+            "Duration": format_duration(item["duration"]),
+            "Size": f"{item['size'] / 1_000_000:.1f} MB",
+            "Audio": "✅" if item["has_audio"] else "❌",
+            "Route": item["route"],
+            "Est. cost": f"${item['cost']:.3f}",
+            "Est. time": format_duration(item["seconds"]),
+            "Note": item["error"] or "",
+        }
+        for item in items
+    ]
@@ -0,0 +1,212 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from disk_manager import DiskQuotaExceeded, ensure_space, temp_prefix
+
+# Most the prefetch cache of one session may hold
+PREFETCH_CACHE_BYTES = int(os.getenv("PREFETCH_CACHE_BYTES", str(2 * 1024**3)))
+# Download rate cap shared by a session's prefetches; 0 means no cap
+PREFETCH_BYTES_PER_SECOND = int(os.getenv("PREFETCH_BYTES_PER_SECOND", "0"))
+PREFETCH_WORKERS = 4
+CHUNK_BYTES = 1024 * 1024
+
+
+class Prefetcher:
+    """Downloads selected S3 objects in the background, ahead of processing.
+
+    Call `update` with the current selection on every run: new keys start
+    downloading, and deselected ones are cancelled and their files deleted.
+    Processing then calls `wait` for the local copy, which is usually done
+    or well under way, and `discard` once finished with it. Objects that do
+    not fit the cache or the disk are skipped and `wait` returns None for
+    them, so the caller downloads them itself as before.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket_name,
+        max_bytes=PREFETCH_CACHE_BYTES,
+        bytes_per_second=PREFETCH_BYTES_PER_SECOND,
+        workers=PREFETCH_WORKERS,
+    ):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.max_bytes = max_bytes
+        self.bytes_per_second = bytes_per_second
+        # Named like other temporary files, so the startup sweep removes it
+        # if the server dies
+        self.cache_dir = tempfile.mkdtemp(prefix=temp_prefix() + "prefetch-")
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._reserved = 0
+        self._next_slot = 0.0
+        # Runs on close, or once the prefetcher is garbage collected with the
+        # session that held it, or at exit, whichever comes first
+        self._finalizer = weakref.finalize(
+            self, _remove_cache, self._pool, self._entries, self.cache_dir
+        )
+
+    def update(self, keys):
+        """Prefetch `keys`, in order, and drop everything else."""
+        wanted = set(keys)
+        with self._lock:
+            for key in [k for k in self._entries if k not in wanted]:
+                self._cancel(key)
+            for key in keys:
+                if key not in self._entries:
+                    entry = {
+                        "status": "queued",
+                        "path": None,
+                        "size": 0,
+                        "done": 0,
+                        "cancel": threading.Event(),
+                    }
+                    self._entries[key] = entry
+                    entry["future"] = self._pool.submit(self._fetch, key, entry)
+
+    def _cancel(self, key):
+        entry = self._entries.pop(key)
+        entry["cancel"].set()
+        if entry["future"].cancel() or entry["status"] == "done":
+            self._release(entry)
+
+    def _release(self, entry):
+        # Called with the lock held, once per entry
+        self._reserved -= entry["size"]
+        entry["size"] = 0
+        if entry["path"] and os.path.exists(entry["path"]):
+            os.unlink(entry["path"])
+
+    def _throttle(self, nbytes, cancel):
+        if not self.bytes_per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next_slot, now)
+            self._next_slot = start + nbytes / self.bytes_per_second
+        cancel.wait(start - now)
+
+    def _fetch(self, key, entry):
+        # Loaded with the S3 client; not imported with the page
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        cancel = entry["cancel"]
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
+            size = response["ContentLength"]
+            with self._lock:
+                fits = self._reserved + size <= self.max_bytes
+                if fits and not cancel.is_set():
+                    self._reserved += size
+                    entry["size"] = size
+            if not fits:
+                response["Body"].close()
+                entry["status"] = "skipped"
+                return
+            ensure_space(size, self.cache_dir)
+
+            entry["status"] = "downloading"
+            # Keep the extension, which ffmpeg and the API go by
+            fd, entry["path"] = tempfile.mkstemp(
+                suffix=os.path.splitext(key)[1], dir=self.cache_dir
+            )
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response["Body"].iter_chunks(CHUNK_BYTES):
+                    if cancel.is_set():
+                        break
+                    self._throttle(len(chunk), cancel)
+                    f.write(chunk)
+                    entry["done"] += len(chunk)
+            response["Body"].close()
+            if not cancel.is_set():
+                entry["status"] = "done"
+                return
+        except DiskQuotaExceeded:
+            entry["status"] = "skipped"
+        except (BotoCoreError, ClientError, OSError) as e:
+            # Closing deletes the cache under a running download
+            if not cancel.is_set():
+                print(f"Prefetch of {key} failed: {e}")
+            entry["status"] = "failed"
+        except BaseException:
+            # Released below; `wait` re-raises it
+            entry["status"] = "failed"
+            raise
+        finally:
+            with self._lock:
+                if cancel.is_set() or entry["status"] in ("skipped", "failed"):
+                    self._release(entry)
+
+    def wait(self, key, timeout=None):
+        """Return the local copy of `key` once downloaded, or None if it is
+        not being prefetched or could not be."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        try:
+            entry["future"].result(timeout)
+        except (TimeoutError, CancelledError):
+            return None
+        return entry["path"] if entry["status"] == "done" else None
+
+    def discard(self, key):
+        """Forget `key` and delete its local copy, if it still has one."""
+        with self._lock:
+            if key in self._entries:
+                self._cancel(key)
+
+    def progress(self):
+        """(objects downloaded, objects prefetching, bytes downloaded)"""
+        with self._lock:
+            entries = list(self._entries.values())
+        active = [e for e in entries if e["status"] != "skipped"]
+        return (
+            sum(e["status"] == "done" for e in active),
+            len(active),
+            sum(e["done"] for e in active),
+        )
+
+    def close(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._cancel(key)
+        self._finalizer()
+
+
+def _remove_cache(pool, entries, cache_dir):
+    # Must not reference the prefetcher, or it would never be collected
+    for entry in entries.values():
+        entry["cancel"].set()
+    pool.shutdown(wait=False, cancel_futures=True)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def close_session_prefetcher(state):
+    """Close the prefetcher kept in a page session's `state`, if any, and
+    delete everything it downloaded."""
+    prefetcher = state.get("prefetcher")
+    if prefetcher is not None:
+        prefetcher.close()
+        state["prefetcher"] = None
+
+
+def get_session_prefetcher(state, s3_client, bucket_name):
+    """Return the prefetcher kept in a page session's `state` for this bucket
+    and client, replacing one made for another."""
+    source = (bucket_name, id(s3_client))
+    prefetcher = state.get("prefetcher")
+    if prefetcher is None or state.get("prefetch_source") != source:
+        if prefetcher is not None:
+            prefetcher.close()
+        prefetcher = Prefetcher(s3_client, bucket_name)
+        state["prefetcher"] = prefetcher
+        state["prefetch_source"] = source
+    return prefetcher
@@ -0,0 +1,243 @@
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+# Set PROFILE_PAGES=1 to profile every page run and pipeline call, or use the
+# sidebar toggle to profile a single session.
+PROFILE_PAGES = os.getenv("PROFILE_PAGES", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Seconds between stack samples
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+
+# The run of the session or pipeline call in progress. asyncio tasks and
+# asyncio.to_thread inherit it; work handed to a thread pool needs in_context.
+_current_run = contextvars.ContextVar("profile_run", default=None)
+_sampler_threads = set()
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+class ProfileRun:
+    """Samples every thread's stack while a page run or pipeline call is active.
+
+    Writes two files to PROFILE_DIR when it finishes: `<name>-<time>.folded`,
+    collapsed stacks that flamegraph.pl, speedscope and inferno read directly,
+    and `<name>-<time>.json`, the wall time spent in each profiled section.
+    """
+
+    def __init__(self, name, thread_id, until_frame_of=None):
+        self.name = name
+        self.thread_id = thread_id
+        # Page runs end when this file's module frame leaves the script thread;
+        # st.rerun() and st.stop() leave through exceptions, not a return.
+        self.until_frame_of = until_frame_of
+        self.stacks = Counter()
+        self.sections = []
+        self.samples = 0
+        self.start = time.time()
+        self.end = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._sample, name=f"profiler-{name}", daemon=True
+        )
+
+    def start_sampling(self):
+        self._thread.start()
+
+    @property
+    def active(self):
+        return self.end is None
+
+    def stop(self):
+        self._stop.set()
+        if threading.get_ident() != self._thread.ident:
+            self._thread.join()
+
+    def _script_running(self, frames):
+        frame = frames.get(self.thread_id)
+        while frame is not None:
+            if frame.f_code.co_filename == self.until_frame_of:
+                return True
+            frame = frame.f_back
+        return False
+
+    def _sample(self):
+        _sampler_threads.add(threading.get_ident())
+        names = {}
+        while not self._stop.wait(PROFILE_INTERVAL):
+            frames = sys._current_frames()
+            if self.until_frame_of and not self._script_running(frames):
+                break
+            if len(names) != len(frames):
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in frames.items():
+                if thread_id in _sampler_threads:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+        self._finish()
+
+    def record_section(self, name, start, duration):
+        self.sections.append((name, threading.current_thread().name, start, duration))
+
+    def breakdown(self):
+        total = self.end - self.start
+        sections = defaultdict(lambda: {"calls": 0, "seconds": 0.0})
+        for name, _, _, duration in self.sections:
+            sections[name]["calls"] += 1
+            sections[name]["seconds"] += duration
+        return {
+            "name": self.name,
+            "started": self.start,
+            "wall_seconds": round(total, 4),
+            "samples": self.samples,
+            "sections": {
+                name: {"calls": s["calls"], "seconds": round(s["seconds"], 4)}
+                for name, s in sorted(
+                    sections.items(), key=lambda item: -item[1]["seconds"]
+                )
+            },
+            "timeline": [
+                {
+                    "section": name,
+                    "thread": thread,
+                    "offset": round(start - self.start, 4),
+                    "seconds": round(duration, 4),
+                }
+                for name, thread, start, duration in self.sections
+            ],
+        }
+
+    def _finish(self):
+        self.end = time.time()
+        _sampler_threads.discard(threading.get_ident())
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.start))
+        base = os.path.join(
+            PROFILE_DIR, f"{self.name}-{stamp}-{int(self.start * 1000) % 1000:03d}"
+        )
+        try:
+            Path(base + ".folded").write_text(
+                "".join(
+                    f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+                ),
+                encoding="utf-8",
+            )
+            with open(base + ".json", "w", encoding="utf-8") as f:
+                json.dump(self.breakdown(), f, indent=2)
+        except OSError as e:
+            print(f"Error writing profile {base}: {e}")
+
+
+def profile_page(page_name, enabled=False):
+    """Profile the rest of the calling page script's run.
+
+    Call once near the top of a page. Does nothing unless PROFILE_PAGES is
+    set or `enabled` is true (the sidebar toggle).
+    """
+    run = None
+    if PROFILE_PAGES or enabled:
+        page_file = sys._getframe(1).f_code.co_filename
+        run = ProfileRun(page_name, threading.get_ident(), until_frame_of=page_file)
+        run.start_sampling()
+    # Script threads can be reused by the next run, profiled or not
+    _current_run.set(run)
+    return run
+
+
+def in_context(fn):
+    """Bind `fn` to the calling session's profile run, so its profiled calls
+    are timed into that run when it runs on a pool thread.
+
+    Use as `pool.submit(in_context(fn), *args)`, calling it per submission.
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def _profiling():
+    run = _current_run.get()
+    return PROFILE_PAGES or (run is not None and run.active)
+
+
+def _record(name, start, duration):
+    run = _current_run.get()
+    if run is not None and run.active:
+        run.record_section(name, start, duration)
+
+
+def _start_standalone(name):
+    # Pipeline functions called outside a profiled page (watch_folder, the
+    # CLI scripts) get a profile of their own when PROFILE_PAGES is set.
+    run = _current_run.get()
+    if not PROFILE_PAGES or (run is not None and run.active):
+        return None, None
+    run = ProfileRun(name, threading.get_ident())
+    run.start_sampling()
+    return run, _current_run.set(run)
+
+
+def _stop_standalone(standalone):
+    run, token = standalone
+    if run is not None:
+        _current_run.reset(token)
+        run.stop()
+
+
+def profiled(name=None):
+    """Decorator that times calls of a function into the active profile runs.
+
+    Costs a context variable lookup per call while profiling is off.
+    """
+
+    def decorator(fn):
+        section = name or fn.__name__
+
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _profiling():
+                    return await fn(*args, **kwargs)
+                standalone = _start_standalone(section)
+                start = time.time()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    _record(section, start, time.time() - start)
+                    _stop_standalone(standalone)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _profiling():
+                return fn(*args, **kwargs)
+            standalone = _start_standalone(section)
+            start = time.time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(section, start, time.time() - start)
+                _stop_standalone(standalone)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,206 @@
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Defaults are deliberately conservative; the rate-limit headers returned by the
+# API replace them with the real quota after the first successful call.
+DEFAULT_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "50"))
+DEFAULT_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "200000"))
+INITIAL_CONCURRENCY = int(os.getenv("OPENAI_INITIAL_CONCURRENCY", "3"))
+MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset_duration(value):
+    """Parse reset values such as '20ms', '1s' or '6m0s' into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _header_number(headers, name):
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class RateGovernor:
+    """Shares one request/token budget and concurrency window across threads.
+
+    Budgets are token buckets refilled per minute. Concurrency follows AIMD:
+    every successful call widens the window by 1/window, and a 429 halves it.
+    """
+
+    def __init__(
+        self,
+        name,
+        requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+        initial_concurrency=INITIAL_CONCURRENCY,
+        max_concurrency=MAX_CONCURRENCY,
+    ):
+        self.name = name
+        self.requests_per_minute = float(requests_per_minute)
+        self.tokens_per_minute = float(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(min(initial_concurrency, max_concurrency))
+        self.in_flight = 0
+        self._request_budget = self.requests_per_minute
+        self._token_budget = self.tokens_per_minute
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        self._request_budget = min(
+            self.requests_per_minute,
+            self._request_budget + elapsed * self.requests_per_minute / 60,
+        )
+        self._token_budget = min(
+            self.tokens_per_minute,
+            self._token_budget + elapsed * self.tokens_per_minute / 60,
+        )
+
+    def _wait_time(self, now, tokens):
+        """Seconds to wait before a call may start, None to wait for a release."""
+        if self.in_flight >= max(1, int(self.concurrency)):
+            return None
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._request_budget < 1:
+            return (1 - self._request_budget) * 60 / self.requests_per_minute
+        # A single call larger than the whole bucket is allowed once it is full.
+        tokens = min(tokens, self.tokens_per_minute)
+        if self._token_budget < tokens:
+            return (tokens - self._token_budget) * 60 / self.tokens_per_minute
+        return 0
+
+    def acquire(self, tokens=0):
+        """Block until a call estimated at `tokens` may start."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._wait_time(now, tokens)
+                if wait == 0:
+                    self._request_budget -= 1
+                    self._token_budget -= min(tokens, self.tokens_per_minute)
+                    self.in_flight += 1
+                    return
+                self._cond.wait(timeout=wait)
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def record_success(self, headers=None):
+        """Additive increase, then resync budgets with the response headers."""
+        with self._cond:
+            self.concurrency = min(
+                self.max_concurrency, self.concurrency + 1 / self.concurrency
+            )
+            if headers:
+                self._apply_headers(headers)
+            self._cond.notify_all()
+
+    def record_rate_limited(self, headers=None):
+        """Multiplicative decrease and pause until the quota resets."""
+        with self._cond:
+            now = time.monotonic()
+            # Calls already in flight when the limit hit report 429 together;
+            # only the first of a burst should shrink the window.
+            if now - self._last_decrease > 1:
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self._last_decrease = now
+            pause = None
+            if headers:
+                self._apply_headers(headers)
+                pause = parse_reset_duration(headers.get("retry-after"))
+            self._paused_until = max(self._paused_until, now + (pause or 1))
+            self._cond.notify_all()
+
+    def _apply_headers(self, headers):
+        now = time.monotonic()
+        limit = _header_number(headers, "x-ratelimit-limit-requests")
+        if limit:
+            self.requests_per_minute = limit
+        limit = _header_number(headers, "x-ratelimit-limit-tokens")
+        if limit:
+            self.tokens_per_minute = limit
+
+        for kind in ("requests", "tokens"):
+            remaining = _header_number(headers, f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            if kind == "requests":
+                self._request_budget = min(self._request_budget, remaining)
+            else:
+                self._token_budget = min(self._token_budget, remaining)
+            if remaining < 1:
+                reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self._paused_until = max(self._paused_until, now + reset)
+
+
+class GovernedCall:
+    """Handle yielded by `governed_call` to report response headers."""
+
+    def __init__(self):
+        self.headers = None
+
+    def observe(self, headers):
+        self.headers = headers
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(name):
+    """Return the process-wide governor for a model, creating it on first use.
+
+    Streamlit runs every session in the same server process, so module state
+    here is shared by all users and all pages.
+    """
+    with _governors_lock:
+        if name not in _governors:
+            _governors[name] = RateGovernor(name)
+        return _governors[name]
+
+
+@contextmanager
+def governed_call(name, tokens=0):
+    """Run one OpenAI call under the shared budget for `name`."""
+    governor = get_governor(name)
+    governor.acquire(tokens)
+    call = GovernedCall()
+    try:
+        yield call
+    except Exception as e:
+        if getattr(e, "status_code", None) == 429:
+            response = getattr(e, "response", None)
+            governor.record_rate_limited(getattr(response, "headers", None))
+        raise
+    else:
+        governor.record_success(call.headers)
+    finally:
+        governor.release()
@@ -0,0 +1,130 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors.
+TRANSIENT_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Hedged attempts run here so the caller's thread is free to wait on both.
+_hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call and its retries do not finish before the deadline."""
+
+
+def is_transient(error):
+    """Return True for errors that are worth retrying."""
+    import openai
+
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return getattr(error, "status_code", None) in TRANSIENT_STATUS_CODES
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """Full-jitter exponential backoff for the given zero-based attempt."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def call_with_retries(fn, deadline, max_attempts=4):
+    """Call `fn(timeout)` until it succeeds, retrying transient errors.
+
+    `deadline` is a `time.monotonic()` timestamp; each attempt is given the
+    time that remains, and no retry starts once the deadline has passed.
+    """
+    for attempt in range(max_attempts):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Deadline exceeded after {attempt} attempts")
+        try:
+            return fn(remaining)
+        except Exception as e:
+            if attempt == max_attempts - 1 or not is_transient(e):
+                raise
+            delay = backoff_delay(attempt)
+            if time.monotonic() + delay >= deadline:
+                raise DeadlineExceeded(
+                    f"Deadline exceeded after {attempt + 1} attempts: {e}"
+                ) from e
+            print(f"Transient error ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class CancelScope:
+    """Lets a hedged attempt register how to abort its in-flight work."""
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self.cancelled.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            # Callbacks close connections, which fails with these at worst
+            except (OSError, RuntimeError) as e:
+                print(f"Error cancelling hedged attempt: {e}")
+
+
+def run_hedged(attempt, hedge_after):
+    """Run `attempt(scope)`, firing a duplicate if it is still running after
+    `hedge_after` seconds. The first success wins and the other is cancelled.
+    """
+    if hedge_after is None:
+        return attempt(CancelScope())
+
+    scopes = [CancelScope()]
+    futures = {_hedge_executor.submit(attempt, scopes[0]): scopes[0]}
+    done, _ = wait(futures, timeout=hedge_after)
+    if not done:
+        scopes.append(CancelScope())
+        futures[_hedge_executor.submit(attempt, scopes[1])] = scopes[1]
+
+    pending = set(futures)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for other in pending:
+                    other.cancel()
+                    futures[other].cancel()
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+class LatencyTracker:
+    """Keeps recent per-unit latencies (e.g. seconds per audio second)."""
+
+    def __init__(self, size=200, min_samples=20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        with self._lock:
+            self.samples.append(value)
+
+    def percentile(self, pct):
+        """Return the pct-th percentile, or None until enough samples exist."""
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[index]
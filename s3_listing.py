@@ -0,0 +1,133 @@
+import heapq
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Partitions listed at once. A single list_objects_v2 cursor returns 1,000
+# keys per round-trip, so a large bucket is listed as many cursors side by
+# side, one per common prefix.
+LISTING_WORKERS = int(os.getenv("S3_LISTING_WORKERS", "16"))
+# Levels of common prefixes expanded while looking for enough partitions
+MAX_PARTITION_DEPTH = 3
+DELIMITER = "/"
+
+
+def _matches(key, extensions):
+    return not extensions or key.lower().endswith(extensions)
+
+
+def _list_level(s3_client, bucket_name, prefix, extensions):
+    """List the keys directly under `prefix` and its common prefixes."""
+    objects = []
+    prefixes = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(
+        Bucket=bucket_name, Prefix=prefix, Delimiter=DELIMITER
+    ):
+        objects += [
+            obj for obj in page.get("Contents", []) if _matches(obj["Key"], extensions)
+        ]
+        prefixes += [p["Prefix"] for p in page.get("CommonPrefixes", [])]
+    return objects, prefixes
+
+
+def discover_partitions(
+    s3_client, bucket_name, prefix, extensions, pool, workers, depth
+):
+    """Split the keys under `prefix` into disjoint partitions.
+
+    Common prefixes are expanded a level at a time, each level listed
+    concurrently, until there are at least `workers` of them or `depth`
+    levels were expanded. Returns the objects met on the way, as sorted
+    lists, and the prefixes still to be listed in full.
+    """
+    found = []
+    partitions = [prefix]
+    for _ in range(depth):
+        if len(partitions) >= workers:
+            break
+        levels = pool.map(
+            lambda p: _list_level(s3_client, bucket_name, p, extensions), partitions
+        )
+        partitions = []
+        for objects, prefixes in levels:
+            found.append(objects)
+            partitions += prefixes
+    return found, partitions
+
+
+def _list_page(s3_client, bucket_name, prefix, token):
+    params = {"Bucket": bucket_name, "Prefix": prefix}
+    if token:
+        params["ContinuationToken"] = token
+    return s3_client.list_objects_v2(**params)
+
+
+def _list_partition(pool, s3_client, bucket_name, prefix, extensions, first):
+    """Yield the objects of one partition from the page future `first` on.
+
+    Only the page being merged and the next one, already requested, are
+    held, so a slow consumer holds the listing back rather than letting
+    it pile up in memory.
+    """
+    page = first
+    while page is not None:
+        result = page.result()
+        token = result.get("IsTruncated") and result.get("NextContinuationToken")
+        page = (
+            pool.submit(_list_page, s3_client, bucket_name, prefix, token)
+            if token
+            else None
+        )
+        for obj in result.get("Contents", []):
+            if _matches(obj["Key"], extensions):
+                yield obj
+
+
+def iter_s3_objects(
+    s3_client, bucket_name, prefix="", extensions=None, workers=LISTING_WORKERS
+):
+    """Yield every object under `prefix` in key order, following pagination
+    past 1,000 keys.
+
+    The keys are split on their common prefixes (see discover_partitions),
+    the partitions are listed concurrently and their pages merged back into
+    one sorted stream as they arrive. A bucket without folders has nothing
+    to split and is listed by a single cursor, as is any `workers` of 1.
+
+    When `extensions` is given, only keys ending in one of them (compared
+    case-insensitively) are yielded; the others are dropped as pages arrive.
+    Each partition lists at most one page ahead of the merge.
+    """
+    if workers <= 1:
+        paginator = s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                if _matches(obj["Key"], extensions):
+                    yield obj
+        return
+
+    pool = ThreadPoolExecutor(workers, thread_name_prefix="s3-listing")
+    try:
+        found, partitions = discover_partitions(
+            s3_client,
+            bucket_name,
+            prefix,
+            extensions,
+            pool,
+            workers,
+            MAX_PARTITION_DEPTH,
+        )
+        streams = [iter(objects) for objects in found]
+        for partition in partitions:
+            # Every first page is requested up front; the merge needs them all
+            # before it can yield anything
+            first = pool.submit(_list_page, s3_client, bucket_name, partition, None)
+            streams.append(
+                _list_partition(
+                    pool, s3_client, bucket_name, partition, extensions, first
+                )
+            )
+        yield from heapq.merge(*streams, key=lambda obj: obj["Key"])
+    finally:
+        # Also reached when the caller stops early
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,164 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SEND_LEDGER_PATH = os.getenv("SEND_LEDGER_PATH", "send_ledger.db")
+
+
+def item_key(item):
+    """Stable identity of an item: its URL without the query string (which
+    changes with every presigned URL), or its title for local files."""
+    url = item.get("url")
+    if url:
+        return url.split("?", 1)[0]
+    return f"local:{item.get('title', '-')}"
+
+
+def source_hash(item):
+    """Hash of what an item is made of, before it is rendered for Troweb, so
+    that sending it in another transcript format is not a change."""
+    fields = dict(item)
+    if fields.get("url"):
+        fields["url"] = fields["url"].split("?", 1)[0]
+    data = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def content_hash(title, text, url):
+    """Hash of the rendered fields, which rows recorded before the transcript
+    format was kept still hold."""
+    data = json.dumps([title, text, url.split("?", 1)[0] if url else url])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class SendLedger:
+    """What was sent to which Troweb collection, and what it looked like.
+
+    One row per (collection, item) with a hash of the item's source
+    content, the transcript format it was rendered in, the bulk job that
+    carried it, if any, and the item's own Troweb id. A send compares
+    against it to skip unchanged items and to update changed ones in place.
+    """
+
+    def __init__(self, path=SEND_LEDGER_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sent (
+                parent_id TEXT NOT NULL,
+                item_key TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                job_id TEXT,
+                troweb_id TEXT,
+                sent_at REAL,
+                PRIMARY KEY (parent_id, item_key)
+            )
+            """
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(sent)")]
+        if "transcript_format" not in columns:
+            # NULL for rows whose content_hash is still of the rendered fields
+            self._db.execute("ALTER TABLE sent ADD COLUMN transcript_format TEXT")
+
+    def sent_items(self, parent_id):
+        """Return {item_key: (content_hash, troweb_id, transcript_format)} of
+        a collection."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT item_key, content_hash, troweb_id, transcript_format "
+                "FROM sent WHERE parent_id = ?",
+                (parent_id,),
+            ).fetchall()
+        return {key: tuple(rest) for key, *rest in rows}
+
+    def record(self, parent_id, sent, job_id, transcript_format):
+        """Remember (item_key, source_hash, troweb_id) triples as sent in
+        `job_id`, rendered in `transcript_format`. A None troweb_id keeps the
+        one already known."""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO sent (parent_id, item_key, content_hash, job_id, "
+                "troweb_id, transcript_format, sent_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (parent_id, item_key) DO UPDATE "
+                "SET content_hash = excluded.content_hash, job_id = excluded.job_id, "
+                "troweb_id = COALESCE(excluded.troweb_id, troweb_id), "
+                "transcript_format = excluded.transcript_format, "
+                "sent_at = excluded.sent_at",
+                [
+                    (parent_id, key, digest, job_id, troweb_id, transcript_format, now)
+                    for key, digest, troweb_id in sent
+                ],
+            )
+
+    def set_troweb_id(self, parent_id, key, troweb_id):
+        """Attach the Troweb id of an item sent before ids were recorded, so
+        later changes update it in place."""
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "UPDATE sent SET troweb_id = ? WHERE parent_id = ? AND item_key = ?",
+                (troweb_id, parent_id, key),
+            )
+        return cursor.rowcount == 1
+
+    def forget(self, parent_id):
+        """Drop a collection's history, so its next send includes everything."""
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "DELETE FROM sent WHERE parent_id = ?", (parent_id,)
+            )
+        return cursor.rowcount
+
+    def items(self, parent_id):
+        with self._lock:
+            return self._db.execute(
+                "SELECT item_key, job_id, troweb_id, sent_at FROM sent "
+                "WHERE parent_id = ? ORDER BY sent_at",
+                (parent_id,),
+            ).fetchall()
+
+
+_send_ledger = None
+_send_ledger_lock = threading.Lock()
+
+
+def get_send_ledger():
+    """Return the process-wide send ledger, opening it on first use."""
+    global _send_ledger
+    with _send_ledger_lock:
+        if _send_ledger is None:
+            _send_ledger = SendLedger()
+        return _send_ledger
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect what was sent to Troweb.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show_parser = commands.add_parser("show", help="List items sent to a collection")
+    show_parser.add_argument("collection_id")
+    forget_parser = commands.add_parser(
+        "forget", help="Resend everything to a collection next time"
+    )
+    forget_parser.add_argument("collection_id")
+    set_id_parser = commands.add_parser(
+        "set-id", help="Record the Troweb id of a sent item"
+    )
+    set_id_parser.add_argument("collection_id")
+    set_id_parser.add_argument("item_key")
+    set_id_parser.add_argument("troweb_id")
+    args = parser.parse_args()
+
+    ledger = get_send_ledger()
+    if args.command == "show":
+        for key, job_id, troweb_id, sent_at in ledger.items(args.collection_id):
+            sent = time.strftime("%Y-%m-%d %H:%M", time.localtime(sent_at))
+            print(f"{sent}  job {job_id}  id {troweb_id or '-'}  {key}")
+    elif args.command == "forget":
+        print(f"Forgot {ledger.forget(args.collection_id)} items")
+    elif not ledger.set_troweb_id(args.collection_id, args.item_key, args.troweb_id):
+        print(f"{args.item_key} was never sent to {args.collection_id}")
@@ -1,14 +1,32 @@
+import json
 import requests
 import os
+from functools import cache
+from profiling import profiled
+from send_ledger import content_hash, get_send_ledger, item_key, source_hash
+from transcript_formats import render, renders_as_subtitles
 
 
-url = "https://lernito-ai-tutor.troweb.app/api/v1/graphql"
+url = os.getenv(
+    "TROWEB_GRAPHQL_URL", "https://lernito-ai-tutor.troweb.app/api/v1/graphql"
+)
 video_extensions = (".mp4", ".mov", ".mkv", ".avi")
+ACTIONS_PER_BATCH = 50
+# Requests are filled with addBulkActions batches, or createVideo mutations,
+# up to this many bytes of JSON variables. Full transcripts vary a lot in
+# size, so a fixed count per request does not bound the body.
+MAX_REQUEST_BYTES = int(os.getenv("TROWEB_MAX_REQUEST_BYTES", str(1024 * 1024)))
+# How the transcript field is filled: "text", "segments" (timestamped lines),
+# "srt" or "vtt". Items without segments are always sent as text.
+TRANSCRIPT_FORMAT = os.getenv("TROWEB_TRANSCRIPT_FORMAT", "text")
+
+# Keeps the TLS connection to Troweb open between requests
+session = requests.Session()
 
 
 def send_gql_request(query, variables):
     # Send the mutation request with variables
-    response = requests.post(
+    response = session.post(
         url,
         json={"query": query, "variables": variables},
         headers={"Authorization": f"Bearer {os.getenv('TW_TOKEN')}"},
@@ -44,57 +62,219 @@ def create_batch_job():
     return send_gql_request(mutation, {})["data"]["createBulkOperation"]["_id"]
 
 
-def start_batch_job(job_id):
-    print(f"starting the job {job_id}")
-    mutation = """
-    mutation startJob($jobId: ObjectId!){
-      startBulkOperation(_id: $jobId) {
-        status
-      }
-    }
-  """
-    return send_gql_request(mutation, {"jobId": job_id})
+@cache
+def batch_mutation(batches, start):
+    """Document adding `batches` action lists to a job and optionally starting it.
 
+    Top-level mutation fields run one after another in document order, so the
+    aliased adds all land before the start. Documents are built once per
+    shape and reused.
+    """
+    params = ["$jobId: ObjectId!"]
+    fields = []
+    for i in range(batches):
+        params.append(f"$actions{i}: [BulkActionInput!]!")
+        fields.append(
+            f"add{i}: addBulkActions(bulkOperationId: $jobId, actions: $actions{i}) "
+            "{ _id status totalActions processedActions errors }"
+        )
+    if start:
+        fields.append("start: startBulkOperation(_id: $jobId) { status }")
+    return f"mutation addAndStart({', '.join(params)}) {{ {' '.join(fields)} }}"
 
-def add_bulk_batch(actions, job_id):
-    print(f"Adding batch of {len(actions)} actions to job {job_id}")
-    mutation = """
-    mutation addBulkActions($jobId: ObjectId! , $actions: [BulkActionInput!]! ) {
-      addBulkActions(bulkOperationId: $jobId, actions: $actions) {
-        _id
-        status
-        totalActions
-        processedActions
-        errors
-      }
-    }
-  """
-    variables = {"jobId": job_id, "actions": actions}
-    return send_gql_request(mutation, variables)
+
+def json_size(value):
+    return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+def group_by_size(items, max_bytes, max_count=None, measure=json_size):
+    """Split `items` into consecutive groups of at most `max_bytes`, as
+    `measure`d, and `max_count` items. An item bigger than `max_bytes` goes
+    alone."""
+    groups = []
+    group = []
+    size = 0
+    for item in items:
+        item_size = measure(item)
+        if group and (
+            size + item_size > max_bytes or (max_count and len(group) >= max_count)
+        ):
+            groups.append(group)
+            group = []
+            size = 0
+        group.append(item)
+        size += item_size
+    if group:
+        groups.append(group)
+    return groups
+
+
+def send_batches(batches, job_id, start):
+    print(
+        f"Adding {len(batches)} batches of actions to job {job_id}"
+        + (" and starting it" if start else "")
+    )
+    variables = {"jobId": job_id}
+    for i, actions in enumerate(batches):
+        variables[f"actions{i}"] = actions
+    return send_gql_request(batch_mutation(len(batches), start), variables)
 
 
-def get_action(video, parent_id):
+@cache
+def create_mutation(count):
+    """Document creating `count` videos, each aliased so its id comes back."""
+    params = [f"$video{i}: CreateVideoInput!" for i in range(count)]
+    fields = [
+        f"create{i}: createVideo(data: $video{i}) {{ _id }}" for i in range(count)
+    ]
+    return f"mutation createVideos({', '.join(params)}) {{ {' '.join(fields)} }}"
+
+
+def create_videos(actions):
+    """Create the videos of createVideo actions, returning their Troweb ids
+    in order, or None if the request failed."""
+    print(f"Creating {len(actions)} videos")
+    variables = {f"video{i}": action["createVideo"] for i, action in enumerate(actions)}
+    result = send_gql_request(create_mutation(len(actions)), variables)
+    if result is None:
+        return None
+    return [result["data"][f"create{i}"]["_id"] for i in range(len(actions))]
+
+
+def get_action(video, parent_id, transcript_format=TRANSCRIPT_FORMAT):
+    segments = video.get("segments")
+    transcript = render(video.get("transcription", "-"), segments, transcript_format)
+    if video.get("visual_summary") and not renders_as_subtitles(
+        segments, transcript_format
+    ):
+        # createVideo has no field of its own for it, so it rides along with
+        # a text transcript; appended to SRT or VTT it would break the file
+        transcript = f"{transcript}\n\nVisual summary:\n{video['visual_summary']}"
     return {
         "createVideo": {
             "tw_title": video.get("title", "-")[:170],
-            "transcript": video.get("transcription", "-"),
+            "transcript": transcript,
             "publicUrl": video.get("url", "-"),
             "tw_parentId": parent_id,
         }
     }
 
 
-def insert_all(videos, parent_id):
-    actions = []
-    job_id = create_batch_job()
-    print(f"Created Job {job_id}")
+def update_action(action, troweb_id):
+    """Turn a createVideo action into an in-place update of an existing item."""
+    fields = dict(action["createVideo"], _id=troweb_id)
+    del fields["tw_parentId"]
+    return {"updateVideo": fields}
+
+
+@profiled()
+def insert_all(videos, parent_id, force=False, transcript_format=TRANSCRIPT_FORMAT):
+    """Send videos to Troweb, creating new ones and updating changed ones.
+
+    The send ledger decides what goes out. Items new to the collection are
+    created, as many to a request as fit in MAX_REQUEST_BYTES, and the ids
+    Troweb returns are recorded. Items whose content or transcript format
+    changed are updated in place through one bulk job, which takes a
+    round-trip to create and one per MAX_REQUEST_BYTES of action batches,
+    the last of which also starts it. Unchanged items are skipped unless
+    `force`.
+
+    A changed item whose Troweb id is unknown (sent before ids were
+    recorded) is not created again, which would duplicate it, but counted
+    under "unidentified": record its id with `send_ledger.py set-id`, or
+    pass `force` to create it anyway.
+
+    Returns None if a request failed, after recording what was sent before
+    it. Otherwise the job id is under data._id (None without updates), the
+    Troweb id of each sent item under "ids" by title, and the counts under
+    "sent", "created", "updated", "unchanged" and "unidentified".
+    """
+    ledger = get_send_ledger()
+    previous = ledger.sent_items(parent_id)
+    creates = []
+    updates = []
+    upgraded = []
+    unchanged = 0
+    unidentified = 0
     for q in videos:
         try:
-            actions.append(get_action(q, parent_id))
+            action = get_action(q, parent_id, transcript_format)
         except Exception as e:
             print(f"Failed to add item {q} - Error {e}")
-        if len(actions) > 50:
-            add_bulk_batch(actions, job_id)
-            actions = []
-    add_bulk_batch(actions, job_id)
-    start_batch_job(job_id)
+            continue
+        key = item_key(q)
+        digest = source_hash(q)
+        entry = (q.get("title", "-"), key, digest)
+        if key not in previous:
+            creates.append((entry, action))
+            continue
+        last_hash, troweb_id, last_format = previous[key]
+        if last_format is None:
+            # Recorded before the format was kept: compare what was rendered
+            fields = action["createVideo"]
+            if last_hash == content_hash(
+                fields["tw_title"], fields["transcript"], fields["publicUrl"]
+            ):
+                last_hash, last_format = digest, transcript_format
+                upgraded.append((key, digest, troweb_id))
+        if last_hash == digest and last_format == transcript_format and not force:
+            unchanged += 1
+        elif troweb_id:
+            updates.append((entry, update_action(action, troweb_id), troweb_id))
+        elif force:
+            creates.append((entry, action))
+        else:
+            unidentified += 1
+    if upgraded:
+        ledger.record(parent_id, upgraded, None, transcript_format)
+    if unidentified:
+        print(
+            f"Not sending {unidentified} changed items whose Troweb id is unknown; "
+            "record their ids with send_ledger.py set-id, or force new copies"
+        )
+
+    ids = {}
+    for chunk in group_by_size(
+        creates, MAX_REQUEST_BYTES, measure=lambda create: json_size(create[1])
+    ):
+        created = create_videos([action for _, action in chunk])
+        if created is None:
+            return None
+        sent = []
+        for ((title, key, digest), _), troweb_id in zip(chunk, created):
+            sent.append((key, digest, troweb_id))
+            ids[title] = troweb_id
+        # Recorded per request, so a later failure cannot lead to duplicates
+        ledger.record(parent_id, sent, None, transcript_format)
+
+    job_id = None
+    if updates:
+        actions = [action for _, action, _ in updates]
+        batches = group_by_size(actions, MAX_REQUEST_BYTES, ACTIONS_PER_BATCH)
+        request_groups = group_by_size(batches, MAX_REQUEST_BYTES)
+        job_id = create_batch_job()
+        print(f"Created Job {job_id}")
+        for i, chunk in enumerate(request_groups):
+            last = i == len(request_groups) - 1
+            if send_batches(chunk, job_id, start=last) is None:
+                return None
+        ledger.record(
+            parent_id,
+            [(key, digest, troweb_id) for (_, key, digest), _, troweb_id in updates],
+            job_id,
+            transcript_format,
+        )
+        for (title, _, _), _, troweb_id in updates:
+            ids[title] = troweb_id
+
+    if not creates and not updates:
+        print(f"Nothing to send: all {unchanged} items are unchanged")
+    return {
+        "data": {"_id": job_id},
+        "ids": ids,
+        "sent": len(creates) + len(updates),
+        "created": len(creates),
+        "updated": len(updates),
+        "unchanged": unchanged,
+        "unidentified": unidentified,
+    }
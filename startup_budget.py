@@ -0,0 +1,96 @@
+"""Check that the login screen of every page stays quick to show.
+
+Each page is run unauthenticated in a fresh interpreter, as on a cold server,
+and must show its login form within the budget without importing any of the
+heavy client libraries, which only the signed-in parts of the app need:
+
+    python startup_budget.py --budget 0.75
+
+Exits with status 1 if a page is over budget or imports one of them.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PAGES = [
+    "Home.py",
+    os.path.join("pages", "1_📝_Transcription.py"),
+    os.path.join("pages", "2_🖼️_Captioning.py"),
+]
+# Imported on first use, never for the login screen
+HEAVY_MODULES = ["openai", "boto3", "aiohttp", "httpx", "numpy", "faster_whisper"]
+# Seconds allowed from script start to the login form
+DEFAULT_BUDGET = 0.75
+
+# Runs in the fresh interpreter. Streamlit itself is needed to show anything,
+# so its import is reported but not counted against the budget.
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+app = AppTest.from_file(sys.argv[1], default_timeout=60).run()
+print(json.dumps({
+    "streamlit_import": imported - started,
+    "login_screen": time.perf_counter() - imported,
+    "login_form": any(b.label == "Login" for b in app.button),
+    "errors": [str(e.value) for e in app.exception],
+    "heavy": [m for m in sys.argv[2:] if m in sys.modules],
+}))
+"""
+
+
+def measure(page):
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE, page, *HEAVY_MODULES],
+        cwd=ROOT,
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=DEFAULT_BUDGET,
+        help="Seconds allowed from script start to the login form",
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    failed = False
+    for page in PAGES:
+        runs = [measure(page) for _ in range(args.runs)]
+        login_screen = statistics.median(run["login_screen"] for run in runs)
+        streamlit_import = statistics.median(run["streamlit_import"] for run in runs)
+        problems = []
+        if login_screen > args.budget:
+            problems.append(f"over the {args.budget:.2f}s budget")
+        if not all(run["login_form"] for run in runs):
+            problems.append("no login form")
+        for error in {error for run in runs for error in run["errors"]}:
+            problems.append(f"error: {error}")
+        heavy = sorted({module for run in runs for module in run["heavy"]})
+        if heavy:
+            problems.append(f"imports {', '.join(heavy)}")
+        failed = failed or bool(problems)
+        print(
+            f"{'FAIL' if problems else 'ok  '} {page}: login screen "
+            f"{login_screen:.2f}s (+{streamlit_import:.2f}s importing streamlit)"
+            + (f" - {'; '.join(problems)}" if problems else "")
+        )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import io
+import random
+
+from PIL import Image, ImageDraw
+
+from caption_index import CaptionIndex, image_hashes
+from image_hash import HammingIndex, dhash, hamming_distance, phash
+
+
+def make_image(seed, size=(256, 192)):
+    """A picture of a few random shapes."""
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(6):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        box = [x, y, x + rng.randrange(20, 120), y + rng.randrange(20, 120)]
+        color = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.ellipse(box, fill=color)
+        else:
+            draw.rectangle(box, fill=color)
+    return image
+
+
+def jpeg_bytes(image, quality=70):
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def test_search_matches_a_brute_force_scan():
+    rng = random.Random(1)
+    index = HammingIndex(max_distance=4)
+    hashes = [rng.getrandbits(64) for _ in range(500)]
+    # Near copies, so the range holds more than the exact matches
+    for i in range(0, 500, 5):
+        flipped = hashes[i]
+        for bit in rng.sample(range(64), rng.randrange(1, 7)):
+            flipped ^= 1 << bit
+        hashes.append(flipped)
+    for i, value in enumerate(hashes):
+        index.add(value, i)
+
+    for query in hashes[:50] + [rng.getrandbits(64) for _ in range(20)]:
+        expected = sorted(
+            (hamming_distance(query, value), i)
+            for i, value in enumerate(hashes)
+            if hamming_distance(query, value) <= 4
+        )
+        assert sorted(index.search(query)) == expected
+
+
+def test_search_returns_closest_first():
+    index = HammingIndex(max_distance=4)
+    index.add(0b1111, "four")
+    index.add(0b1, "one")
+    index.add(0, "exact")
+    assert [value for _, value in index.search(0)] == ["exact", "one", "four"]
+    assert index.search(0, max_distance=1) == [(0, "exact"), (1, "one")]
+
+
+def test_hashes_survive_resizing_and_recompression():
+    original = make_image(7)
+    copy = Image.open(io.BytesIO(jpeg_bytes(original.resize((128, 96)))))
+    assert hamming_distance(phash(original), phash(copy)) <= 4
+    assert hamming_distance(dhash(original), dhash(copy)) <= 10
+
+
+def test_different_images_hash_apart():
+    assert hamming_distance(phash(make_image(1)), phash(make_image(2))) > 4
+
+
+def test_caption_index_reuses_captions_across_opens(tmp_path):
+    path = str(tmp_path / "captions.db")
+    index = CaptionIndex(path)
+    original = jpeg_bytes(make_image(3), quality=95)
+    index.add(image_hashes(original), "three shapes")
+
+    reopened = CaptionIndex(path)
+    assert len(reopened) == 1
+    resized = jpeg_bytes(make_image(3).resize((200, 150)))
+    assert reopened.lookup(image_hashes(resized)) == "three shapes"
+    assert reopened.lookup(image_hashes(jpeg_bytes(make_image(4)))) is None
+
+
+def test_caption_index_keeps_hashes_with_the_top_bit_set(tmp_path):
+    path = str(tmp_path / "captions.db")
+    hashes = ((1 << 64) - 1, 1 << 63)
+    CaptionIndex(path).add(hashes, "bright")
+    assert CaptionIndex(path).lookup(hashes) == "bright"
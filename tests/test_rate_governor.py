@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from rate_governor import (
+    RateGovernor,
+    get_governor,
+    governed_call,
+    parse_reset_duration,
+)
+
+
+@pytest.mark.parametrize(
+    ("value", "seconds"),
+    [("20ms", 0.02), ("1s", 1), ("6m0s", 360), ("1h2m", 3720), ("2.5", 2.5)],
+)
+def test_parse_reset_duration(value, seconds):
+    assert parse_reset_duration(value) == pytest.approx(seconds)
+
+
+@pytest.mark.parametrize("value", [None, "", "soon"])
+def test_parse_reset_duration_unknown(value):
+    assert parse_reset_duration(value) is None
+
+
+def test_success_widens_the_window_additively():
+    governor = RateGovernor("test", initial_concurrency=2, max_concurrency=4)
+    governor.record_success()
+    assert governor.concurrency == pytest.approx(2.5)
+    for _ in range(20):
+        governor.record_success()
+    assert governor.concurrency == 4
+
+
+def test_rate_limit_halves_the_window_once_per_burst():
+    governor = RateGovernor("test", initial_concurrency=8, max_concurrency=16)
+    governor.record_rate_limited({"retry-after": "0"})
+    assert governor.concurrency == 4
+    # The other calls of the same burst report their 429 right after
+    governor.record_rate_limited({"retry-after": "0"})
+    assert governor.concurrency == 4
+
+
+def test_window_never_drops_below_one():
+    governor = RateGovernor("test", initial_concurrency=1)
+    governor.record_rate_limited()
+    assert governor.concurrency == 1
+
+
+def test_rate_limit_pauses_new_calls():
+    governor = RateGovernor("test")
+    governor.record_rate_limited({"retry-after": "5"})
+    assert governor._wait_time(time.monotonic(), 0) == pytest.approx(5, abs=0.1)
+
+
+def test_headers_replace_the_budgets():
+    governor = RateGovernor("test", requests_per_minute=50, tokens_per_minute=1000)
+    governor.record_success(
+        {
+            "x-ratelimit-limit-requests": "500",
+            "x-ratelimit-limit-tokens": "200000",
+            "x-ratelimit-remaining-requests": "10",
+            "x-ratelimit-remaining-tokens": "0",
+            "x-ratelimit-reset-tokens": "30s",
+        }
+    )
+    assert governor.requests_per_minute == 500
+    assert governor.tokens_per_minute == 200000
+    assert governor._request_budget == 10
+    # No tokens left: new calls wait for the reset
+    assert governor._wait_time(time.monotonic(), 100) == pytest.approx(30, abs=0.1)
+
+
+def test_token_budget_delays_large_calls():
+    governor = RateGovernor("test", tokens_per_minute=600)
+    governor.acquire(600)
+    governor.release()
+    # The bucket refills at 10 tokens a second
+    assert governor._wait_time(time.monotonic(), 100) == pytest.approx(10, abs=0.1)
+
+
+def test_a_call_larger_than_the_bucket_runs_once_it_is_full():
+    governor = RateGovernor("test", tokens_per_minute=600)
+    assert governor._wait_time(time.monotonic(), 10_000) == 0
+
+
+def test_concurrency_window_blocks_until_a_release():
+    governor = RateGovernor("test", initial_concurrency=1)
+    governor.acquire()
+    started = threading.Event()
+
+    def second_call():
+        governor.acquire()
+        started.set()
+
+    threading.Thread(target=second_call, daemon=True).start()
+    assert not started.wait(0.2)
+    governor.release()
+    assert started.wait(1)
+
+
+def test_governed_call_records_429s():
+    class RateLimited(Exception):
+        status_code = 429
+        response = None
+
+    with pytest.raises(RateLimited), governed_call("test-429"):
+        raise RateLimited()
+
+    governor = get_governor("test-429")
+    assert governor.in_flight == 0
+    assert governor._paused_until > time.monotonic()
@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+
+from s3_listing import iter_s3_objects
+
+
+class StubS3:
+    """list_objects_v2 over an in-memory bucket, `page_size` keys a page."""
+
+    def __init__(self, keys, page_size=3):
+        self.keys = sorted(keys)
+        self.page_size = page_size
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def list_objects_v2(
+        self, Bucket, Prefix="", Delimiter=None, ContinuationToken=None
+    ):
+        with self._lock:
+            self.calls += 1
+        contents = []
+        prefixes = []
+        for key in self.keys:
+            if not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix) :]
+            if Delimiter and Delimiter in rest:
+                common = Prefix + rest.split(Delimiter, 1)[0] + Delimiter
+                if common not in prefixes:
+                    prefixes.append(common)
+            else:
+                contents.append({"Key": key, "Size": len(key)})
+        # Contents and common prefixes share the page budget, as on S3
+        entries = [("key", obj) for obj in contents] + [("prefix", p) for p in prefixes]
+        entries.sort(
+            key=lambda entry: entry[1]["Key"] if entry[0] == "key" else entry[1]
+        )
+        start = int(ContinuationToken or 0)
+        page = entries[start : start + self.page_size]
+        result = {
+            "Contents": [obj for kind, obj in page if kind == "key"],
+            "CommonPrefixes": [{"Prefix": p} for kind, p in page if kind == "prefix"],
+            "IsTruncated": start + self.page_size < len(entries),
+        }
+        if result["IsTruncated"]:
+            result["NextContinuationToken"] = str(start + self.page_size)
+        return result
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        return self
+
+    def paginate(self, **params):
+        while True:
+            page = self.list_objects_v2(**params)
+            yield page
+            if not page["IsTruncated"]:
+                return
+            params["ContinuationToken"] = page["NextContinuationToken"]
+
+
+def bucket_keys():
+    keys = ["readme.txt", "top.mp4"]
+    for folder in ("a", "b", "c"):
+        for sub in ("x", "y"):
+            keys += [f"{folder}/{sub}/{i:02d}.mp4" for i in range(7)]
+        keys += [f"{folder}/notes.txt", f"{folder}/{folder}.MOV"]
+    return keys
+
+
+@pytest.mark.parametrize("workers", [1, 2, 4, 16])
+def test_yields_every_key_in_order(workers):
+    keys = bucket_keys()
+    listed = [
+        obj["Key"] for obj in iter_s3_objects(StubS3(keys), "bucket", workers=workers)
+    ]
+    assert listed == sorted(keys)
+
+
+def test_filters_extensions_case_insensitively():
+    keys = bucket_keys()
+    listed = [
+        obj["Key"]
+        for obj in iter_s3_objects(
+            StubS3(keys), "bucket", extensions=(".mp4", ".mov"), workers=8
+        )
+    ]
+    assert listed == sorted(k for k in keys if k.lower().endswith((".mp4", ".mov")))
+
+
+def test_lists_under_a_prefix():
+    keys = bucket_keys()
+    listed = [
+        obj["Key"] for obj in iter_s3_objects(StubS3(keys), "bucket", "b/", workers=4)
+    ]
+    assert listed == sorted(k for k in keys if k.startswith("b/"))
+
+
+def test_stopping_early_stops_the_listing():
+    keys = [f"{folder:02d}/{i:03d}.mp4" for folder in range(10) for i in range(300)]
+    client = StubS3(keys, page_size=10)
+    objects = iter_s3_objects(client, "bucket", workers=10)
+    first = [next(objects)["Key"] for _ in range(5)]
+    objects.close()
+
+    assert first == sorted(keys)[:5]
+    # Each partition is at most a page ahead, far short of its 30 pages
+    assert client.calls < 50
@@ -0,0 +1,157 @@
+import pytest
+
+import send_to_troweb
+from send_ledger import SendLedger
+from send_to_troweb import batch_mutation, group_by_size, insert_all, json_size
+
+
+def test_group_by_size_bounds_bytes():
+    items = ["a" * 10] * 7
+    item_size = json_size(items[0])
+    groups = group_by_size(items, item_size * 3)
+    assert [len(group) for group in groups] == [3, 3, 1]
+    assert [item for group in groups for item in group] == items
+
+
+def test_group_by_size_bounds_count():
+    groups = group_by_size(list(range(5)), 10**6, max_count=2)
+    assert groups == [[0, 1], [2, 3], [4]]
+
+
+def test_group_by_size_sends_oversized_items_alone():
+    items = ["small", "x" * 100, "small"]
+    groups = group_by_size(items, 20)
+    assert groups == [["small"], ["x" * 100], ["small"]]
+
+
+def test_group_by_size_custom_measure():
+    groups = group_by_size([3, 4, 5, 1], 7, measure=lambda n: n)
+    assert groups == [[3, 4], [5, 1]]
+    assert group_by_size([], 10) == []
+
+
+def test_batch_mutation_adds_then_starts():
+    document = batch_mutation(2, True)
+    assert document.startswith("mutation addAndStart($jobId: ObjectId!, ")
+    assert "$actions0: [BulkActionInput!]!" in document
+    assert "$actions1: [BulkActionInput!]!" in document
+    # Mutation fields run in document order: both adds before the start
+    add0 = document.index(
+        "add0: addBulkActions(bulkOperationId: $jobId, actions: $actions0)"
+    )
+    add1 = document.index(
+        "add1: addBulkActions(bulkOperationId: $jobId, actions: $actions1)"
+    )
+    start = document.index("start: startBulkOperation(_id: $jobId)")
+    assert add0 < add1 < start
+
+
+def test_batch_mutation_without_start():
+    document = batch_mutation(1, False)
+    assert "startBulkOperation" not in document
+    assert "add1" not in document
+
+
+def test_batch_mutation_is_built_once_per_shape():
+    assert batch_mutation(3, False) is batch_mutation(3, False)
+    assert batch_mutation(3, False) is not batch_mutation(3, True)
+
+
+class FakeTroweb:
+    """Answers the GraphQL documents insert_all sends, recording them."""
+
+    def __init__(self):
+        self.created = []
+        self.updated = []
+        self.jobs = 0
+
+    def __call__(self, query, variables):
+        if query.startswith("mutation createVideos"):
+            ids = []
+            for i in range(len(variables)):
+                self.created.append(variables[f"video{i}"])
+                ids.append(f"id-{len(self.created)}")
+            return {"data": {f"create{i}": {"_id": id_} for i, id_ in enumerate(ids)}}
+        if "createBulkOperation" in query:
+            self.jobs += 1
+            return {"data": {"createBulkOperation": {"_id": f"job-{self.jobs}"}}}
+        for name, actions in variables.items():
+            if name.startswith("actions"):
+                self.updated.extend(action["updateVideo"] for action in actions)
+        return {"data": {}}
+
+
+@pytest.fixture
+def troweb(monkeypatch, tmp_path):
+    fake = FakeTroweb()
+    ledger = SendLedger(str(tmp_path / "send_ledger.db"))
+    monkeypatch.setattr(send_to_troweb, "send_gql_request", fake)
+    monkeypatch.setattr(send_to_troweb, "get_send_ledger", lambda: ledger)
+    return fake
+
+
+def video(title, text):
+    return {
+        "title": title,
+        "transcription": text,
+        "url": f"https://bucket.s3.amazonaws.com/{title}.mp4?X-Amz-Signature=abc",
+    }
+
+
+def test_insert_all_creates_new_items_and_records_ids(troweb):
+    result = insert_all([video("a", "one"), video("b", "two")], "parent")
+    assert result["ids"] == {"a": "id-1", "b": "id-2"}
+    assert (result["created"], result["updated"], result["unchanged"]) == (2, 0, 0)
+    assert result["data"]["_id"] is None
+    assert [fields["tw_title"] for fields in troweb.created] == ["a", "b"]
+
+
+def test_insert_all_sends_only_the_delta(troweb):
+    insert_all([video("a", "one"), video("b", "two")], "parent")
+
+    # A fresh presigned URL alone is not a change
+    resent = video("a", "one")
+    resent["url"] = resent["url"].replace("abc", "def")
+    result = insert_all(
+        [resent, video("b", "two, edited"), video("c", "three")], "parent"
+    )
+
+    assert (result["created"], result["updated"], result["unchanged"]) == (1, 1, 1)
+    assert result["ids"] == {"c": "id-3", "b": "id-2"}
+    assert result["data"]["_id"] == "job-1"
+    assert [fields["tw_title"] for fields in troweb.created] == ["a", "b", "c"]
+    # The changed item is updated in place under its recorded id
+    assert troweb.updated == [
+        {
+            "tw_title": "b",
+            "transcript": "two, edited",
+            "publicUrl": video("b", "")["url"],
+            "_id": "id-2",
+        }
+    ]
+
+
+def test_insert_all_skips_unchanged_unless_forced(troweb):
+    insert_all([video("a", "one")], "parent")
+
+    result = insert_all([video("a", "one")], "parent")
+    assert (result["sent"], result["unchanged"]) == (0, 1)
+
+    result = insert_all([video("a", "one")], "parent", force=True)
+    assert (result["updated"], result["unchanged"]) == (1, 0)
+    assert troweb.updated[0]["_id"] == "id-1"
+
+
+def test_insert_all_resends_in_a_new_transcript_format(troweb):
+    item = dict(video("a", "hello"), segments=[[0.0, 1.0, "hello"]])
+    insert_all([item], "parent", transcript_format="text")
+
+    result = insert_all([item], "parent", transcript_format="srt")
+    assert result["updated"] == 1
+    assert troweb.updated[0]["transcript"].startswith("1\n00:00:00,000 --> ")
+
+
+def test_insert_all_ledger_is_per_collection(troweb):
+    insert_all([video("a", "one")], "parent")
+    result = insert_all([video("a", "one")], "other")
+    assert (result["created"], result["unchanged"]) == (1, 0)
@@ -0,0 +1,15 @@
+import pytest
+
+from startup_budget import DEFAULT_BUDGET, PAGES, measure
+
+# The probe runs each page under Streamlit's AppTest
+pytest.importorskip("streamlit")
+
+
+@pytest.mark.parametrize("page", PAGES)
+def test_login_screen_is_light_and_quick(page):
+    run = measure(page)
+    assert run["errors"] == []
+    assert run["login_form"]
+    assert run["heavy"] == []
+    assert run["login_screen"] <= DEFAULT_BUDGET
@@ -0,0 +1,91 @@
+import pytest
+
+from transcript_formats import (
+    format_timestamp,
+    from_verbose_json,
+    join,
+    render,
+    to_srt,
+    to_timestamped,
+    to_vtt,
+)
+
+SEGMENTS = [[0.0, 2.5, "Hello there."], [2.5, 3661.042, "General Kenobi."]]
+
+
+def test_format_timestamp():
+    assert format_timestamp(0) == "00:00:00,000"
+    assert format_timestamp(3661.042) == "01:01:01,042"
+    assert format_timestamp(59.9996, ".") == "00:01:00.000"
+
+
+def test_to_srt():
+    assert to_srt(SEGMENTS) == (
+        "1\n00:00:00,000 --> 00:00:02,500\nHello there.\n"
+        "\n"
+        "2\n00:00:02,500 --> 01:01:01,042\nGeneral Kenobi.\n"
+    )
+
+
+def test_to_vtt():
+    assert to_vtt(SEGMENTS) == (
+        "WEBVTT\n\n"
+        "00:00:00.000 --> 00:00:02.500\nHello there.\n"
+        "\n"
+        "00:00:02.500 --> 01:01:01.042\nGeneral Kenobi.\n"
+    )
+
+
+def test_to_timestamped():
+    assert to_timestamped(SEGMENTS) == (
+        "[00:00:00] Hello there.\n[00:00:02] General Kenobi."
+    )
+
+
+def test_join_offsets_each_piece_by_the_ones_before():
+    pieces = [
+        {"text": "one ", "segments": [[0.0, 10.0, "one"]], "duration": 600.5},
+        {"text": "two", "segments": [[1.0, 2.0, "two"]], "duration": None},
+        {"text": "three", "segments": [[0.25, 1.0, "three"]], "duration": 30.0},
+    ]
+    joined = join(pieces, default_duration=600)
+    assert joined["text"] == "one\ntwo\nthree"
+    # The second piece has no duration, so it counts as default_duration
+    assert joined["segments"] == [
+        [0.0, 10.0, "one"],
+        [601.5, 602.5, "two"],
+        [1200.75, 1201.5, "three"],
+    ]
+    assert joined["duration"] == 1230.5
+
+
+def test_join_drops_segments_if_a_piece_has_none():
+    pieces = [
+        {"text": "one", "segments": [[0.0, 1.0, "one"]], "duration": 5.0},
+        {"text": "two", "segments": None, "duration": 5.0},
+        {"text": "three", "segments": [[0.0, 1.0, "three"]], "duration": 5.0},
+    ]
+    assert join(pieces, default_duration=5)["segments"] is None
+
+
+def test_from_verbose_json():
+    response = {
+        "text": " Hi. ",
+        "duration": 4.2,
+        "segments": [{"start": 0.0, "end": 1.23456, "text": " Hi. "}],
+    }
+    assert from_verbose_json(response) == {
+        "text": "Hi.",
+        "segments": [[0.0, 1.235, "Hi."]],
+        "duration": 4.2,
+    }
+
+
+@pytest.mark.parametrize("fmt", ["text", "segments", "srt", "vtt"])
+def test_render_without_segments_is_text(fmt):
+    assert render("plain", None, fmt) == "plain"
+
+
+def test_render_unknown_format():
+    with pytest.raises(ValueError):
+        render("plain", SEGMENTS, "docx")
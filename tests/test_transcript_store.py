@@ -0,0 +1,71 @@
+import pytest
+
+from transcript_store import TranscriptStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TranscriptStore(str(tmp_path / "transcripts.db"))
+
+
+def test_put_and_get_by_key(store):
+    segments = [[0.0, 1.5, "hello"], [1.5, 3.0, "world"]]
+    store.put("hello world", s3_key="videos/a.mp4", etag="e1", segments=segments)
+
+    row = store.get("videos/a.mp4")
+    assert row["transcription"] == "hello world"
+    assert row["segments"] == segments
+    assert row["etag"] == "e1"
+    assert store.has_transcript(s3_key="videos/a.mp4")
+    assert store.get_by_etag("e1")["s3_key"] == "videos/a.mp4"
+
+
+def test_put_replaces_and_reindexes(store):
+    store.put("the quick brown fox", s3_key="a.mp4")
+    store.put("a lazy dog", s3_key="a.mp4")
+
+    assert store.get("a.mp4")["transcription"] == "a lazy dog"
+    assert len(list(store.iter_transcripts())) == 1
+    # The old text was deleted from the contentless index, not left behind
+    assert store.search("fox") == []
+    assert [row["s3_key"] for row in store.search("lazy")] == ["a.mp4"]
+
+
+def test_put_fills_a_registered_row(store):
+    store.register("videos/b.mp4", local_name="videos_b", etag="e2", title="B")
+    assert not store.has_transcript(s3_key="videos/b.mp4")
+    assert store.s3_key_for("videos_b") == "videos/b.mp4"
+
+    store.put("registered text", s3_key="videos/b.mp4")
+    row = store.get("videos/b.mp4")
+    assert row["transcription"] == "registered text"
+    assert (row["local_name"], row["etag"], row["title"]) == ("videos_b", "e2", "B")
+
+
+def test_local_name_does_not_touch_s3_rows(store):
+    store.register("videos/c.mp4", local_name="c")
+    store.put("upload text", local_name="c")
+
+    assert not store.has_transcript(s3_key="videos/c.mp4")
+    assert store.get_by_local_name("c")["s3_key"] is None
+    store.put("upload text, edited", local_name="c")
+    assert [row["transcription"] for row in store.iter_transcripts()] == [
+        "upload text, edited"
+    ]
+
+
+def test_search_ranks_best_match_first(store):
+    store.put("cats and dogs", s3_key="one.mp4")
+    store.put("cats cats cats", s3_key="two.mp4")
+    store.put("only dogs here", s3_key="three.mp4")
+
+    results = [row["s3_key"] for row in store.search("cats")]
+    assert results == ["two.mp4", "one.mp4"]
+    assert [row["s3_key"] for row in store.search("cats", limit=1)] == ["two.mp4"]
+
+
+def test_s3_key_for_rejects_ambiguous_names(store):
+    store.register("a/b.mp4", local_name="a_b")
+    store.register("a_b.mp4", local_name="a_b")
+    with pytest.raises(ValueError):
+        store.s3_key_for("a_b")
@@ -0,0 +1,140 @@
+import queue
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from transcription_backends import SAMPLE_RATE, WINDOW_SECONDS, LocalWhisperBackend
+
+# Installed with faster-whisper, which the local backend needs anyway
+np = pytest.importorskip("numpy")
+
+
+class StubPipeline:
+    """Returns one segment per clip, or the segments it was given."""
+
+    def __init__(self, segments=None):
+        self.segments = segments
+        self.calls = []
+
+    def transcribe(self, audio, clip_timestamps, **kwargs):
+        self.calls.append((audio, clip_timestamps))
+        if self.segments is not None:
+            return self.segments, None
+        return [
+            SimpleNamespace(
+                start=clip["start"] / SAMPLE_RATE,
+                end=clip["start"] / SAMPLE_RATE + 1,
+                text=f" clip at {clip['start'] // SAMPLE_RATE} ",
+            )
+            for clip in clip_timestamps
+        ], None
+
+
+class StubBackend(LocalWhisperBackend):
+    """The local backend without faster-whisper: clips are named by their
+    length in seconds, and "bad" ones fail to decode."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.batch_size = 8
+        self.language = None
+
+    def decode(self, source):
+        if source == "bad":
+            raise ValueError("cannot decode")
+        return np.ones(int(float(source) * SAMPLE_RATE), dtype=np.float32)
+
+
+def test_clips_are_padded_to_whole_windows():
+    pipeline = StubPipeline()
+    results = StubBackend(pipeline).transcribe_batch(["5", "40"])
+
+    audio, clips = pipeline.calls[0]
+    window = WINDOW_SECONDS * SAMPLE_RATE
+    assert len(audio) == 3 * window
+    assert [(c["start"], c["end"]) for c in clips] == [
+        (0, window),
+        (window, 2 * window),
+        (2 * window, 3 * window),
+    ]
+    assert results[0] == {
+        "text": "clip at 0",
+        "segments": [[0.0, 1.0, "clip at 0"]],
+        "duration": 5.0,
+    }
+    assert results[1]["segments"] == [
+        [0.0, 1.0, "clip at 30"],
+        [30.0, 31.0, "clip at 60"],
+    ]
+    assert results[1]["duration"] == 40.0
+
+
+def test_bad_decode_fails_only_its_file():
+    pipeline = StubPipeline()
+    results = StubBackend(pipeline).transcribe_batch(["bad", "5"])
+
+    assert isinstance(results[0], ValueError)
+    assert results[1]["text"] == "clip at 0"
+    assert len(pipeline.calls[0][0]) == WINDOW_SECONDS * SAMPLE_RATE
+
+
+def test_segments_are_kept_to_their_clip():
+    segments = [
+        SimpleNamespace(start=1.0, end=4.0, text="first"),
+        # Ends past the first clip's audio, in its padding
+        SimpleNamespace(start=4.0, end=6.0, text="tail"),
+        # Only padding
+        SimpleNamespace(start=20.0, end=21.0, text="hallucinated"),
+        # Runs from the first clip into the second
+        SimpleNamespace(start=29.0, end=31.0, text="across"),
+        SimpleNamespace(start=30.5, end=32.0, text="second"),
+    ]
+    results = StubBackend(StubPipeline(segments)).transcribe_batch(["5", "5"])
+
+    assert results[0]["segments"] == [[1.0, 4.0, "first"], [4.0, 5.0, "tail"]]
+    assert results[1]["segments"] == [[0.5, 2.0, "second"]]
+
+
+def test_transcribe_fails_only_the_bad_request():
+    backend = StubBackend(StubPipeline())
+    backend._requests = queue.Queue()
+    threading.Thread(target=backend._run, daemon=True).start()
+
+    results = {}
+
+    def run(source):
+        try:
+            results[source] = backend.transcribe(source)
+        except ValueError as e:
+            results[source] = e
+
+    threads = [threading.Thread(target=run, args=(s,)) for s in ("bad", "5")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert isinstance(results["bad"], ValueError)
+    assert results["5"]["text"] == "clip at 0"
+
+
+# The inference thread re-raises the error as it stops
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_unexpected_error_stops_the_backend():
+    class BrokenPipeline(StubPipeline):
+        def transcribe(self, audio, clip_timestamps, **kwargs):
+            raise KeyError("bug")
+
+    backend = StubBackend(BrokenPipeline())
+    backend._requests = queue.Queue()
+    thread = threading.Thread(target=backend._run, daemon=True)
+    thread.start()
+
+    with pytest.raises(KeyError):
+        backend.transcribe("5")
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    # Later calls fail at once instead of waiting on a dead thread
+    with pytest.raises(RuntimeError):
+        backend.transcribe("5")
@@ -0,0 +1,95 @@
+import pytest
+
+import work_queue
+from work_queue import MAX_ATTEMPTS, MemoryQueue, SQLiteQueue, open_work_queue
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(work_queue.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def queue(request, tmp_path, clock):
+    if request.param == "sqlite":
+        return SQLiteQueue(str(tmp_path / "queue.db"), lease_seconds=60)
+    return MemoryQueue(lease_seconds=60)
+
+
+def test_enqueue_is_unique_per_kind_and_key(queue):
+    assert queue.enqueue("transcribe", "a.mp4", {"bucket": "b"})
+    assert not queue.enqueue("transcribe", "a.mp4", {"bucket": "other"})
+    assert queue.enqueue("caption", "a.mp4", {})
+    assert queue.counts() == {"pending": 2}
+
+
+def test_leased_job_is_invisible_until_it_expires(queue, clock):
+    queue.enqueue("transcribe", "a.mp4", {"bucket": "b"})
+    (job,) = queue.lease("w1")
+    assert (job["key"], job["payload"], job["attempt"]) == ("a.mp4", {"bucket": "b"}, 1)
+    assert queue.lease("w2") == []
+
+    clock.now += 61
+    (job,) = queue.lease("w2")
+    assert job["attempt"] == 2
+    # The first worker lost the job and its late updates are ignored
+    assert not queue.heartbeat(job["id"], "w1")
+    assert not queue.complete(job["id"], "w1")
+    assert queue.complete(job["id"], "w2")
+    assert queue.counts() == {"done": 1}
+
+
+def test_heartbeat_extends_the_lease(queue, clock):
+    queue.enqueue("transcribe", "a.mp4", {})
+    (job,) = queue.lease("w1")
+    clock.now += 50
+    assert queue.heartbeat(job["id"], "w1")
+    clock.now += 50
+    assert queue.lease("w2") == []
+
+
+def test_fail_retries_then_parks(queue):
+    queue.enqueue("transcribe", "a.mp4", {})
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        (job,) = queue.lease("w1")
+        assert job["attempt"] == attempt
+        assert queue.fail(job["id"], "w1", f"error {attempt}")
+
+    assert queue.lease("w1") == []
+    assert queue.counts() == {"failed": 1}
+    assert queue.failed_jobs() == [("a.mp4", MAX_ATTEMPTS, f"error {MAX_ATTEMPTS}")]
+
+
+def test_expired_leases_count_as_attempts(queue, clock):
+    queue.enqueue("transcribe", "a.mp4", {})
+    for _ in range(MAX_ATTEMPTS):
+        assert len(queue.lease("w1")) == 1
+        clock.now += 61
+
+    assert queue.lease("w1") == []
+    assert queue.failed_jobs() == [("a.mp4", MAX_ATTEMPTS, "lease expired")]
+
+
+def test_lease_respects_limit(queue):
+    for name in ("a", "b", "c"):
+        queue.enqueue("transcribe", name, {})
+    assert [job["key"] for job in queue.lease("w1", limit=2)] == ["a", "b"]
+    assert [job["key"] for job in queue.lease("w2", limit=2)] == ["c"]
+
+
+def test_open_work_queue(tmp_path):
+    assert isinstance(open_work_queue("memory://"), MemoryQueue)
+    queue = open_work_queue(f"sqlite:///{tmp_path / 'queue.db'}")
+    assert isinstance(queue, SQLiteQueue)
+    with pytest.raises(ValueError):
+        open_work_queue("redis://localhost")
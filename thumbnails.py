@@ -0,0 +1,93 @@
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from disk_manager import DiskQuotaExceeded, ensure_space
+
+# One of the working directories under the disk quota (see disk_manager)
+THUMBNAIL_DIR = "thumbnails"
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 75
+# Upper end of the size of one thumbnail, to make room before building them
+THUMBNAIL_BYTES = 32 * 1024
+
+
+def thumbnail_path(bucket_name, key, etag):
+    """Cache path for a thumbnail; a new ETag means a new object version."""
+    digest = hashlib.sha1(f"{bucket_name}/{key}@{etag}".encode()).hexdigest()
+    return os.path.join(THUMBNAIL_DIR, digest[:2], digest + ".webp")
+
+
+def make_thumbnail(image_data, path, size=THUMBNAIL_SIZE):
+    with Image.open(io.BytesIO(image_data)) as image:
+        # Let the JPEG decoder downscale while decoding where it can
+        image.draft("RGB", size)
+        image.thumbnail(size)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name so readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            image.save(tmp_path, "WEBP", quality=THUMBNAIL_QUALITY)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+
+def get_thumbnail(s3_client, bucket_name, key, etag):
+    """Return a local WebP thumbnail for an S3 image, generating it once."""
+    path = thumbnail_path(bucket_name, key, etag)
+    if not os.path.exists(path):
+        image_obj = s3_client.get_object(Bucket=bucket_name, Key=key)
+        make_thumbnail(image_obj["Body"].read(), path)
+    return path
+
+
+def get_thumbnails(s3_client, bucket_name, etags, workers=8):
+    """Return {key: thumbnail path} for a {key: etag} mapping.
+
+    Cached thumbnails are returned without touching S3; missing ones are
+    generated in parallel. Keys whose thumbnail cannot be built are left out.
+    """
+    # The S3 client has loaded botocore already
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    paths = {}
+    missing = []
+    for key, etag in etags.items():
+        path = thumbnail_path(bucket_name, key, etag)
+        if os.path.exists(path):
+            paths[key] = path
+        else:
+            missing.append(key)
+
+    def build(key):
+        try:
+            return key, get_thumbnail(s3_client, bucket_name, key, etags[key])
+        except (
+            BotoCoreError,
+            ClientError,
+            OSError,
+            Image.DecompressionBombError,
+        ) as e:
+            print(f"Error creating thumbnail for {key}: {e}")
+            return key, None
+
+    if missing:
+        os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+        try:
+            ensure_space(len(missing) * THUMBNAIL_BYTES, THUMBNAIL_DIR)
+        except DiskQuotaExceeded as e:
+            print(f"Not creating thumbnails: {e}")
+            return paths
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for key, path in pool.map(build, missing):
+                if path:
+                    paths[key] = path
+    return paths
@@ -0,0 +1,134 @@
+import json
+
+from extract_audio import reproject_timestamp
+
+# A transcript is {"text": ..., "segments": [[start, end, text], ...],
+# "duration": ...}, times in seconds. Transcription asks for segments once and
+# every other format is derived from them here, without another API call.
+# Transcripts stored before segments were kept have "segments": None and can
+# only be rendered as text.
+FORMATS = {
+    "text": (".txt", "text/plain"),
+    "segments": (".txt", "text/plain"),
+    "srt": (".srt", "application/x-subrip"),
+    "vtt": (".vtt", "text/vtt"),
+}
+# Formats with a fixed structure, which nothing may be appended to
+SUBTITLE_FORMATS = ("srt", "vtt")
+
+
+def _field(item, name):
+    # The OpenAI SDK returns objects, plain JSON responses dicts
+    if isinstance(item, dict):
+        return item.get(name)
+    return getattr(item, name, None)
+
+
+def from_verbose_json(response):
+    """Build a transcript from a verbose_json transcription response."""
+    if isinstance(response, str):
+        response = json.loads(response)
+    segments = [
+        [
+            round(_field(s, "start"), 3),
+            round(_field(s, "end"), 3),
+            _field(s, "text").strip(),
+        ]
+        for s in _field(response, "segments") or []
+    ]
+    return {
+        "text": (_field(response, "text") or "").strip(),
+        "segments": segments,
+        "duration": _field(response, "duration"),
+    }
+
+
+def shift(segments, offset):
+    return [
+        [round(start + offset, 3), round(end + offset, 3), text]
+        for start, end, text in segments
+    ]
+
+
+def join(transcripts, default_duration):
+    """Join consecutive pieces of one recording, offsetting their timings by
+    the length of the pieces before them."""
+    segments = []
+    offset = 0.0
+    for transcript in transcripts:
+        if segments is not None and transcript["segments"] is not None:
+            segments += shift(transcript["segments"], offset)
+        else:
+            segments = None
+        offset += transcript.get("duration") or default_duration
+    return {
+        "text": "\n".join(t["text"].strip() for t in transcripts),
+        "segments": segments,
+        "duration": round(offset, 3),
+    }
+
+
+def reproject(transcript, timestamp_map):
+    """Map the timings of a transcript of pre-conditioned audio back onto
+    the original recording."""
+    if not timestamp_map or not transcript.get("segments"):
+        return transcript
+    segments = [
+        [
+            round(reproject_timestamp(timestamp_map, start), 3),
+            round(reproject_timestamp(timestamp_map, end), 3),
+            text,
+        ]
+        for start, end, text in transcript["segments"]
+    ]
+    return {**transcript, "segments": segments}
+
+
+def format_timestamp(seconds, decimal_marker=","):
+    milliseconds = round(seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{decimal_marker}{milliseconds:03d}"
+
+
+def to_srt(segments):
+    return "\n".join(
+        f"{i}\n{format_timestamp(start)} --> {format_timestamp(end)}\n{text}\n"
+        for i, (start, end, text) in enumerate(segments, 1)
+    )
+
+
+def to_vtt(segments):
+    return "WEBVTT\n\n" + "\n".join(
+        f"{format_timestamp(start, '.')} --> {format_timestamp(end, '.')}\n{text}\n"
+        for start, end, text in segments
+    )
+
+
+def to_timestamped(segments):
+    return "\n".join(
+        f"[{format_timestamp(start)[:8]}] {text}" for start, _, text in segments
+    )
+
+
+def available_formats(segments):
+    return list(FORMATS) if segments else ["text"]
+
+
+def renders_as_subtitles(segments, fmt):
+    return fmt in SUBTITLE_FORMATS and bool(segments)
+
+
+def render(text, segments, fmt="text"):
+    """Render a transcript in `fmt`, falling back to plain text when it has
+    no segments."""
+    if fmt == "text" or not segments:
+        return text
+    if fmt == "srt":
+        return to_srt(segments)
+    if fmt == "vtt":
+        return to_vtt(segments)
+    if fmt == "segments":
+        return to_timestamped(segments)
+    raise ValueError(f"Unknown transcript format: {fmt}")
@@ -0,0 +1,299 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zlib is always available, just larger and slower
+    zstandard = None
+
+TRANSCRIPT_STORE_PATH = os.getenv("TRANSCRIPT_STORE_PATH", "transcripts.db")
+
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+
+def _compress(text):
+    data = text.encode("utf-8")
+    if zstandard is not None:
+        return CODEC_ZSTD, zstandard.ZstdCompressor(level=9).compress(data)
+    return CODEC_ZLIB, zlib.compress(data, 9)
+
+
+def _decompress(codec, blob):
+    if blob is None:
+        return None
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdDecompressor().decompress(blob).decode("utf-8")
+    return zlib.decompress(blob).decode("utf-8")
+
+
+class TranscriptStore:
+    """All transcripts in one SQLite file, compressed and full-text indexed.
+
+    Rows are keyed by S3 key where one is known. Files processed from the
+    local working directories are also reachable by `local_name`, the
+    flattened file name (without extension) the download step gives them.
+    """
+
+    def __init__(self, path=TRANSCRIPT_STORE_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS transcripts (
+                id INTEGER PRIMARY KEY,
+                s3_key TEXT UNIQUE,
+                local_name TEXT,
+                etag TEXT,
+                title TEXT,
+                codec INTEGER,
+                body BLOB,
+                updated_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS transcripts_local_name
+                ON transcripts (local_name);
+            CREATE INDEX IF NOT EXISTS transcripts_etag ON transcripts (etag);
+            """
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(transcripts)")]
+        if "segments" not in columns:
+            # Timed segments, as compressed JSON; NULL for older transcripts
+            self._db.execute("ALTER TABLE transcripts ADD COLUMN segments BLOB")
+        # Contentless: the index stores no text, the compressed body is the
+        # only copy.
+        self._db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts "
+            "USING fts5(body, content='')"
+        )
+        self._db.commit()
+
+    def _row(self, row):
+        if row is None:
+            return None
+        s3_key, local_name, etag, title, codec, body, segments, updated_at = row
+        segments = _decompress(codec, segments)
+        return {
+            "s3_key": s3_key,
+            "local_name": local_name,
+            "etag": etag,
+            "title": title,
+            "transcription": _decompress(codec, body),
+            "segments": json.loads(segments) if segments else None,
+            "updated_at": updated_at,
+        }
+
+    def _fetch_one(self, where, value):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT s3_key, local_name, etag, title, codec, body, segments, "
+                f"updated_at FROM transcripts WHERE {where} = ? "
+                "ORDER BY id DESC LIMIT 1",
+                (value,),
+            ).fetchone()
+        return self._row(row)
+
+    def get(self, s3_key):
+        return self._fetch_one("s3_key", s3_key)
+
+    def get_by_local_name(self, local_name):
+        return self._fetch_one("local_name", local_name)
+
+    def get_by_etag(self, etag):
+        """Return the latest transcript of an object with this ETag, under
+        whatever key it was stored; a copied object keeps its ETag."""
+        return self._fetch_one("etag", etag)
+
+    def s3_key_for(self, local_name):
+        """Return the S3 key a downloaded file was registered under, or None.
+
+        Raises ValueError if several keys flatten to the same local name, as
+        `a/b.mp4` and `a_b.mp4` do; the download step avoids that.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT s3_key FROM transcripts "
+                "WHERE local_name = ? AND s3_key IS NOT NULL",
+                (local_name,),
+            ).fetchall()
+        if len(rows) > 1:
+            keys = ", ".join(key for (key,) in rows)
+            raise ValueError(f"{local_name} is the local name of several keys: {keys}")
+        return rows[0][0] if rows else None
+
+    def has_transcript(self, s3_key=None, local_name=None):
+        column, value = ("s3_key", s3_key) if s3_key else ("local_name", local_name)
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT 1 FROM transcripts WHERE {column} = ? AND body IS NOT NULL",
+                (value,),
+            ).fetchone()
+        return row is not None
+
+    def register(self, s3_key, local_name=None, etag=None, title=None):
+        """Record where a downloaded object came from, ahead of its transcript."""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO transcripts (s3_key, local_name, etag, title) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (s3_key) DO UPDATE SET "
+                "local_name = excluded.local_name, etag = excluded.etag, "
+                "title = COALESCE(excluded.title, title)",
+                (s3_key, local_name, etag, title),
+            )
+            self._db.commit()
+
+    def put(
+        self, text, s3_key=None, local_name=None, etag=None, title=None, segments=None
+    ):
+        """Store a transcript by S3 key, or by local name for a file that has
+        none, such as an upload.
+
+        A local name only ever addresses the row without an S3 key, never
+        the rows of S3 objects downloaded under that name: look their key
+        up with `s3_key_for` instead.
+
+        `segments` are its [start, end, text] timings, from which subtitles
+        are rendered; they are kept compressed next to the text.
+        """
+        codec, body = _compress(text)
+        if segments is not None:
+            _, segments = _compress(json.dumps(segments, separators=(",", ":")))
+        now = time.time()
+        with self._lock:
+            if s3_key:
+                rows = self._db.execute(
+                    "SELECT id, codec, body FROM transcripts WHERE s3_key = ?",
+                    (s3_key,),
+                ).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT id, codec, body FROM transcripts "
+                    "WHERE local_name = ? AND s3_key IS NULL",
+                    (local_name,),
+                ).fetchall()
+                if len(rows) > 1:
+                    raise ValueError(f"Several transcripts are named {local_name}")
+
+            if not rows:
+                cursor = self._db.execute(
+                    "INSERT INTO transcripts "
+                    "(s3_key, local_name, etag, title, codec, body, segments, "
+                    "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (s3_key, local_name, etag, title, codec, body, segments, now),
+                )
+                rows = [(cursor.lastrowid, None, None)]
+
+            for row_id, old_codec, old_body in rows:
+                if old_body is not None:
+                    # Contentless FTS5 needs the old text to unindex a row
+                    self._db.execute(
+                        "INSERT INTO transcripts_fts (transcripts_fts, rowid, body) "
+                        "VALUES ('delete', ?, ?)",
+                        (row_id, _decompress(old_codec, old_body)),
+                    )
+                self._db.execute(
+                    "UPDATE transcripts SET codec = ?, body = ?, segments = ?, "
+                    "updated_at = ?, local_name = COALESCE(?, local_name), "
+                    "etag = COALESCE(?, etag), title = COALESCE(?, title) "
+                    "WHERE id = ?",
+                    (codec, body, segments, now, local_name, etag, title, row_id),
+                )
+                self._db.execute(
+                    "INSERT INTO transcripts_fts (rowid, body) VALUES (?, ?)",
+                    (row_id, text),
+                )
+            self._db.commit()
+
+    def iter_transcripts(self):
+        """Yield every stored transcript in one sequential scan."""
+        with self._lock:
+            cursor = self._db.execute(
+                "SELECT s3_key, local_name, etag, title, codec, body, segments, "
+                "updated_at FROM transcripts WHERE body IS NOT NULL ORDER BY id"
+            )
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(500)
+            if not rows:
+                break
+            for row in rows:
+                yield self._row(row)
+
+    def search(self, query, limit=20):
+        """Full-text search, best matches first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT t.s3_key, t.local_name, t.etag, t.title, t.codec, t.body, "
+                "t.segments, t.updated_at FROM transcripts_fts f "
+                "JOIN transcripts t ON t.id = f.rowid "
+                "WHERE transcripts_fts MATCH ? ORDER BY f.rank LIMIT ?",
+                (query, limit),
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def export_jsonl(self, path):
+        """Write every transcript to a JSON Lines file, returning the count."""
+        count = 0
+        with open(path, "w", encoding="utf-8") as f:
+            for row in self.iter_transcripts():
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                count += 1
+        return count
+
+    def import_markdown_dir(self, directory="transcription"):
+        """Load legacy one-file-per-video transcripts, returning the count."""
+        count = 0
+        for file_name in sorted(os.listdir(directory)):
+            if not file_name.endswith(".md"):
+                continue
+            with open(os.path.join(directory, file_name), encoding="utf-8") as f:
+                self.put(f.read(), local_name=os.path.splitext(file_name)[0])
+            count += 1
+        return count
+
+
+_transcript_store = None
+_transcript_store_lock = threading.Lock()
+
+
+def get_transcript_store():
+    """Return the process-wide transcript store, opening it on first use."""
+    global _transcript_store
+    with _transcript_store_lock:
+        if _transcript_store is None:
+            _transcript_store = TranscriptStore()
+        return _transcript_store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the transcript store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="Import legacy .md transcripts")
+    import_parser.add_argument("directory", nargs="?", default="transcription")
+    export_parser = commands.add_parser("export", help="Export to JSON Lines")
+    export_parser.add_argument("path")
+    search_parser = commands.add_parser("search", help="Full-text search")
+    search_parser.add_argument("query")
+    show_parser = commands.add_parser("show", help="Print one transcript")
+    show_parser.add_argument("key", help="S3 key, or ETag with --etag")
+    show_parser.add_argument("--etag", action="store_true")
+    args = parser.parse_args()
+
+    store = get_transcript_store()
+    if args.command == "import":
+        print(f"Imported {store.import_markdown_dir(args.directory)} transcripts")
+    elif args.command == "export":
+        print(f"Exported {store.export_jsonl(args.path)} transcripts")
+    elif args.command == "show":
+        row = store.get_by_etag(args.key) if args.etag else store.get(args.key)
+        if row is None or row["transcription"] is None:
+            print(f"No transcript for {args.key}")
+        else:
+            print(row["transcription"])
+    else:
+        for row in store.search(args.query):
+            print(row["s3_key"] or row["local_name"])
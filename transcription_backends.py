@@ -0,0 +1,312 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import importlib.util
+
+from buffers import BufferReader, buffer_size
+from clients import get_openai_client
+from extract_audio import get_media_duration
+from extract_transcript import (
+    HEDGE_TRANSCRIPTIONS,
+    STREAM_FIRST_CHUNK_SECONDS,
+    WHISPER_MAX_BYTES,
+    needs_chunking,
+    transcribe_audio,
+    transcribe_in_chunks,
+    worth_streaming,
+)
+
+# "auto" routes short clips to the local engine when it is installed, "openai"
+# and "local" send everything to one backend (local works air-gapped).
+TRANSCRIPTION_BACKEND = os.getenv("TRANSCRIPTION_BACKEND", "auto")
+# Clips up to this long are transcribed locally under "auto". In-memory
+# uploads have no duration yet and are routed by size instead.
+LOCAL_MAX_SECONDS = float(os.getenv("LOCAL_MAX_SECONDS", "120"))
+LOCAL_MAX_BYTES = int(os.getenv("LOCAL_MAX_BYTES", str(2 * 1024 * 1024)))
+LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "small")
+# None detects the language of every segment
+LOCAL_WHISPER_LANGUAGE = os.getenv("LOCAL_WHISPER_LANGUAGE") or None
+LOCAL_BATCH_SIZE = int(os.getenv("LOCAL_BATCH_SIZE", "8"))
+# How long the local engine waits for more clips to fill a batch
+LOCAL_BATCH_WINDOW = 0.05
+
+SAMPLE_RATE = 16000
+# Local transcription is optional, and faster-whisper is slow to import, so
+# it is only imported when the local engine is first built
+HAS_FASTER_WHISPER = importlib.util.find_spec("faster_whisper") is not None
+
+# Whisper's input window; batched inference runs on pieces of at most this.
+# Each clip is padded to whole windows, which Whisper would pad it to anyway,
+# so no piece holds audio of two clips.
+WINDOW_SECONDS = 30
+
+
+class OpenAIBackend:
+    """The hosted whisper-1 model, through the rate governor."""
+
+    name = "openai"
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        # Created on first use, so local-only runs need no API key
+        if self._client is None:
+            self._client = get_openai_client()
+        return self._client
+
+    def transcribe(self, audio, hedge=HEDGE_TRANSCRIPTIONS, on_chunk=None, route=None):
+        """Transcribe `audio`, in chunks when it needs them or when `route`,
+        from a plan, is "chunked".
+
+        With `on_chunk`, a long file is also cut into a short first chunk
+        and long ones after it, so its first text shows within seconds.
+        """
+        if isinstance(audio, (str, os.PathLike)):
+            chunked = route == "chunked" if route else needs_chunking(audio)
+            if chunked or (on_chunk and worth_streaming(audio)):
+                return transcribe_in_chunks(
+                    self.client,
+                    audio,
+                    hedge,
+                    on_chunk=on_chunk,
+                    first_chunk_seconds=STREAM_FIRST_CHUNK_SECONDS
+                    if on_chunk
+                    else None,
+                )
+        transcript = transcribe_audio(self.client, audio, hedge)
+        if on_chunk:
+            on_chunk(0, 1, transcript["text"])
+        return transcript
+
+
+class LocalWhisperBackend:
+    """faster-whisper (CTranslate2, int8) on the CPU, batched across files.
+
+    Calls from any thread are queued for a single inference thread. It takes
+    whatever clips arrive within LOCAL_BATCH_WINDOW, lays them end to end
+    and transcribes their 30 s windows together in batches of `batch_size`,
+    so many short clips share one pass over the model. CTranslate2 spreads
+    each batch over all cores.
+    """
+
+    name = "local"
+    # The error that stopped the inference thread, if one did
+    _stopped = None
+
+    def __init__(
+        self,
+        model_size=LOCAL_WHISPER_MODEL,
+        batch_size=LOCAL_BATCH_SIZE,
+        language=LOCAL_WHISPER_LANGUAGE,
+    ):
+        if not HAS_FASTER_WHISPER:
+            raise RuntimeError("Local transcription needs faster-whisper installed")
+        from faster_whisper import BatchedInferencePipeline, WhisperModel
+
+        model = WhisperModel(
+            model_size,
+            device="cpu",
+            compute_type="int8",
+            cpu_threads=os.cpu_count() or 1,
+        )
+        self.pipeline = BatchedInferencePipeline(model)
+        self.batch_size = batch_size
+        self.language = language
+        self._requests = queue.Queue()
+        threading.Thread(target=self._run, name="local-whisper", daemon=True).start()
+
+    def transcribe(self, audio, hedge=False, on_chunk=None, route=None):
+        """Transcribe a path or in-memory file. `hedge` and `route` have no
+        meaning locally, and the clips routed here are short enough to arrive
+        in one piece."""
+        if self._stopped is not None:
+            raise RuntimeError("Local transcription has stopped") from self._stopped
+        future = Future()
+        self._requests.put((audio, future))
+        transcript = future.result()
+        if on_chunk:
+            on_chunk(0, 1, transcript["text"])
+        return transcript
+
+    def _next_batch(self):
+        batch = [self._requests.get()]
+        deadline = time.monotonic() + LOCAL_BATCH_WINDOW
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self.transcribe_batch([audio for audio, _ in batch])
+            except (RuntimeError, OSError, ValueError, MemoryError) as e:
+                # CTranslate2 raises RuntimeError, running out of memory included
+                results = [e] * len(batch)
+            except BaseException as e:
+                # A bug: fail this batch and everything queued, then stop
+                self._stopped = e
+                while batch:
+                    for _, future in batch:
+                        future.set_exception(e)
+                    try:
+                        batch = [self._requests.get_nowait()]
+                    except queue.Empty:
+                        batch = []
+                raise
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def decode(self, source):
+        from faster_whisper.audio import decode_audio
+
+        if not isinstance(source, (str, os.PathLike)):
+            source = BufferReader(source, getattr(source, "name", "audio"))
+        return decode_audio(source, sampling_rate=SAMPLE_RATE)
+
+    def transcribe_batch(self, sources):
+        """Transcribe several files in one batched pass, returning a
+        transcript of each with segment timings relative to its own start.
+
+        A file that fails to decode gets its exception in its place in the
+        result, and the others are transcribed without it.
+        """
+        import numpy as np
+
+        results = [None] * len(sources)
+        pieces = []
+        clips = []
+        # (index, start, end of audio, end of padding) in seconds
+        spans = []
+        offset = 0
+        window = WINDOW_SECONDS * SAMPLE_RATE
+        for i, source in enumerate(sources):
+            try:
+                audio = self.decode(source)
+            # PyAV's errors are also OSError, ValueError or RuntimeError
+            except (OSError, ValueError, RuntimeError) as e:
+                results[i] = e
+                continue
+            # Batched clip timestamps are sample indices into the whole array,
+            # and every clip is a full window so none is merged with the next
+            padded = max(1, -(-len(audio) // window)) * window
+            for start in range(0, padded, window):
+                clips.append({"start": offset + start, "end": offset + start + window})
+            spans.append(
+                (
+                    i,
+                    offset / SAMPLE_RATE,
+                    (offset + len(audio)) / SAMPLE_RATE,
+                    (offset + padded) / SAMPLE_RATE,
+                )
+            )
+            pieces += [audio, np.zeros(padded - len(audio), dtype=np.float32)]
+            offset += padded
+        if not spans:
+            return results
+
+        segments, _ = self.pipeline.transcribe(
+            np.concatenate(pieces),
+            language=self.language,
+            multilingual=self.language is None,
+            clip_timestamps=clips,
+            vad_filter=False,
+            batch_size=self.batch_size,
+            without_timestamps=False,
+        )
+        timed = {i: [] for i, _, _, _ in spans}
+        for segment in segments:
+            for i, start, end, boundary in spans:
+                if start <= segment.start < boundary:
+                    if segment.end > boundary:
+                        print("Dropping a segment that runs into the next clip")
+                    elif segment.start < end:
+                        timed[i].append(
+                            [
+                                round(segment.start - start, 3),
+                                round(min(segment.end, end) - start, 3),
+                                segment.text.strip(),
+                            ]
+                        )
+                    break
+        for i, start, end, _ in spans:
+            results[i] = {
+                "text": " ".join(text for _, _, text in timed[i]),
+                "segments": timed[i],
+                "duration": round(end - start, 3),
+            }
+        return results
+
+
+class TranscriptionRouter:
+    """Sends short clips to the local engine and everything else to OpenAI."""
+
+    def __init__(self, remote, local=None, mode=TRANSCRIPTION_BACKEND):
+        if mode == "local" and local is None:
+            raise RuntimeError("TRANSCRIPTION_BACKEND=local needs faster-whisper")
+        self.remote = remote
+        self.local = local
+        self.mode = mode
+
+    def backend_for(self, audio, route=None):
+        """Pick the backend for `audio`, or the one `route` from a plan names."""
+        if self.mode == "openai" or self.local is None:
+            return self.remote
+        if self.mode == "local":
+            return self.local
+        if route:
+            return self.local if route == "local" else self.remote
+        if isinstance(audio, (str, os.PathLike)):
+            short = runs_locally(get_media_duration(audio))
+        else:
+            short = buffer_size(audio) <= LOCAL_MAX_BYTES
+        return self.local if short else self.remote
+
+    def transcribe(self, audio, hedge=HEDGE_TRANSCRIPTIONS, on_chunk=None, route=None):
+        """Transcribe `audio`. A plan's `route` ("local", "direct" or
+        "chunked", see planner) is followed rather than decided again."""
+        return self.backend_for(audio, route).transcribe(audio, hedge, on_chunk, route)
+
+
+def runs_locally(duration):
+    """True if a file of `duration` seconds goes to the local engine."""
+    if TRANSCRIPTION_BACKEND == "openai" or not HAS_FASTER_WHISPER:
+        return False
+    if TRANSCRIPTION_BACKEND == "local":
+        return True
+    return duration is not None and duration <= LOCAL_MAX_SECONDS
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_transcription_router():
+    """Return the process-wide router, loading the local model on first use."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            local = None
+            if TRANSCRIPTION_BACKEND != "openai" and HAS_FASTER_WHISPER:
+                local = LocalWhisperBackend()
+            _router = TranscriptionRouter(OpenAIBackend(), local)
+        return _router
+
+
+def fits_single_request(audio):
+    """True if an in-memory upload can go to the hosted model in one request."""
+    return buffer_size(audio) <= WHISPER_MAX_BYTES
@@ -0,0 +1,230 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import APIError
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from caption_images import caption_uploaded_image, image_extensions
+from download import prepare_application, video_extensions
+from extract_audio import (
+    audio_extensions,
+    audio_output_path,
+    extract_audio_from_mp4_ffmpeg,
+)
+from extract_transcript import process_single_audio_file
+from transcript_store import get_transcript_store
+
+
+def is_audio(path):
+    directory, file_name = os.path.split(path)
+    return directory == "audio" and file_name.lower().endswith(audio_extensions)
+
+
+def output_path_for(path):
+    """Return the file the pipeline produces from `path`, or None.
+
+    Audio has no output file; its transcript goes to the transcript store.
+    """
+    directory, file_name = os.path.split(path)
+    stem, ext = os.path.splitext(file_name)
+    ext = ext.lower()
+    if directory == "files" and ext in video_extensions:
+        return audio_output_path(file_name)
+    if directory == "files" and ext in image_extensions:
+        return os.path.join("files", stem + "_caption.txt")
+    return None
+
+
+def is_watched(path):
+    return is_audio(path) or output_path_for(path) is not None
+
+
+def is_stale(path):
+    """True if `path` has no output yet or changed after its output was written."""
+    if is_audio(path):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        row = get_transcript_store().get_by_local_name(stem)
+        if row is None or row["transcription"] is None:
+            return True
+        return os.path.getmtime(path) > row["updated_at"]
+    output = output_path_for(path)
+    if output is None:
+        return False
+    if not os.path.exists(output):
+        if output.startswith("audio"):
+            # The audio may have been evicted after it was transcribed
+            stem = os.path.splitext(os.path.basename(path))[0]
+            row = get_transcript_store().get_by_local_name(stem)
+            if row is not None and row["transcription"] is not None:
+                return os.path.getmtime(path) > row["updated_at"]
+        return True
+    return os.path.getmtime(path) > os.path.getmtime(output)
+
+
+class PendingFiles(FileSystemEventHandler):
+    """Collects filesystem events and releases each path once it has settled.
+
+    Bursts of events for the same path collapse into one entry, and a path is
+    only released after `settle_seconds` without events and with an unchanged
+    size, so files that are still being copied in are not picked up early.
+    """
+
+    def __init__(self, settle_seconds=2.0):
+        self.settle_seconds = settle_seconds
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def touch(self, path):
+        path = os.path.relpath(path)
+        if not is_watched(path):
+            return
+        with self._lock:
+            self._pending[path] = (time.monotonic(), None)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.touch(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.touch(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.touch(event.dest_path)
+
+    def settled(self):
+        """Pop and return the paths that are ready to process."""
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for path, (last_event, last_size) in list(self._pending.items()):
+                if now - last_event < self.settle_seconds:
+                    continue
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    # Deleted or renamed away before it settled.
+                    del self._pending[path]
+                    continue
+                if size != last_size:
+                    self._pending[path] = (now, size)
+                    continue
+                del self._pending[path]
+                ready.append(path)
+        return ready
+
+
+class FolderWatcher:
+    """Runs new or changed media in the working directories through the pipeline.
+
+    Videos dropped into `files/` have their audio extracted into `audio/`,
+    which in turn is transcribed into the transcript store. Images in `files/` get
+    a `_caption.txt` sidecar next to them.
+    """
+
+    def __init__(self, settle_seconds=2.0, workers=4):
+        self.pending = PendingFiles(settle_seconds)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._running = set()
+        self._rerun = set()
+        self._lock = threading.Lock()
+
+    def submit(self, path):
+        with self._lock:
+            # A file that changes while it is being processed is run again
+            # once the current pass finishes instead of twice in parallel.
+            if path in self._running:
+                self._rerun.add(path)
+                return
+            self._running.add(path)
+        self.executor.submit(self._process, path)
+
+    def _process(self, path):
+        try:
+            if is_stale(path):
+                self.process_file(path)
+        # Audio extraction and transcription report their own errors, so
+        # these come from captioning or the file system
+        except (APIError, OSError) as e:
+            print(f"Error processing {path}: {e}")
+        finally:
+            with self._lock:
+                self._running.discard(path)
+                rerun = path in self._rerun
+                self._rerun.discard(path)
+            if rerun:
+                self.pending.touch(path)
+
+    def process_file(self, path):
+        if is_audio(path):
+            # Only stale audio gets here, so replace the stored transcript
+            process_single_audio_file(path, overwrite=True)
+            return
+
+        output = output_path_for(path)
+        # The pipeline skips files whose output exists, so drop outdated ones.
+        if os.path.exists(output):
+            os.unlink(output)
+
+        directory, file_name = os.path.split(path)
+        ext = os.path.splitext(file_name)[1].lower()
+        if directory == "files" and ext in video_extensions:
+            extract_audio_from_mp4_ffmpeg(file_name)
+            # Chain straight into transcription rather than waiting for the
+            # audio file's own events to settle.
+            if os.path.exists(output):
+                self.submit(output)
+        else:
+            with open(path, "rb") as f:
+                caption = caption_uploaded_image(f.read())
+            with open(output, "w", encoding="utf-8") as f:
+                f.write(caption)
+            print(f"Captioned {file_name}")
+
+    def catch_up(self):
+        """Queue files that arrived while the watcher was not running."""
+        for directory in ("files", "audio"):
+            for file_name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, file_name)
+                if os.path.isfile(path) and is_stale(path):
+                    self.submit(path)
+
+    def run(self, poll_interval=0.5):
+        prepare_application()
+        observer = Observer()
+        for directory in ("files", "audio"):
+            observer.schedule(self.pending, directory, recursive=False)
+        observer.start()
+        print("Watching files/ and audio/ for new media. Press Ctrl+C to stop.")
+        self.catch_up()
+        try:
+            while True:
+                for path in self.pending.settled():
+                    self.submit(path)
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            observer.stop()
+            observer.join()
+            self.executor.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Watch the working directories and process new media."
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=2.0,
+        help="Seconds a file must stay unchanged before it is processed",
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    FolderWatcher(settle_seconds=args.settle, workers=args.workers).run()
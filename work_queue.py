@@ -0,0 +1,277 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# "sqlite:///path/to/queue.db" (the default, one host) or "memory://" (an
+# in-process stand-in for a shared multi-host backend).
+WORK_QUEUE_URL = os.getenv("WORK_QUEUE_URL", "sqlite:///work_queue.db")
+# A worker that stops heartbeating loses its jobs after this many seconds
+LEASE_SECONDS = int(os.getenv("WORK_QUEUE_LEASE_SECONDS", "300"))
+MAX_ATTEMPTS = 3
+
+
+class SQLiteQueue:
+    """Work queue with visibility leases, shared by processes on one host.
+
+    A leased job is invisible to other workers until its lease expires.
+    Workers extend the lease with `heartbeat` while they work, so a crashed
+    or stuck worker's jobs are reclaimed by the next `lease` call after
+    LEASE_SECONDS. Jobs are unique per (kind, key), so re-enqueueing the
+    same S3 listing is harmless.
+    """
+
+    def __init__(self, path="work_queue.db", lease_seconds=LEASE_SECONDS):
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        # Autocommit mode, so that BEGIN IMMEDIATE below controls locking
+        self._db = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL,
+                UNIQUE (kind, key)
+            )
+            """
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires)"
+        )
+
+    def enqueue(self, kind, key, payload):
+        """Add a job unless one for (kind, key) exists. Returns True if added."""
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO jobs (kind, key, payload, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (kind, key, json.dumps(payload), time.time()),
+            )
+        return cursor.rowcount == 1
+
+    def lease(self, worker, limit=1):
+        """Claim up to `limit` pending jobs or jobs whose lease has expired."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # A job that keeps outliving its worker is parked, not retried
+                self._db.execute(
+                    "UPDATE jobs SET status = 'failed', last_error = 'lease expired' "
+                    "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                    (now, MAX_ATTEMPTS),
+                )
+                rows = self._db.execute(
+                    "SELECT id, kind, key, payload, attempts FROM jobs "
+                    "WHERE status = 'pending' "
+                    "OR (status = 'leased' AND lease_expires < ?) "
+                    "ORDER BY id LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                for row in rows:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'leased', worker = ?, "
+                        "lease_expires = ?, attempts = attempts + 1, "
+                        "updated_at = ? WHERE id = ?",
+                        (worker, now + self.lease_seconds, now, row[0]),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return [
+            {
+                "id": job_id,
+                "kind": kind,
+                "key": key,
+                "payload": json.loads(payload),
+                "attempt": attempts + 1,
+            }
+            for job_id, kind, key, payload, attempts in rows
+        ]
+
+    def _update_owned(self, job_id, worker, assignments, values):
+        # Only the current lease holder may touch a job; after a reclaim the
+        # old worker's late updates are ignored.
+        with self._lock:
+            cursor = self._db.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                (*values, time.time(), job_id, worker),
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job_id, worker):
+        """Extend a lease. Returns False if the job was reclaimed meanwhile."""
+        return self._update_owned(
+            job_id,
+            worker,
+            "lease_expires = ?",
+            (time.time() + self.lease_seconds,),
+        )
+
+    def complete(self, job_id, worker):
+        return self._update_owned(
+            job_id, worker, "status = 'done', lease_expires = NULL", ()
+        )
+
+    def fail(self, job_id, worker, error):
+        """Release a job for another try, or park it after MAX_ATTEMPTS."""
+        return self._update_owned(
+            job_id,
+            worker,
+            "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "lease_expires = NULL, last_error = ?",
+            (MAX_ATTEMPTS, str(error)),
+        )
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+    def failed_jobs(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT key, attempts, last_error FROM jobs WHERE status = 'failed'"
+            ).fetchall()
+
+
+class MemoryQueue:
+    """In-process queue with the same interface and lease rules.
+
+    Stands in for a networked backend shared by several hosts, so workers
+    and lease handling can be exercised on one machine without one.
+    """
+
+    def __init__(self, lease_seconds=LEASE_SECONDS):
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._keys = {}
+
+    def enqueue(self, kind, key, payload):
+        with self._lock:
+            if (kind, key) in self._keys:
+                return False
+            job_id = len(self._jobs) + 1
+            self._keys[(kind, key)] = job_id
+            self._jobs[job_id] = {
+                "id": job_id,
+                "kind": kind,
+                "key": key,
+                "payload": payload,
+                "status": "pending",
+                "worker": None,
+                "lease_expires": None,
+                "attempts": 0,
+                "last_error": None,
+            }
+            return True
+
+    def lease(self, worker, limit=1):
+        now = time.time()
+        leased = []
+        with self._lock:
+            for job in self._jobs.values():
+                if len(leased) == limit:
+                    break
+                expired = job["status"] == "leased" and job["lease_expires"] < now
+                if expired and job["attempts"] >= MAX_ATTEMPTS:
+                    job.update(status="failed", last_error="lease expired")
+                    continue
+                if job["status"] == "pending" or (
+                    job["status"] == "leased" and job["lease_expires"] < now
+                ):
+                    job.update(
+                        status="leased",
+                        worker=worker,
+                        lease_expires=now + self.lease_seconds,
+                        attempts=job["attempts"] + 1,
+                    )
+                    leased.append(
+                        {
+                            "id": job["id"],
+                            "kind": job["kind"],
+                            "key": job["key"],
+                            "payload": job["payload"],
+                            "attempt": job["attempts"],
+                        }
+                    )
+        return leased
+
+    def _owned(self, job_id, worker):
+        job = self._jobs.get(job_id)
+        if job and job["worker"] == worker and job["status"] == "leased":
+            return job
+        return None
+
+    def heartbeat(self, job_id, worker):
+        with self._lock:
+            job = self._owned(job_id, worker)
+            if job:
+                job["lease_expires"] = time.time() + self.lease_seconds
+            return job is not None
+
+    def complete(self, job_id, worker):
+        with self._lock:
+            job = self._owned(job_id, worker)
+            if job:
+                job.update(status="done", lease_expires=None)
+            return job is not None
+
+    def fail(self, job_id, worker, error):
+        with self._lock:
+            job = self._owned(job_id, worker)
+            if job:
+                job.update(
+                    status="failed" if job["attempts"] >= MAX_ATTEMPTS else "pending",
+                    lease_expires=None,
+                    last_error=str(error),
+                )
+            return job is not None
+
+    def counts(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return counts
+
+    def failed_jobs(self):
+        with self._lock:
+            return [
+                (job["key"], job["attempts"], job["last_error"])
+                for job in self._jobs.values()
+                if job["status"] == "failed"
+            ]
+
+
+# Other backends plug in here: a class with the methods above, built from
+# the part of WORK_QUEUE_URL after "scheme://".
+QUEUE_BACKENDS = {
+    # sqlite:///relative.db or sqlite:////absolute/path.db
+    "sqlite": lambda location: SQLiteQueue(location[1:] or "work_queue.db"),
+    "memory": lambda location: MemoryQueue(),
+}
+
+
+def open_work_queue(url=WORK_QUEUE_URL):
+    scheme, _, location = url.partition("://")
+    if scheme not in QUEUE_BACKENDS:
+        raise ValueError(f"Unknown work queue backend: {scheme}")
+    return QUEUE_BACKENDS[scheme](location)
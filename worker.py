@@ -0,0 +1,211 @@
+import argparse
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+import uuid
+
+from boto3.exceptions import Boto3Error
+from botocore.exceptions import BotoCoreError, ClientError
+from openai import APIError
+
+from clients import get_s3_client
+from disk_manager import ensure_space, sweep_once, temp_prefix
+from download import video_extensions
+from extract_audio import (
+    PRECONDITION_AUDIO,
+    audio_extensions,
+    extract_audio_file,
+    precondition_audio,
+)
+from extract_transcript import WHISPER_EXTENSIONS
+from s3_listing import iter_s3_objects
+from transcript_formats import reproject
+from transcript_store import get_transcript_store
+from transcription_backends import get_transcription_router
+from work_queue import open_work_queue
+
+media_extensions = video_extensions + audio_extensions
+POLL_SECONDS = 5
+# What a job can fail with and be tried again: S3 and OpenAI errors, ffmpeg
+# exits, a full disk (DiskQuotaExceeded is an OSError), a deadline
+JOB_ERRORS = (
+    Boto3Error,
+    BotoCoreError,
+    ClientError,
+    APIError,
+    OSError,
+    subprocess.CalledProcessError,
+    ValueError,
+    RuntimeError,
+)
+
+
+def enqueue_bucket(queue, s3_client, bucket_name, prefix=""):
+    """Queue a transcription job for every untranscribed media file under `prefix`."""
+    store = get_transcript_store()
+    added = skipped = 0
+    for obj in iter_s3_objects(s3_client, bucket_name, prefix, media_extensions):
+        key = obj["Key"]
+        if store.has_transcript(s3_key=key):
+            skipped += 1
+            continue
+        payload = {
+            "bucket": bucket_name,
+            "key": key,
+            "etag": obj.get("ETag"),
+            "size": obj.get("Size", 0),
+        }
+        if queue.enqueue("transcribe", f"{bucket_name}/{key}", payload):
+            added += 1
+    print(f"Queued {added} files ({skipped} already transcribed)")
+    return added
+
+
+def transcribe_s3_object(s3_client, payload):
+    """Download, extract audio if needed, transcribe and store one S3 object."""
+    key = payload["key"]
+    ext = os.path.splitext(key)[1].lower()
+    # Fails the job, to be retried later, rather than filling the disk
+    ensure_space(payload.get("size", 0), tempfile.gettempdir())
+    with tempfile.TemporaryDirectory(prefix=temp_prefix()) as tmp_dir:
+        media_path = os.path.join(tmp_dir, "media" + ext)
+        s3_client.download_file(payload["bucket"], key, media_path)
+
+        audio_path = media_path
+        timestamp_map = None
+        if PRECONDITION_AUDIO:
+            audio_path = os.path.join(tmp_dir, "audio.ogg")
+            report = precondition_audio(media_path, audio_path)
+            timestamp_map = report["timestamp_map"]
+        elif ext not in WHISPER_EXTENSIONS:
+            audio_path = os.path.join(tmp_dir, "audio.mp3")
+            extract_audio_file(media_path, audio_path)
+
+        transcript = get_transcription_router().transcribe(audio_path)
+    transcript = reproject(transcript, timestamp_map)
+
+    get_transcript_store().put(
+        transcript["text"],
+        segments=transcript["segments"],
+        s3_key=key,
+        etag=payload.get("etag"),
+        title=os.path.splitext(key)[0],
+    )
+
+
+class Worker:
+    """Pulls jobs from the shared queue until it is empty or stopped.
+
+    Start as many as you like, on one host or several: each job is leased to
+    one worker at a time, and the lease is renewed from a background thread
+    while the job runs. If a worker dies its jobs become visible again once
+    their leases expire.
+    """
+
+    def __init__(self, queue, s3_client, worker_id=None, threads=4):
+        self.queue = queue
+        self.s3_client = s3_client
+        self.worker_id = worker_id or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.threads = threads
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _heartbeat(self, job, done):
+        interval = self.queue.lease_seconds / 3
+        while not done.wait(interval):
+            if not self.queue.heartbeat(job["id"], self.worker_id):
+                print(f"Lost the lease on {job['key']}")
+                return
+
+    def run_job(self, job):
+        done = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(job, done), daemon=True)
+        beat.start()
+        try:
+            transcribe_s3_object(self.s3_client, job["payload"])
+        except JOB_ERRORS as e:
+            print(f"Error processing {job['key']} (attempt {job['attempt']}): {e}")
+            self.queue.fail(job["id"], self.worker_id, e)
+            return False
+        except BaseException as e:
+            # A bug, or an interrupt: release the job, then stop this thread
+            self.queue.fail(job["id"], self.worker_id, e)
+            raise
+        finally:
+            done.set()
+            beat.join()
+        self.queue.complete(job["id"], self.worker_id)
+        print(f"Transcribed {job['key']}")
+        return True
+
+    def _loop(self, exit_when_empty):
+        while not self._stop.is_set():
+            jobs = self.queue.lease(self.worker_id)
+            if not jobs:
+                if exit_when_empty:
+                    return
+                self._stop.wait(POLL_SECONDS)
+                continue
+            for job in jobs:
+                self.run_job(job)
+
+    def run(self, exit_when_empty=False):
+        """Process jobs on `threads` threads, leasing one job at a time each."""
+        sweep_once()
+        loops = [
+            threading.Thread(target=self._loop, args=(exit_when_empty,))
+            for _ in range(self.threads)
+        ]
+        for t in loops:
+            t.start()
+        try:
+            for t in loops:
+                while t.is_alive():
+                    t.join(timeout=1)
+        except KeyboardInterrupt:
+            print("Stopping after the current jobs...")
+            self.stop()
+            for t in loops:
+                t.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Distributed transcription of an S3 bucket through a shared "
+        "work queue (WORK_QUEUE_URL)."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = commands.add_parser("enqueue", help="Queue files from S3")
+    enqueue_parser.add_argument("bucket")
+    enqueue_parser.add_argument("--prefix", default="")
+    enqueue_parser.add_argument("--anonymous", action="store_true")
+
+    run_parser = commands.add_parser("run", help="Process queued files")
+    run_parser.add_argument("--threads", type=int, default=4)
+    run_parser.add_argument("--worker-id")
+    run_parser.add_argument("--exit-when-empty", action="store_true")
+    run_parser.add_argument("--anonymous", action="store_true")
+
+    commands.add_parser("status", help="Show job counts")
+    args = parser.parse_args()
+
+    queue = open_work_queue()
+    if args.command == "enqueue":
+        enqueue_bucket(queue, get_s3_client(args.anonymous), args.bucket, args.prefix)
+    elif args.command == "run":
+        Worker(queue, get_s3_client(args.anonymous), args.worker_id, args.threads).run(
+            args.exit_when_empty
+        )
+    else:
+        print(queue.counts())
+        for key, attempts, error in queue.failed_jobs():
+            print(f"failed after {attempts} attempts: {key}: {error}")
+
+
+if __name__ == "__main__":
+    main()